@@ -1,21 +1,80 @@
 import os
 import json
+import hashlib
+import time
+import tempfile
 from datetime import datetime, date, timedelta
+from contextlib import contextmanager
 from functools import wraps
+from urllib.parse import quote
 
-from flask import Flask, render_template, redirect, url_for, request, session, abort, flash
+import click
+from flask import (Flask, render_template, redirect, url_for, request, session, abort, flash, jsonify, g,
+                   Response, stream_with_context, send_file)
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import text
+from sqlalchemy.orm import joinedload, load_only
 
 from models import db, Task, User, Project, Resource, Member, TaskDependency
+import burndown
+import gantt
+import query_budget
+import instrumentation
+import migrations
+import scheduling
+import bulk_io
+import task_batch
+import task_api
+import versions
+import portfolio
+import workload
+import wbs
+import search
+import history
+import jobs
+import packages
+import risk
+import changes
+import metrics
+from routing import project_engines, apply_sqlite_profile
 
 app = Flask(__name__)
 app.secret_key = 'dev'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-# Keep track of currently opened project directory
-current_project_path = None
+app.config['MASTER_DB_PATH'] = os.path.join(app.root_path, 'data', 'master.db')
+app.config['PROJECT_ENGINE_POOL_SIZE'] = 8
+app.config['PROJECT_ENGINE_IDLE_SECONDS'] = 600
+app.config['CHANGE_STREAM_POLL_SECONDS'] = 2
+app.config['CHANGE_STREAM_HEARTBEAT_SECONDS'] = 15
+# Streams end after this long; browsers reconnect and resume from Last-Event-ID
+app.config['CHANGE_STREAM_MAX_SECONDS'] = 300
+app.config['PORTFOLIO_WORKERS'] = 8
+app.config['PORTFOLIO_TIMEOUT_SECONDS'] = 10
+# Processes for Monte Carlo risk runs; 1 runs the chunks in-process
+app.config['RISK_WORKERS'] = 1
+app.config['JOB_WORKERS'] = 4
+# How long a write request waits for a background job on its project
+app.config['JOB_WRITE_WAIT_SECONDS'] = 5
+# Longest explicit date range /api/workload builds a matrix for
+app.config['WORKLOAD_MAX_DAYS'] = 3 * 366
+app.config['PACKAGE_DIR'] = os.path.join(app.root_path, 'data', 'packages')
+
+project_engines.max_size = app.config['PROJECT_ENGINE_POOL_SIZE']
+project_engines.idle_timeout = app.config['PROJECT_ENGINE_IDLE_SECONDS']
+# New engines are brought up to date before their first use
+project_engines.on_create = migrations.upgrade_project
+# Package files are mounted read-only in memory
+project_engines.factory = packages.engine_for
+
+# Project name -> database path, filled from the Project table on demand
+project_paths = {}
+
+# Bulk writes scale with their input and have committed by the time the
+# budget is checked, so failing them would only invite duplicate retries
+app.config['QUERY_BUDGETS'] = {'import_tasks': None, 'batch_update_tasks': None}
+query_budget.init_app(app)
+instrumentation.init_app(app)
+jobs.runner.init_app(app)
 
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
@@ -57,61 +116,103 @@ def roles_required(*roles):
 
 
 def init_db(project_name, db_path=None):
-    """Initialize databases for the given project and master data."""
+    """Register the project and bring its database and the master data up to date.
 
-    base = os.path.abspath(os.path.dirname(__file__))
-    if db_path is None:
-        projects_dir = os.path.join(base, 'data', 'projects')
-        os.makedirs(projects_dir, exist_ok=True)
-        db_path = os.path.join(projects_dir, f'{project_name}.db')
-    else:
-        os.makedirs(os.path.dirname(db_path), exist_ok=True)
-    master_path = os.path.join(base, 'data', 'master.db')
+    When ``db_path`` is omitted the registered path is used, falling back to
+    ``data/projects/<name>.db`` for new projects.
+    """
 
-    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
-    app.config['SQLALCHEMY_BINDS'] = {'users': f'sqlite:///{master_path}'}
+    base = os.path.abspath(os.path.dirname(__file__))
 
     if not getattr(app, 'db_initialized', False):
+        # Project tables are routed per request; the default bind is unused
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['SQLALCHEMY_BINDS'] = {'users': f"sqlite:///{app.config['MASTER_DB_PATH']}"}
         db.init_app(app)
+        with app.app_context():
+            apply_sqlite_profile(db.engines['users'])
         app.db_initialized = True
 
     with app.app_context():
-        db.create_all()
-
-        engine = db.get_engine()
-        with engine.connect() as conn:
-            cols = [c[1] for c in conn.execute(text("PRAGMA table_info(tasks)")).fetchall()]
-        if 'remarks' not in cols:
-            with engine.begin() as conn:
-                conn.execute(text('ALTER TABLE tasks ADD COLUMN remarks TEXT'))
-        if 'parent_id' not in cols:
-            with engine.begin() as conn:
-                conn.execute(text('ALTER TABLE tasks ADD COLUMN parent_id INTEGER'))
-        if 'assignee_id' not in cols:
-            with engine.begin() as conn:
-                conn.execute(text('ALTER TABLE tasks ADD COLUMN assignee_id INTEGER'))
-
-        user_engine = db.get_engine(bind_key='users')
-        with user_engine.connect() as conn:
-            ucols = [c[1] for c in conn.execute(text("PRAGMA table_info(user)")).fetchall()]
-        if 'role' not in ucols:
-            with user_engine.begin() as conn:
-                conn.execute(text("ALTER TABLE user ADD COLUMN role VARCHAR DEFAULT 'Viewer'"))
-                conn.execute(text("UPDATE user SET role='Viewer'"))
-
-        if not Project.query.filter_by(name=project_name).first():
-            project = Project(name=project_name, path=db_path)
-            db.session.add(project)
-
+        # The master database does not change between project switches
+        if not getattr(app, 'master_migrated', False):
+            migrations.upgrade_master(db.engines['users'])
+            jobs.runner.recover()
+            app.master_migrated = True
+
+        project = Project.query.filter_by(name=project_name).first()
+        if db_path is None:
+            if project:
+                db_path = project.path
+            else:
+                projects_dir = os.path.join(base, 'data', 'projects')
+                os.makedirs(projects_dir, exist_ok=True)
+                db_path = os.path.join(projects_dir, f'{project_name}.db')
+        else:
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+        # Creating the engine runs any pending migrations
+        project_engines.get(db_path)
+
+        if not project:
+            db.session.add(Project(name=project_name, path=db_path))
+        elif project.path != db_path:
+            project.path = db_path
         db.session.commit()
 
+    project_paths[project_name] = db_path
+    return db_path
+
+
+@contextmanager
+def project_context(project_name):
+    """App context routed to ``project_name``, for CLI commands."""
+    db_path = init_db(project_name)
+    with app.app_context():
+        g.project_path = db_path
+        yield db_path
+
+
+def project_db_path(project_name):
+    """Database path registered for ``project_name``, or None if unknown."""
+    path = project_paths.get(project_name)
+    if path is None:
+        project = Project.query.filter_by(name=project_name).first()
+        if project:
+            path = project_paths[project_name] = project.path
+    return path
+
 
 @app.before_request
 def load_project():
     project = session.get('project')
-    allowed = ('select_project', 'create_project', 'new_project', 'open_project', 'login', 'setup', 'static')
+    if project and getattr(app, 'db_initialized', False):
+        g.project_path = project_db_path(project)
+        if g.project_path is None:
+            session.pop('project')
+            project = None
+    allowed = ('select_project', 'create_project', 'new_project', 'open_project', 'login', 'setup', 'static',
+               'portfolio_view', 'portfolio_data', 'prometheus_metrics',
+               'job_view', 'job_status', 'job_list', 'cancel_job', 'open_job_project', 'download_package')
     if not project and request.endpoint not in allowed:
         return redirect(url_for('select_project'))
+    # Mounted packages are read-only
+    if project and packages.is_package(g.get('project_path')) \
+            and request.method not in ('GET', 'HEAD') and request.endpoint not in allowed:
+        abort(403)
+    # Writes to the project wait for its running background job, if any
+    if project and request.method not in ('GET', 'HEAD') and request.endpoint not in allowed:
+        lock = jobs.runner.writer_lock(g.project_path)
+        if not lock.acquire(timeout=app.config['JOB_WRITE_WAIT_SECONDS']):
+            abort(409, 'A background job is updating this project.')
+        g.writer_lock = lock
+
+
+@app.teardown_request
+def release_writer_lock(exc):
+    lock = g.pop('writer_lock', None)
+    if lock is not None:
+        lock.release()
 
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -169,25 +270,33 @@ def new_project():
     """Create a new project folder with sqlite db and json."""
     if request.method == 'POST':
         proj_name = request.form['project_name']
-        save_dir = request.form['save_path']
-        project_dir = os.path.join(save_dir, proj_name)
-        os.makedirs(project_dir, exist_ok=True)
-        proj_info = {"name": proj_name, "db_file": "db.sqlite3"}
-        with open(os.path.join(project_dir, 'project.json'), 'w', encoding='utf-8') as f:
-            json.dump(proj_info, f, ensure_ascii=False, indent=4)
-        db_path = os.path.join(project_dir, 'db.sqlite3')
-        init_db(proj_name, db_path)
-        global current_project_path
-        current_project_path = project_dir
-        session['project'] = proj_name
-        flash(f"New project '{proj_name}' created at {project_dir}", 'success')
-        return redirect(url_for('dashboard'))
+        project_dir = os.path.join(request.form['save_path'], proj_name)
+        job_id = jobs.runner.submit('create_project', os.path.join(project_dir, 'db.sqlite3'),
+                                    {'name': proj_name, 'project_dir': project_dir},
+                                    user_id=current_user.id)
+        return redirect(url_for('job_view', job_id=job_id,
+                                next=url_for('open_job_project', job_id=job_id)))
     return render_template('new_project.html')
 
 
+@jobs.job('create_project')
+def create_project_job(ctx, name, project_dir):
+    """Create the project folder, its project.json and a fully migrated database."""
+    os.makedirs(project_dir, exist_ok=True)
+    proj_info = {"name": name, "db_file": "db.sqlite3"}
+    with open(os.path.join(project_dir, 'project.json'), 'w', encoding='utf-8') as f:
+        json.dump(proj_info, f, ensure_ascii=False, indent=4)
+    ctx.progress(10, 'データベースを作成しています')
+    init_db(name, os.path.join(project_dir, 'db.sqlite3'))
+    return {'name': name, 'project_dir': project_dir}
+
+
 @app.route('/project/open', methods=['GET', 'POST'])
 @login_required
 def open_project():
+    if request.method == 'POST' and request.form.get('package_path'):
+        return open_package(request.form['package_path'].strip(), request.form.get('mode', 'extract'),
+                            request.form.get('project_name', '').strip())
     if request.method == 'POST':
         file = request.files.get('project_file')
         if file:
@@ -196,8 +305,6 @@ def open_project():
             db_path = os.path.join(proj_dir, proj_info.get('db_file', 'db.sqlite3'))
             if os.path.exists(db_path):
                 init_db(proj_info.get('name'), db_path)
-                global current_project_path
-                current_project_path = proj_dir
                 session['project'] = proj_info.get('name')
                 flash(f"Project '{proj_info.get('name')}' opened.", 'info')
                 return redirect(url_for('dashboard'))
@@ -207,6 +314,62 @@ def open_project():
     return render_template('open_project.html')
 
 
+def open_package(path, mode, name):
+    """Open a package: extract it into data/projects, or mount it read-only."""
+    try:
+        manifest = packages.read_manifest(path)
+    except packages.PackageError as e:
+        flash(f'Cannot open package: {e}', 'danger')
+        return redirect(url_for('open_project'))
+    name = name or manifest['name']
+    if mode == 'mount':
+        try:
+            init_db(name, os.path.abspath(path))
+        except packages.PackageError as e:
+            flash(f'Cannot open package: {e}', 'danger')
+            return redirect(url_for('open_project'))
+        session['project'] = name
+        flash(f"Project '{name}' opened read-only from {path}.", 'info')
+        return redirect(url_for('dashboard'))
+    target = os.path.join(app.root_path, 'data', 'projects', f'{name}.db')
+    if os.path.exists(target):
+        flash(f'{target} already exists.', 'danger')
+        return redirect(url_for('open_project'))
+    job_id = jobs.runner.submit('extract_package', target, {'path': os.path.abspath(path), 'name': name},
+                                user_id=current_user.id)
+    return redirect(url_for('job_view', job_id=job_id, next=url_for('open_job_project', job_id=job_id)))
+
+
+@jobs.job('extract_package')
+def extract_package_job(ctx, path, name):
+    ctx.progress(0, 'パッケージを展開しています')
+    manifest = packages.extract(path, g.project_path)
+    ctx.progress(90, 'データベースを更新しています')
+    init_db(name, g.project_path)
+    return {'name': name, 'tasks': manifest['tasks']}
+
+
+@app.route('/project/package', methods=['POST'])
+@login_required
+@roles_required('Admin', 'Editor')
+def package_project():
+    """Snapshot the current project into a package and offer it for download."""
+    name = session['project']
+    output = os.path.join(app.config['PACKAGE_DIR'],
+                          f"{name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}{packages.PACKAGE_SUFFIX}")
+    job_id = jobs.runner.submit('package_project', g.project_path, {'name': name, 'output': output},
+                                user_id=current_user.id)
+    return redirect(url_for('job_view', job_id=job_id, next=url_for('download_package', job_id=job_id)))
+
+
+@jobs.job('package_project')
+def package_project_job(ctx, name, output):
+    ctx.progress(0, 'スナップショットを作成しています')
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    manifest = packages.create(g.project_path, output, name)
+    return {'path': output, 'tasks': manifest['tasks'], 'size': os.path.getsize(output)}
+
+
 @app.route('/resources')
 @login_required
 @roles_required('Admin', 'Editor')
@@ -253,7 +416,9 @@ def edit_member(member_id):
 def delete_member(member_id):
     member = Member.query.get_or_404(member_id)
     db.session.delete(member)
+    assigned = [i for (i,) in db.session.query(Task.id).filter_by(assignee_id=member.id)]
     Task.query.filter_by(assignee_id=member.id).update({'assignee_id': None})
+    changes.record('task', assigned)
     db.session.commit()
     flash(f"メンバー「{member.name}」を削除しました。", 'info')
     return redirect(url_for('members'))
@@ -307,12 +472,22 @@ def delete_resource(resource_id):
 @login_required
 def index():
     """Project overview metrics."""
-    tasks = Task.query.all()
-    total = len(tasks)
-    completed = sum(1 for t in tasks if t.progress == 100)
-    avg_progress = int(sum(t.progress for t in tasks) / total) if total else 0
-    return render_template('index.html', total=total, completed=completed,
-                           avg_progress=avg_progress)
+    return render_template('index.html', remaining_by_date=cached_burndown(),
+                           actual_by_date=metrics.cached('actual_burndown', actual_burndown),
+                           **metrics.summary())
+
+
+def cached_burndown():
+    return metrics.cached('burndown', lambda: burndown.remaining_by_date(bucket='auto'))
+
+
+def actual_burndown():
+    """Recorded open-task counts over the planned burndown's range and buckets."""
+    start, end = burndown.project_span()
+    if start is None:
+        return {}
+    series = history.actual_burndown(start, min(end, date.today()), burndown.pick_bucket(start, end))
+    return {p['date']: p['remaining'] for p in series if p['remaining'] is not None}
 
 
 @app.route('/tasks', methods=['GET', 'POST'])
@@ -337,34 +512,152 @@ def tasks():
                     remarks=remarks, progress=progress,
                     assignee_id=assignee_id, parent_id=parent_id)
         db.session.add(task)
-        db.session.commit()
-        predecessors = request.form.getlist('predecessors')
+        db.session.flush()
+        predecessors = parse_predecessors(request.form.getlist('predecessors'), task.id)
         for pid in predecessors:
-            try:
-                pid = int(pid)
-            except ValueError:
-                continue
-            if pid and pid != task.id:
-                db.session.add(TaskDependency(predecessor_id=pid, successor_id=task.id))
+            db.session.add(TaskDependency(predecessor_id=pid, successor_id=task.id))
+        scheduling.task_changed(task, predecessors)
         db.session.commit()
         flash(f"New task '{name}' added.", 'success')
         return redirect(url_for('tasks'))
 
-    tasks = Task.query.order_by(Task.start_date).all()
+    tasks = Task.query.options(joinedload(Task.assignee)).order_by(Task.start_date).all()
     members = Member.query.all()
-    deps = TaskDependency.query.all()
     current_date = date.today()
-    day = timedelta(days=1)
     return render_template(
         'tasks.html',
         tasks=tasks,
         members=members,
-        deps=deps,
+        predecessors=predecessor_map(),
+        depths=wbs.depths(),
         current_date=current_date,
-        day=day,
     )
 
 
+def parse_predecessors(values, task_id=None):
+    """Convert submitted predecessor ids to ints, skipping blanks and self links."""
+    ids = []
+    for pid in values:
+        try:
+            pid = int(pid)
+        except (TypeError, ValueError):
+            continue
+        if pid and pid != task_id and pid not in ids:
+            ids.append(pid)
+    return ids
+
+
+def predecessor_map():
+    """Map each successor task id to ``(id, name)`` of its predecessors in one query."""
+    preds = {}
+    rows = (db.session.query(TaskDependency.successor_id, Task.id, Task.name)
+            .join(Task, Task.id == TaskDependency.predecessor_id)
+            .order_by(TaskDependency.id))
+    for successor_id, pred_id, name in rows:
+        preds.setdefault(successor_id, []).append((pred_id, name))
+    return preds
+
+
+@app.route('/api/gantt')
+@login_required
+def gantt_data():
+    """Precomputed Gantt layout for a block of rows."""
+    row_start = request.args.get('row_start', 0, type=int)
+    row_count = min(request.args.get('row_count', gantt.BLOCK_SIZE, type=int), 1000)
+    return jsonify(gantt.window(metrics.cached('gantt_layout', gantt_layout), row_start, row_count))
+
+
+def gantt_layout():
+    try:
+        critical = scheduling.get_schedule().critical_tasks()
+    except scheduling.CycleError:
+        critical = set()
+    return gantt.build_layout(critical=critical)
+
+
+@app.route('/api/schedule')
+@login_required
+def schedule_data():
+    """Critical path analysis for the current project."""
+    try:
+        return jsonify(scheduling.get_schedule().as_dict())
+    except scheduling.CycleError as e:
+        return {'status': 'error', 'message': str(e), 'cycle': e.cycle}, 409
+
+
+@app.route('/tasks/import', methods=['POST'])
+@login_required
+@roles_required('Admin', 'Editor')
+def import_tasks():
+    """Bulk import tasks from an uploaded CSV or JSON Lines file."""
+    file = request.files.get('file')
+    fmt = request.form.get('format') or (bulk_io.format_for(file.filename) if file else None)
+    if not file or fmt not in bulk_io.FORMATS:
+        abort(400)
+    browser = request.accept_mimetypes.best_match(['application/json', 'text/html']) == 'text/html'
+    if browser or request.args.get('async') == '1':
+        # Large files are imported by a background job the client polls
+        fd, path = tempfile.mkstemp(suffix=f'.{fmt}')
+        with os.fdopen(fd, 'wb') as f:
+            file.save(f)
+        job_id = jobs.runner.submit('import_tasks', g.project_path, {'path': path, 'fmt': fmt},
+                                    user_id=current_user.id)
+        if browser:
+            return redirect(url_for('job_view', job_id=job_id, next=url_for('tasks')))
+        return {'status': 'queued', 'job': job_id,
+                'status_url': url_for('job_status', job_id=job_id)}, 202
+    try:
+        counts = bulk_io.import_tasks(bulk_io.read_records(file.stream, fmt))
+        db.session.commit()
+    except bulk_io.ImportFailed as e:
+        db.session.rollback()
+        if browser:
+            flash(f'Import failed: {e}', 'danger')
+            return redirect(url_for('tasks'))
+        return {'status': 'error', 'message': str(e), 'line': e.line}, 400
+    scheduling.invalidate()
+    if browser:
+        flash(f"{counts['tasks']} tasks imported.", 'success')
+        return redirect(url_for('tasks'))
+    return {'status': 'ok', **counts}
+
+
+@jobs.job('import_tasks')
+def import_tasks_job(ctx, path, fmt):
+    """Import an uploaded file saved at ``path``; the file is removed afterwards."""
+    try:
+        with open(path, 'rb') as f:
+            total = max(sum(1 for _ in f), 1)
+
+        def records(stream):
+            for line, record in bulk_io.read_records(stream, fmt):
+                if line % 1000 == 0:
+                    ctx.progress(line * 90 // total, f'{line} 行目を読み込み中')
+                yield line, record
+
+        with open(path, 'rb') as f:
+            counts = bulk_io.import_tasks(records(f))
+        ctx.check_cancelled()
+        db.session.commit()
+    finally:
+        os.remove(path)
+    scheduling.invalidate()
+    return counts
+
+
+@app.route('/tasks/export')
+@login_required
+def export_tasks():
+    """Stream all tasks as CSV or JSON Lines."""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in bulk_io.FORMATS:
+        abort(400)
+    filename = quote(f"{session['project']}.{fmt}")
+    return Response(stream_with_context(bulk_io.export_lines(fmt)),
+                    mimetype=bulk_io.FORMATS[fmt],
+                    headers={'Content-Disposition': f"attachment; filename*=UTF-8''{filename}"})
+
+
 @app.route('/task/add', methods=['GET', 'POST'])
 @login_required
 @roles_required('Admin', 'Editor')
@@ -389,10 +682,12 @@ def add_task():
             is_milestone=is_milestone,
         )
         db.session.add(task)
+        db.session.flush()
+        scheduling.task_changed(task, [])
         db.session.commit()
         flash('Task added', 'success')
         return redirect(url_for('tasks'))
-    tasks = Task.query.all()
+    tasks = Task.query.options(load_only(Task.id, Task.name)).all()
     members = Member.query.all()
     return render_template('form.html', task=None, tasks=tasks, members=members)
 
@@ -404,6 +699,12 @@ def edit_task(task_id):
     if current_user.role == 'Viewer':
         abort(403)
     if request.method == 'POST':
+        predecessors = parse_predecessors(request.form.getlist('predecessors'), task.id)
+        try:
+            scheduling.check_predecessors(task.id, predecessors)
+        except scheduling.CycleError as e:
+            flash(f'Dependency cycle: {e}', 'danger')
+            return redirect(url_for('edit_task', task_id=task.id))
         task.name = request.form['name']
         task.start_date = datetime.strptime(request.form['start_date'], '%Y-%m-%d').date()
         task.end_date = datetime.strptime(request.form['end_date'], '%Y-%m-%d').date()
@@ -414,23 +715,26 @@ def edit_task(task_id):
         task.is_milestone = 'is_milestone' in request.form
         if task.is_milestone:
             task.end_date = task.start_date
-        db.session.commit()
-        TaskDependency.query.filter_by(successor_id=task.id).delete()
-        predecessors = request.form.getlist('predecessors')
+        # Task fields, dependencies and moved successors commit together
+        if TaskDependency.query.filter_by(successor_id=task.id).delete():
+            # The bulk delete bypasses the change log's flush hook
+            changes.record('task', [task.id])
         for pid in predecessors:
-            try:
-                pid = int(pid)
-            except ValueError:
-                continue
-            if pid and pid != task.id:
-                db.session.add(TaskDependency(predecessor_id=pid, successor_id=task.id))
+            db.session.add(TaskDependency(predecessor_id=pid, successor_id=task.id))
+        db.session.flush()
+        scheduling.task_changed(task, predecessors)
+        moved = scheduling.propagate(task.id) if 'propagate' in request.form else []
         db.session.commit()
         flash('Task updated', 'success')
+        if moved:
+            flash(f'{len(moved)} successor task(s) rescheduled', 'info')
         return redirect(url_for('tasks'))
-    tasks = Task.query.filter(Task.id != task_id).all()
+    tasks = Task.query.options(load_only(Task.id, Task.name)).filter(Task.id != task_id).all()
     members = Member.query.all()
-    deps = TaskDependency.query.all()
-    return render_template('form.html', task=task, tasks=tasks, members=members, deps=deps)
+    predecessor_ids = {pid for (pid,) in db.session.query(TaskDependency.predecessor_id)
+                       .filter_by(successor_id=task_id)}
+    return render_template('form.html', task=task, tasks=tasks, members=members,
+                           predecessor_ids=predecessor_ids)
 
 
 @app.route('/task/<int:task_id>/delete', methods=['POST'])
@@ -439,9 +743,12 @@ def delete_task(task_id):
     if current_user.role not in ['Admin', 'Editor']:
         abort(403)
     task = Task.query.get_or_404(task_id)
+    successors = [i for (i,) in db.session.query(TaskDependency.successor_id).filter_by(predecessor_id=task.id)]
     TaskDependency.query.filter((TaskDependency.predecessor_id == task.id) | (TaskDependency.successor_id == task.id)).delete()
+    changes.record('task', successors)
     db.session.delete(task)
     db.session.commit()
+    scheduling.invalidate()
     flash('Task deleted', 'success')
     return redirect(url_for('tasks'))
 
@@ -453,6 +760,11 @@ def update_task():
     data = request.get_json()
     task_id = data.get('id')
     task = Task.query.get_or_404(task_id)
+    predecessors = parse_predecessors(data.get('predecessors', []), task.id)
+    try:
+        scheduling.check_predecessors(task.id, predecessors)
+    except scheduling.CycleError as e:
+        return {'status': 'error', 'message': str(e)}, 400
     task.name = data.get('name', task.name)
     task.start_date = datetime.strptime(data.get('start_date'), '%Y-%m-%d').date()
     task.end_date = datetime.strptime(data.get('end_date'), '%Y-%m-%d').date()
@@ -463,46 +775,492 @@ def update_task():
     task.is_milestone = data.get('is_milestone', False)
     if task.is_milestone:
         task.end_date = task.start_date
-    TaskDependency.query.filter_by(successor_id=task.id).delete()
-    for pid in data.get('predecessors', []):
-        try:
-            pid = int(pid)
-        except (TypeError, ValueError):
-            continue
-        if pid and pid != task.id:
-            db.session.add(TaskDependency(predecessor_id=pid, successor_id=task.id))
+    task_batch.sync_predecessors({task.id: set(predecessors)})
+    db.session.flush()
+    scheduling.task_changed(task, predecessors)
+    # Optionally push successors after a slip, in the same transaction
+    moved = scheduling.propagate(task.id) if data.get('propagate') else []
     db.session.commit()
-    return {'status': 'ok'}
+    return {'status': 'ok', 'moved': moved}
+
+
+@app.route('/api/tasks')
+@login_required
+def task_list_api():
+    """Filtered, keyset-paginated tasks with ETag support."""
+    args = request.args
+    status = args.get('status')
+    if status and status not in task_api.STATUSES:
+        abort(400)
+    try:
+        after = task_api.decode_cursor(args['after']) if args.get('after') else None
+        start = burndown.parse_date(args.get('start'))
+        end = burndown.parse_date(args.get('end'))
+    except ValueError:
+        abort(400)
+    limit = min(max(args.get('limit', task_api.DEFAULT_LIMIT, type=int), 1), task_api.MAX_LIMIT)
+
+    # Status filters depend on today's date, so it is part of the validator
+    version = versions.project_version()
+    key = repr((g.get('project_path'), date.today(), sorted(args.items(multi=True))))
+    etag = f"{version}-{hashlib.sha1(key.encode()).hexdigest()[:12]}"
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+
+    tasks, next_cursor = task_api.query_tasks(
+        assignee_id=args.get('assignee_id', type=int), parent_id=args.get('parent_id', type=int),
+        start=start, end=end, status=status, after=after, limit=limit)
+    response = jsonify({'tasks': task_api.serialize(tasks), 'next': next_cursor, 'version': version})
+    response.set_etag(etag, weak=True)
+    return response
+
+
+@app.route('/changes')
+@login_required
+def change_feed():
+    """Compact deltas since a cursor; without one, just the current cursor."""
+    since = request.args.get('since', type=int)
+    if since is None:
+        return {'cursor': changes.latest_cursor(), 'changes': [], 'more': False, 'reset': False}
+    return jsonify(changes.read_changes(since))
+
+
+@app.route('/changes/stream')
+@login_required
+def change_stream():
+    """Server-sent events carrying the change feed."""
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', type=int)
+    if since is None:
+        since = changes.latest_cursor()
+    poll = app.config['CHANGE_STREAM_POLL_SECONDS']
+    heartbeat = app.config['CHANGE_STREAM_HEARTBEAT_SECONDS']
+    deadline = time.monotonic() + app.config['CHANGE_STREAM_MAX_SECONDS']
+
+    def events(cursor):
+        # The id makes a reconnect resume here even if no change arrives first
+        yield f'retry: 3000\nid: {cursor}\n\n'
+        idle = 0
+        while time.monotonic() < deadline:
+            feed = changes.read_changes(cursor)
+            # End the read transaction so the next poll sees new commits
+            db.session.commit()
+            if feed['changes'] or feed['reset']:
+                cursor = feed['cursor']
+                yield f"id: {cursor}\nevent: changes\ndata: {json.dumps(feed, ensure_ascii=False)}\n\n"
+                idle = 0
+                if feed['more']:
+                    continue
+            elif idle >= heartbeat:
+                yield ': keepalive\n\n'
+                idle = 0
+            time.sleep(poll)
+            idle += poll
+
+    return Response(stream_with_context(events(since)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/tasks/batch', methods=['POST'])
+@login_required
+@roles_required('Admin', 'Editor')
+def batch_update_tasks():
+    """Apply many task patches in one transaction."""
+    data = request.get_json(silent=True) or {}
+    patches = data.get('tasks')
+    if not isinstance(patches, list) or len(patches) > task_batch.MAX_BATCH:
+        abort(400)
+    ok, results = task_batch.apply_batch(patches)
+    if not ok:
+        db.session.rollback()
+        return {'status': 'error', 'results': results}, 400
+    db.session.commit()
+    return {'status': 'ok', 'results': results}
 
 
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    tasks = Task.query.all()
-    total_tasks = len(tasks)
-    completed_tasks = sum(1 for t in tasks if t.progress == 100)
-    overdue_tasks = sum(1 for t in tasks if t.progress < 100 and t.end_date < date.today())
-    progress_rate = int(completed_tasks / total_tasks * 100) if total_tasks else 0
-
-    remaining_by_date = []
-    if total_tasks:
-        start_date = min(t.start_date for t in tasks)
-        end_date = max(t.end_date for t in tasks)
-        cur_date = start_date
-        while cur_date <= end_date:
-            remaining = sum(1 for t in tasks if t.progress < 100 and t.end_date >= cur_date)
-            remaining_by_date.append({"date": cur_date.strftime("%Y-%m-%d"), "remaining": remaining})
-            cur_date += timedelta(days=1)
-
-    return render_template('index.html', **{
-        "total_tasks": total_tasks,
-        "completed_tasks": completed_tasks,
-        "overdue_tasks": overdue_tasks,
-        "progress_rate": progress_rate,
-        "remaining_by_date": remaining_by_date
+    return render_template('index.html', remaining_by_date=cached_burndown(),
+                           actual_by_date=metrics.cached('actual_burndown', actual_burndown),
+                           **metrics.summary())
+
+
+def portfolio_summaries():
+    projects = [(p.name, p.path) for p in Project.query.order_by(Project.name)]
+    return portfolio.collect(projects, workers=app.config['PORTFOLIO_WORKERS'],
+                             timeout=app.config['PORTFOLIO_TIMEOUT_SECONDS'])
+
+
+@app.route('/portfolio')
+@login_required
+@roles_required('Admin', 'Editor')
+def portfolio_view():
+    """Summary of every registered project."""
+    summaries = portfolio_summaries()
+    return render_template('portfolio.html', projects=summaries, totals=portfolio.totals(summaries))
+
+
+@app.route('/api/portfolio')
+@login_required
+@roles_required('Admin', 'Editor')
+def portfolio_data():
+    bucket = request.args.get('bucket', 'auto')
+    if bucket not in burndown.BUCKETS and bucket != 'auto':
+        abort(400)
+    summaries = portfolio_summaries()
+    totals = portfolio.totals(summaries, bucket)
+    projects = [{k: v for k, v in s.items() if k != 'open_by_end'} for s in summaries]
+    return jsonify({'totals': totals, 'projects': projects})
+
+
+@app.route('/workload')
+@login_required
+def workload_view():
+    """Heatmap of booked load per member or resource."""
+    by = request.args.get('by', 'member')
+    if by not in workload.OWNERS:
+        abort(400)
+    return render_template('workload.html', by=by)
+
+
+@app.route('/api/workload')
+@login_required
+def workload_data():
+    """Load matrix and over-allocated intervals, optionally limited to a date range."""
+    by = request.args.get('by', 'member')
+    if by not in workload.OWNERS:
+        abort(400)
+    try:
+        start = burndown.parse_date(request.args.get('start'))
+        end = burndown.parse_date(request.args.get('end'))
+    except ValueError:
+        abort(400)
+    # The matrix has a column per day, so its span is capped
+    max_days = app.config['WORKLOAD_MAX_DAYS']
+    span_start, span_end = burndown.project_span()
+    first, last = start or span_start, end or span_end
+    if first and last and (last - first).days >= max_days:
+        if start or end:
+            abort(400)
+        # Default view of a long project: the window around today
+        first = max(date.today() - timedelta(days=max_days // 2), first)
+        first = min(first, last - timedelta(days=max_days - 1))
+        last = first + timedelta(days=max_days - 1)
+    return jsonify(workload.heatmap(by, first, last))
+
+
+@app.route('/wbs')
+@login_required
+def wbs_view():
+    """Task hierarchy with rolled-up dates and progress."""
+    return render_template('wbs.html', rows=wbs.tree(), current_date=date.today())
+
+
+@app.route('/api/wbs')
+@login_required
+def wbs_data():
+    return jsonify([{
+        'id': task.id,
+        'name': task.name,
+        'parent_id': task.parent_id,
+        'depth': depth,
+        'start_date': rollup.start_date.isoformat(),
+        'end_date': rollup.end_date.isoformat(),
+        'progress': rollup.progress,
+        'work_days': rollup.work,
+    } for task, depth, rollup in wbs.tree()])
+
+
+def search_args():
+    """``(query, limit, offset)`` from the request; aborts on bad paging values."""
+    query = request.args.get('q', '').strip()
+    try:
+        limit = min(int(request.args.get('limit', search.DEFAULT_LIMIT)), search.MAX_LIMIT)
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        abort(400)
+    if limit < 1 or offset < 0:
+        abort(400)
+    return query, limit, offset
+
+
+@app.route('/search')
+@login_required
+def search_view():
+    """Ranked full-text search over task names and remarks."""
+    query, limit, offset = search_args()
+    results, more = search.search(query, limit, offset)
+    return render_template('search.html', query=query, results=results, more=more,
+                           limit=limit, offset=offset)
+
+
+@app.route('/api/search')
+@login_required
+def search_data():
+    query, limit, offset = search_args()
+    results, more = search.search(query, limit, offset)
+    return jsonify({
+        'query': query,
+        'results': [dict(r, name_html=str(r['name_html']), remarks_html=str(r['remarks_html']))
+                    for r in results],
+        'next_offset': offset + limit if more else None,
     })
 
 
+def risk_args():
+    """Simulation parameters from the request; aborts on bad values."""
+    try:
+        samples = int(request.args.get('samples', risk.DEFAULT_SAMPLES))
+        optimistic = float(request.args.get('optimistic', 0.9))
+        pessimistic = float(request.args.get('pessimistic', 1.5))
+        seed = int(request.args.get('seed', 0))
+    except ValueError:
+        abort(400)
+    distribution = request.args.get('distribution', 'pert')
+    if not 1 <= samples <= risk.MAX_SAMPLES or distribution not in risk.DISTRIBUTIONS \
+            or not 0 < optimistic <= 1 <= pessimistic or seed < 0:
+        abort(400)
+    return {'samples': samples, 'distribution': distribution, 'optimistic': optimistic,
+            'pessimistic': pessimistic, 'seed': seed}
+
+
+@app.route('/risk')
+@login_required
+def risk_view():
+    """Monte Carlo finish date distribution and task criticality."""
+    return render_template('risk.html', params=risk_args(), distributions=risk.DISTRIBUTIONS)
+
+
+@app.route('/api/risk')
+@login_required
+def risk_data():
+    try:
+        return jsonify(risk.analyze(workers=app.config['RISK_WORKERS'], **risk_args()))
+    except scheduling.CycleError as e:
+        return {'status': 'error', 'message': str(e), 'cycle': e.cycle}, 409
+
+
+@app.route('/metrics')
+@login_required
+@roles_required('Admin')
+def prometheus_metrics():
+    """Request and SQL timing in the Prometheus text format."""
+    return Response(instrumentation.render(), mimetype='text/plain; version=0.0.4')
+
+
+def get_job(job_id):
+    """The job row, if it exists and belongs to the current user (Admins see all)."""
+    row = jobs.runner.get(job_id)
+    if row is None or (row.user_id != current_user.id and current_user.role != 'Admin'):
+        abort(404)
+    return row
+
+
+@app.route('/jobs/<int:job_id>')
+@login_required
+def job_view(job_id):
+    """Progress page that polls the job and moves on to ``next`` when it succeeds."""
+    row = get_job(job_id)
+    next_url = request.args.get('next', '')
+    # Only same-site paths, never another host
+    if not next_url.startswith('/') or next_url.startswith('//'):
+        next_url = ''
+    return render_template('job.html', job=jobs.as_dict(row), next=next_url)
+
+
+@app.route('/jobs/<int:job_id>/open')
+@login_required
+def open_job_project(job_id):
+    """Switch to the project a finished ``create_project`` or ``extract_package`` job opened."""
+    job = jobs.as_dict(get_job(job_id))
+    if job['kind'] not in ('create_project', 'extract_package') or job['status'] != jobs.SUCCEEDED:
+        abort(404)
+    session['project'] = job['result']['name']
+    if job['kind'] == 'create_project':
+        flash(f"New project '{job['result']['name']}' created at {job['result']['project_dir']}", 'success')
+    else:
+        flash(f"Project '{job['result']['name']}' opened from package.", 'info')
+    return redirect(url_for('dashboard'))
+
+
+@app.route('/jobs/<int:job_id>/package')
+@login_required
+def download_package(job_id):
+    """Download the archive a finished ``package_project`` job wrote."""
+    job = jobs.as_dict(get_job(job_id))
+    if job['kind'] != 'package_project' or job['status'] != jobs.SUCCEEDED \
+            or not os.path.exists(job['result']['path']):
+        abort(404)
+    return send_file(job['result']['path'], as_attachment=True,
+                     download_name=os.path.basename(job['result']['path']))
+
+
+@app.route('/api/jobs')
+@login_required
+def job_list():
+    user_id = None if current_user.role == 'Admin' else current_user.id
+    return jsonify([jobs.as_dict(row) for row in jobs.runner.recent(user_id)])
+
+
+@app.route('/api/jobs/<int:job_id>')
+@login_required
+def job_status(job_id):
+    return jsonify(jobs.as_dict(get_job(job_id)))
+
+
+@app.route('/api/jobs/<int:job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    get_job(job_id)
+    if not jobs.runner.cancel(job_id):
+        return {'status': 'error', 'message': 'job already finished'}, 409
+    return jsonify(jobs.as_dict(jobs.runner.get(job_id)))
+
+
+@app.route('/api/burndown')
+@login_required
+def burndown_data():
+    """Burndown series as JSON, optionally limited to a date range and bucketed."""
+    bucket = request.args.get('bucket', 'day')
+    if bucket not in burndown.BUCKETS and bucket != 'auto':
+        abort(400)
+    try:
+        start = burndown.parse_date(request.args.get('start'))
+        end = burndown.parse_date(request.args.get('end'))
+    except ValueError:
+        abort(400)
+    return jsonify(burndown.remaining_by_date(start, end, bucket))
+
+
+@app.route('/api/burndown/actual')
+@login_required
+def actual_burndown_data():
+    """Recorded burndown: open tasks and remaining work as they were each day."""
+    bucket = request.args.get('bucket', 'day')
+    if bucket not in burndown.BUCKETS and bucket != 'auto':
+        abort(400)
+    try:
+        start = burndown.parse_date(request.args.get('start'))
+        end = burndown.parse_date(request.args.get('end'))
+    except ValueError:
+        abort(400)
+    return jsonify(history.actual_burndown(start, end, bucket))
+
+
+@app.route('/api/velocity')
+@login_required
+def velocity_data():
+    """Tasks completed and progress made per bucket (default: week)."""
+    bucket = request.args.get('bucket', 'week')
+    if bucket not in burndown.BUCKETS:
+        abort(400)
+    try:
+        start = burndown.parse_date(request.args.get('start'))
+        end = burndown.parse_date(request.args.get('end'))
+    except ValueError:
+        abort(400)
+    return jsonify(history.velocity(start, end, bucket))
+
+
+@app.cli.command('migrate-projects')
+@click.option('--workers', default=4, show_default=True, help='Number of parallel workers.')
+def migrate_projects(workers):
+    """Upgrade every project database listed in the Project table."""
+    if not getattr(app, 'db_initialized', False):
+        init_db('project1')
+    with app.app_context():
+        paths = [p.path for p in Project.query.order_by(Project.name).all()]
+    # Packages are read-only archives; they are brought up to date in memory when mounted
+    for path in [p for p in paths if packages.is_package(p)]:
+        click.echo(f'{path}: package, skipped')
+    paths = [p for p in paths if not packages.is_package(p)]
+    for path, before, after, error in migrations.upgrade_project_files(paths, workers):
+        if error:
+            click.echo(f'FAILED {path}: {error}', err=True)
+        else:
+            click.echo(f'{path}: {before} -> {after}')
+
+
+@app.cli.command('compact-history')
+def compact_history():
+    """Downsample old progress history in every project."""
+    if not getattr(app, 'db_initialized', False):
+        init_db('project1')
+    with app.app_context():
+        names = [p.name for p in Project.query.order_by(Project.name).all()]
+    for name in names:
+        with project_context(name):
+            removed = history.compact()
+            db.session.commit()
+        click.echo(f'{name}: {removed} rows removed')
+
+
+@app.cli.command('import-tasks')
+@click.argument('project')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(list(bulk_io.FORMATS)),
+              help='Input format (default: from the file extension).')
+def import_tasks_command(project, path, fmt):
+    """Import tasks into PROJECT from a CSV or JSON Lines file."""
+    fmt = fmt or bulk_io.format_for(path)
+    if fmt is None:
+        raise click.UsageError('cannot tell the format from the file name; use --format')
+    with project_context(project), open(path, 'rb') as f:
+        try:
+            counts = bulk_io.import_tasks(bulk_io.read_records(f, fmt))
+            db.session.commit()
+        except bulk_io.ImportFailed as e:
+            db.session.rollback()
+            raise click.ClickException(str(e))
+    click.echo(f"{counts['tasks']} tasks, {counts['dependencies']} dependencies, "
+               f"{counts['members']} new members")
+
+
+@app.cli.command('export-tasks')
+@click.argument('project')
+@click.option('--format', 'fmt', type=click.Choice(list(bulk_io.FORMATS)), default='csv', show_default=True)
+@click.option('--output', type=click.File('w', encoding='utf-8'), default='-')
+def export_tasks_command(project, fmt, output):
+    """Export every task of PROJECT."""
+    with project_context(project):
+        for chunk in bulk_io.export_lines(fmt):
+            output.write(chunk)
+
+
+@app.cli.command('package-project')
+@click.argument('project')
+@click.argument('output', type=click.Path(dir_okay=False))
+def package_project_command(project, output):
+    """Write a consistent snapshot of PROJECT to the package file OUTPUT."""
+    with project_context(project) as path:
+        manifest = packages.create(path, output, project)
+    click.echo(f"{output}: {manifest['tasks']} tasks, {os.path.getsize(output)} bytes")
+
+
+@app.cli.command('open-package')
+@click.argument('package', type=click.Path(exists=True, dir_okay=False))
+@click.option('--name', help='Project name (default: from the manifest).')
+@click.option('--mount', is_flag=True, help='Register the package read-only instead of extracting it.')
+def open_package_command(package, name, mount):
+    """Register the project in PACKAGE, extracting it to data/projects unless --mount."""
+    try:
+        manifest = packages.read_manifest(package)
+        name = name or manifest['name']
+        if mount:
+            path = os.path.abspath(package)
+        else:
+            path = os.path.join(app.root_path, 'data', 'projects', f'{name}.db')
+            packages.extract(package, path)
+        init_db(name, path)
+    except packages.PackageError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'{name}: {path}')
+
+
 if __name__ == '__main__':
     init_db('project1')
     app.run(debug=True)
@@ -0,0 +1,174 @@
+"""Synthetic project generator for benchmarks.
+
+Writes a fully migrated project database with a WBS hierarchy, members,
+resources and finish-to-start dependencies between leaf tasks.  Task ids
+follow the hierarchy breadth first and dependencies always point from a
+lower to a higher id, so the graph is acyclic and every successor starts
+after its predecessors finish.  The same arguments and seed produce the
+same project, with dates relative to today so progress looks current.
+
+    python benchmarks/generate.py data/projects/bench.db --tasks 10000 --depth 3
+"""
+import argparse
+import math
+import os
+import random
+import sys
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import migrations  # noqa: E402
+from routing import apply_sqlite_profile  # noqa: E402
+
+WORDS = ('設計', '実装', 'レビュー', 'テスト', '調整', '資料作成', 'requirements', 'design',
+         'build', 'deploy', 'migration', 'review', 'API', 'UI', 'report', 'integration')
+# Dependencies are drawn from this many preceding leaves, which keeps chains local
+DEPENDENCY_WINDOW = 200
+
+
+def _level_sizes(tasks, depth):
+    """Tasks per WBS level; each level fans out by the same factor."""
+    if depth <= 1:
+        return [tasks]
+    fanout = max(2, round(tasks ** (1 / depth)))
+    sizes, total = [], 0
+    for level in range(depth - 1):
+        size = min(fanout ** (level + 1), tasks - total - 1)
+        if size <= 0:
+            break
+        sizes.append(size)
+        total += size
+    sizes.append(tasks - total)
+    return sizes
+
+
+def build_rows(tasks, depth=3, dependencies=1.0, members=20, resources=10, span_days=None,
+               seed=1, today=None):
+    """Return ``(tasks, dependencies, members, resources)`` row dicts."""
+    rng = random.Random(seed)
+    today = today or date.today()
+    span_days = span_days or max(90, int(math.sqrt(tasks) * 15))
+    origin = today - timedelta(days=span_days // 2)
+
+    parents, next_id, levels = [None], 1, []
+    for size in _level_sizes(tasks, depth):
+        ids = list(range(next_id, next_id + size))
+        levels.append([(i, rng.choice(parents)) for i in ids])
+        parents, next_id = ids, next_id + size
+    leaves = [i for i, _ in levels[-1]]
+
+    preds = {i: set() for i in leaves}
+    for position, task_id in enumerate(leaves[1:], start=1):
+        # Whole predecessors plus one more with the fractional probability
+        count = int(dependencies) + (rng.random() < dependencies - int(dependencies))
+        window = leaves[max(0, position - DEPENDENCY_WINDOW):position]
+        preds[task_id].update(rng.sample(window, min(count, len(window))))
+
+    task_rows, spans = {}, {}
+    for position, task_id in enumerate(leaves):
+        start = origin + timedelta(days=int(position / len(leaves) * span_days))
+        for p in preds[task_id]:
+            start = max(start, spans[p][1] + timedelta(days=1))
+        milestone = rng.random() < 0.03
+        end = start if milestone else start + timedelta(days=rng.randint(1, 15))
+        spans[task_id] = (start, end)
+        if end < today:
+            progress = 100 if rng.random() < 0.85 else rng.choice((50, 75, 90))
+        elif start <= today:
+            progress = rng.choice((0, 10, 25, 50, 75))
+        else:
+            progress = 0
+        task_rows[task_id] = {'progress': progress, 'is_milestone': milestone}
+
+    # Parents span their children, deepest level first
+    for level in reversed(levels):
+        for task_id, parent_id in level:
+            if task_id not in spans:
+                # A parent that drew no children becomes a short leaf of its own
+                start = origin + timedelta(days=rng.randint(0, span_days))
+                spans[task_id] = (start, start + timedelta(days=rng.randint(1, 15)))
+            if task_id not in task_rows:
+                task_rows[task_id] = {'progress': 100 if spans[task_id][1] < today else 0,
+                                      'is_milestone': False}
+            if parent_id is not None:
+                start, end = spans[task_id]
+                if parent_id in spans:
+                    start = min(start, spans[parent_id][0])
+                    end = max(end, spans[parent_id][1])
+                spans[parent_id] = (start, end)
+
+    parent_of = {i: p for level in levels for i, p in level}
+    rows = []
+    for task_id in range(1, tasks + 1):
+        start, end = spans[task_id]
+        rows.append({
+            'id': task_id,
+            'name': f'{rng.choice(WORDS)} {rng.choice(WORDS)} {task_id}',
+            'start_date': start.isoformat(),
+            'end_date': end.isoformat(),
+            'remarks': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(0, 12))) or None,
+            'progress': task_rows[task_id]['progress'],
+            'parent_id': parent_of[task_id],
+            'assignee_id': rng.randint(1, members) if members else None,
+            'resource_id': rng.randint(1, resources) if resources and rng.random() < 0.5 else None,
+            'is_milestone': task_rows[task_id]['is_milestone'],
+        })
+    dependency_rows = [{'predecessor_id': p, 'successor_id': s} for s in leaves for p in sorted(preds[s])]
+    member_rows = [{'id': i, 'name': f'Member {i:03d}'} for i in range(1, members + 1)]
+    resource_rows = [{'id': i, 'name': f'Resource {i:03d}', 'role': rng.choice(('Dev', 'QA', 'PM')),
+                      'utilization': rng.choice((50, 80, 100))} for i in range(1, resources + 1)]
+    return rows, dependency_rows, member_rows, resource_rows
+
+
+def generate(path, tasks, depth=3, dependencies=1.0, members=20, resources=10, seed=1):
+    """Create the project database at ``path``, replacing any existing file."""
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    task_rows, dependency_rows, member_rows, resource_rows = build_rows(
+        tasks, depth, dependencies, members, resources, seed=seed)
+    engine = apply_sqlite_profile(create_engine(f'sqlite:///{path}'))
+    migrations.upgrade_project(engine)
+    with engine.begin() as conn:
+        if member_rows:
+            conn.execute(text('INSERT INTO members (id, name) VALUES (:id, :name)'), member_rows)
+        if resource_rows:
+            conn.execute(text('INSERT INTO resource (id, name, role, utilization) '
+                              'VALUES (:id, :name, :role, :utilization)'), resource_rows)
+        conn.execute(text(
+            'INSERT INTO tasks (id, name, start_date, end_date, remarks, progress, parent_id, '
+            'assignee_id, resource_id, is_milestone, updated_at) '
+            'VALUES (:id, :name, :start_date, :end_date, :remarks, :progress, :parent_id, '
+            ':assignee_id, :resource_id, :is_milestone, CURRENT_TIMESTAMP)'), task_rows)
+        if dependency_rows:
+            conn.execute(text('INSERT INTO task_dependencies (predecessor_id, successor_id) '
+                              'VALUES (:predecessor_id, :successor_id)'), dependency_rows)
+        # Progress history starts with today's state, as for a migrated project
+        conn.execute(text('INSERT OR REPLACE INTO progress_history (day, task_id, progress) '
+                          'SELECT :day, id, progress FROM tasks'), {'day': date.today().isoformat()})
+        conn.execute(text('PRAGMA optimize'))
+    engine.dispose()
+    return len(task_rows), len(dependency_rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path')
+    parser.add_argument('--tasks', type=int, default=1000)
+    parser.add_argument('--depth', type=int, default=3, help='WBS levels (1 = flat)')
+    parser.add_argument('--dependencies', type=float, default=1.0,
+                        help='Mean predecessors per leaf task')
+    parser.add_argument('--members', type=int, default=20)
+    parser.add_argument('--resources', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    tasks, dependencies = generate(args.path, args.tasks, args.depth, args.dependencies,
+                                   args.members, args.resources, args.seed)
+    print(f'{args.path}: {tasks} tasks, {dependencies} dependencies')
+
+
+if __name__ == '__main__':
+    main()
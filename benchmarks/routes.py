@@ -0,0 +1,229 @@
+"""Benchmark of the core routes on synthetic projects of increasing size.
+
+For each project size a generated database (see ``generate.py``) is copied
+into a scratch directory with its own master database.  The benchmark then
+drives the Flask test client through the task list, the dashboard (warm,
+and cold with the metrics cache dropped before each call), task updates
+and a cold ``init_db()``.  Each scenario records median/p95
+latency, SQL statements per call and the peak Python memory of one call
+(measured in a separate run under ``tracemalloc``, which would otherwise
+skew the timings).
+
+Results are written as JSON.  With ``--baseline`` they are compared to an
+earlier results file, and the exit status is 1 when a scenario got slower
+than the tolerance allows or issues more statements.
+
+    python benchmarks/routes.py --sizes 100 1000 10000 --output results.json
+    python benchmarks/routes.py --baseline results.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event  # noqa: E402
+from sqlalchemy.engine import Engine  # noqa: E402
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+import generate  # noqa: E402
+
+SIZES = (100, 1000, 10000, 50000)
+SCENARIOS = ('tasks', 'dashboard', 'dashboard_cold', 'update_task', 'init_db')
+USERNAME, PASSWORD = 'bench', 'bench'
+
+# Statements executed on any engine; counted here rather than with
+# query_budget because init_db() runs outside the request's app context
+_statements = 0
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    global _statements
+    _statements += 1
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+class Bench:
+    """Test client logged in to one generated project."""
+
+    def __init__(self, appmod, name, path, seed=1):
+        self.appmod, self.app = appmod, appmod.app
+        self.name, self.path = name, path
+        self.rng = random.Random(seed)
+        appmod.init_db(name, path)
+        with self.app.app_context():
+            if not appmod.User.query.filter_by(username=USERNAME).first():
+                appmod.db.session.add(appmod.User(username=USERNAME, role='Admin',
+                                                  password_hash=generate_password_hash(PASSWORD)))
+                appmod.db.session.commit()
+        self.client = self.app.test_client()
+        self.client.post('/login', data={'username': USERNAME, 'password': PASSWORD})
+        self.client.post('/select', data={'project': name})
+        with sqlite3.connect(path) as conn:
+            self.leaves = [row[0] for row in conn.execute(
+                'SELECT id FROM tasks t WHERE NOT EXISTS (SELECT 1 FROM tasks c WHERE c.parent_id = t.id)')]
+
+    def tasks(self):
+        return self.client.get('/tasks')
+
+    def dashboard(self):
+        # Warm: repeated calls hit the metrics cache
+        return self.client.get('/dashboard')
+
+    def dashboard_cold(self):
+        self.appmod.metrics.invalidate(self.path)
+        return self.client.get('/dashboard')
+
+    def update_task(self):
+        task_id = self.rng.choice(self.leaves)
+        with sqlite3.connect(self.path) as conn:
+            name, start, end, remarks, parent_id, assignee_id, milestone = conn.execute(
+                'SELECT name, start_date, end_date, remarks, parent_id, assignee_id, is_milestone '
+                'FROM tasks WHERE id = ?', (task_id,)).fetchone()
+            predecessors = [r[0] for r in conn.execute(
+                'SELECT predecessor_id FROM task_dependencies WHERE successor_id = ?', (task_id,))]
+        return self.client.post('/task/update', json={
+            'id': task_id, 'name': name, 'start_date': start, 'end_date': end, 'remarks': remarks,
+            'progress': self.rng.choice((0, 25, 50, 75, 100)), 'parent_id': parent_id,
+            'assignee_id': assignee_id, 'is_milestone': bool(milestone), 'predecessors': predecessors})
+
+    def init_db(self):
+        # Cold path: the engine is created again and checked for migrations
+        self.appmod.project_engines.discard(self.path)
+        self.appmod.init_db(self.name)
+
+    def call(self, scenario):
+        """Run ``scenario`` once; returns the number of SQL statements."""
+        before = _statements
+        response = getattr(self, scenario)()
+        if response is not None and response.status_code >= 400:
+            raise RuntimeError(f'{scenario}: HTTP {response.status_code}')
+        return _statements - before
+
+
+def measure(bench, scenario, repeat):
+    bench.call(scenario)  # warm-up
+    latencies, queries = [], []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        queries.append(bench.call(scenario))
+        latencies.append((time.perf_counter() - started) * 1000)
+    tracemalloc.start()
+    bench.call(scenario)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'median_ms': round(statistics.median(latencies), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'min_ms': round(min(latencies), 3),
+        'queries': max(queries),
+        'peak_kib': round(peak / 1024),
+    }
+
+
+def run(sizes, repeat, data_dir, depth, dependencies, regenerate=False, scenarios=SCENARIOS):
+    import app as appmod
+
+    logging.getLogger('instrumentation').setLevel(logging.ERROR)
+    results = {}
+    with tempfile.TemporaryDirectory() as scratch:
+        appmod.app.config['MASTER_DB_PATH'] = os.path.join(scratch, 'master.db')
+        for size in sizes:
+            source = os.path.join(data_dir, f'bench-{size}-d{depth}-k{dependencies:g}.db')
+            if regenerate or not os.path.exists(source):
+                print(f'generating {source}', file=sys.stderr)
+                generate.generate(source, size, depth, dependencies)
+            # Work on a copy so updates never leak into the next run
+            path = os.path.join(scratch, f'bench-{size}.db')
+            shutil.copy(source, path)
+            bench = Bench(appmod, f'bench-{size}', path)
+            results[str(size)] = {}
+            for scenario in scenarios:
+                results[str(size)][scenario] = result = measure(bench, scenario, repeat)
+                print(f'{size:>7} {scenario:14} {result["median_ms"]:10.1f} ms '
+                      f'{result["p95_ms"]:10.1f} ms {result["queries"]:6} q '
+                      f'{result["peak_kib"]:9} KiB', file=sys.stderr)
+            appmod.project_engines.discard(path)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print the change against ``baseline``; returns the list of regressions."""
+    regressions = []
+    print(f'{"size":>7} {"scenario":14} {"baseline":>10} {"now":>10} {"ratio":>7} {"queries":>9}')
+    for size, scenarios in results.items():
+        for scenario, now in scenarios.items():
+            before = baseline.get(size, {}).get(scenario)
+            if before is None:
+                continue
+            ratio = now['median_ms'] / before['median_ms'] if before['median_ms'] else 1.0
+            slower = ratio > 1 + tolerance
+            more_queries = now['queries'] > before['queries']
+            flag = ' REGRESSION' if slower or more_queries else ''
+            print(f'{size:>7} {scenario:14} {before["median_ms"]:10.1f} {now["median_ms"]:10.1f} '
+                  f'{ratio:6.2f}x {before["queries"]:>4}->{now["queries"]:<4}{flag}')
+            if flag:
+                regressions.append((size, scenario))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES))
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--dependencies', type=float, default=1.0)
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'pmt-bench'),
+                        help='Where generated projects are kept between runs')
+    parser.add_argument('--regenerate', action='store_true')
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--baseline', help='Earlier results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed median slowdown before a scenario counts as a regression')
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = run(args.sizes, args.repeat, args.data_dir, args.depth, args.dependencies,
+                  args.regenerate, args.scenarios)
+    document = {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'depth': args.depth,
+            'dependencies': args.dependencies,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(document, f, indent=2)
+    print(f'results written to {args.output}', file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
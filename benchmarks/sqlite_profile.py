@@ -0,0 +1,136 @@
+"""Before/after benchmark for the SQLite connection profile and indexes.
+
+Builds two copies of a synthetic project (default settings without indexes,
+and fully migrated with the connection profile) and times the hot queries
+used by the task list, Gantt, burndown and delete views.
+
+The full task list reads every row, so ``ix_tasks_start_date`` only saves
+the sort and the per-row lookups can cost as much as it saves: expect
+anything from a small gain to a slowdown depending on the page cache.  The
+index pays off for the keyset pages of the task API, timed separately.
+
+    python benchmarks/sqlite_profile.py --tasks 10000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import migrations  # noqa: E402
+from models import db  # noqa: E402
+from routing import apply_sqlite_profile  # noqa: E402
+
+QUERIES = {
+    'task list (ORDER BY start_date)':
+        'SELECT id, name, start_date, end_date FROM tasks ORDER BY start_date, id',
+    'task page (keyset, 100 rows)':
+        'SELECT id, name, start_date, end_date FROM tasks '
+        'WHERE (start_date, id) > (SELECT start_date, id FROM tasks WHERE id = :id) '
+        'ORDER BY start_date, id LIMIT 101',
+    'burndown (GROUP BY end_date)':
+        'SELECT end_date, count(id) FROM tasks WHERE progress < 100 GROUP BY end_date',
+    'children of a phase':
+        'SELECT id FROM tasks WHERE parent_id = :id',
+    'tasks of a member':
+        'SELECT id FROM tasks WHERE assignee_id = :id',
+    'predecessors of a task':
+        'SELECT predecessor_id FROM task_dependencies WHERE successor_id = :id',
+    'successors of a task':
+        'SELECT successor_id FROM task_dependencies WHERE predecessor_id = :id',
+}
+
+WRITES = {
+    'delete_member UPDATE':
+        'UPDATE tasks SET assignee_id = NULL WHERE assignee_id = :id',
+    'delete_task dependency DELETE':
+        'DELETE FROM task_dependencies WHERE predecessor_id = :id OR successor_id = :id',
+}
+
+
+def populate(engine, n_tasks, seed=1):
+    rng = random.Random(seed)
+    start = date(2024, 1, 1)
+    tasks = []
+    for i in range(1, n_tasks + 1):
+        s = start + timedelta(days=rng.randint(0, 730))
+        tasks.append({
+            'id': i, 'name': f'Task {i}', 'start_date': s.isoformat(),
+            'end_date': (s + timedelta(days=rng.randint(0, 30))).isoformat(),
+            'progress': rng.choice((0, 25, 50, 75, 100)),
+            'parent_id': rng.randint(1, max(1, n_tasks // 50)) if i > n_tasks // 50 else None,
+            'assignee_id': rng.randint(1, 50),
+        })
+    deps = [{'p': rng.randint(1, i - 1), 's': i}
+            for i in range(2, n_tasks + 1) for _ in range(rng.randint(0, 2))]
+    with engine.begin() as conn:
+        conn.execute(text(
+            'INSERT INTO tasks (id, name, start_date, end_date, progress, parent_id, assignee_id) '
+            'VALUES (:id, :name, :start_date, :end_date, :progress, :parent_id, :assignee_id)'), tasks)
+        conn.execute(text(
+            'INSERT INTO task_dependencies (predecessor_id, successor_id) VALUES (:p, :s)'), deps)
+
+
+def build(path, n_tasks, optimized):
+    if optimized:
+        engine = apply_sqlite_profile(create_engine(f'sqlite:///{path}'))
+        migrations.upgrade_project(engine)
+    else:
+        engine = create_engine(f'sqlite:///{path}')
+        with engine.begin() as conn:
+            db.metadatas[None].create_all(conn)
+            for (name,) in conn.execute(text(
+                    "SELECT name FROM sqlite_master WHERE type='index' AND name LIKE 'ix_%'")).all():
+                conn.execute(text(f'DROP INDEX {name}'))
+    populate(engine, n_tasks)
+    return engine
+
+
+def timed(engine, sql, ids, write):
+    """Median milliseconds per call, after one warm-up call."""
+    latencies = []
+    for i in ids[:1] + ids:
+        started = time.perf_counter()
+        if write:
+            with engine.begin() as conn:
+                conn.execute(text(sql), {'id': i})
+        else:
+            with engine.connect() as conn:
+                conn.execute(text(sql), {'id': i}).fetchall()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return statistics.median(latencies[1:])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tasks', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(2)
+    ids = [rng.randint(1, args.tasks) for _ in range(args.repeat)]
+    with tempfile.TemporaryDirectory() as tmp:
+        engines = {
+            'before': build(os.path.join(tmp, 'before.db'), args.tasks, optimized=False),
+            'after': build(os.path.join(tmp, 'after.db'), args.tasks, optimized=True),
+        }
+        print(f'{args.tasks} tasks, median of {args.repeat} runs (ms)')
+        print(f'{"query":40} {"before":>10} {"after":>10} {"speedup":>8}')
+        for label, sql, write in ([(k, v, False) for k, v in QUERIES.items()]
+                                  + [(k, v, True) for k, v in WRITES.items()]):
+            before = timed(engines['before'], sql, ids, write)
+            after = timed(engines['after'], sql, ids, write)
+            print(f'{label:40} {before:10.3f} {after:10.3f} {before / after:7.1f}x')
+        for engine in engines.values():
+            engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,318 @@
+"""Streaming bulk import and export of tasks, members and dependencies.
+
+Two formats are supported: CSV with a header row and JSON Lines (one object
+per line).  A JSON file holding one array of objects is also read as JSON
+Lines, numbering records by position.  Both use the keys in ``FIELDS``:
+
+``ref``           identifier used by ``parent``/``predecessors`` in the same file
+``assignee``      member name; unknown names are created
+``parent``        ref of the parent task
+``predecessors``  refs separated by ``;`` (CSV) or a list (JSON Lines)
+
+References not defined in the file fall back to existing task ids.
+Records are parsed one at a time and tasks are inserted in chunks of
+``CHUNK_SIZE`` inside the caller's transaction; parent links and
+dependencies are resolved in memory and written with ``executemany`` once
+every task has an id.  Exports stream rows from the database with the same
+layout, so an export can be imported into another project.
+"""
+import csv
+import io
+import json
+from datetime import date
+
+from sqlalchemy import func, insert, update
+
+from models import db, Task, TaskDependency, Member
+import changes
+import history
+import scheduling
+
+FIELDS = ['ref', 'name', 'start_date', 'end_date', 'progress', 'remarks',
+          'assignee', 'parent', 'predecessors', 'is_milestone']
+FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+CHUNK_SIZE = 1000
+
+
+class ImportFailed(ValueError):
+    """Raised for an invalid record; nothing from the import is kept."""
+
+    def __init__(self, line, message):
+        self.line = line
+        super().__init__(f'line {line}: {message}')
+
+
+def format_for(filename):
+    """Guess the format from a file name, or None."""
+    ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    return {'csv': 'csv', 'jsonl': 'jsonl', 'ndjson': 'jsonl', 'json': 'jsonl'}.get(ext)
+
+
+def read_records(stream, fmt):
+    """Yield ``(line_number, record)`` from a binary ``stream``."""
+    if fmt not in FORMATS:
+        raise ValueError(f'unknown format: {fmt}')
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for record in reader:
+            yield reader.line_num, record
+    else:
+        first = True
+        for number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            if first and line.lstrip().startswith('['):
+                # A plain .json export: one array, which has to be read whole
+                yield from _array_records(line + text.read(), number)
+                return
+            first = False
+            try:
+                yield number, json.loads(line)
+            except ValueError as e:
+                raise ImportFailed(number, f'invalid JSON ({e})')
+
+
+def _array_records(document, line):
+    try:
+        records = json.loads(document)
+    except ValueError as e:
+        raise ImportFailed(line + getattr(e, 'lineno', 1) - 1, f'invalid JSON ({e})')
+    if not isinstance(records, list):
+        raise ImportFailed(line, 'expected an array of objects')
+    yield from enumerate(records, start=1)
+
+
+def _text(line, field, value, numbers=False):
+    """``value`` as a stripped string, '' when missing.
+
+    ``numbers`` also accepts integers, as refs may be task ids.
+    """
+    if value is None:
+        return ''
+    if isinstance(value, str) or (numbers and isinstance(value, int) and not isinstance(value, bool)):
+        return str(value).strip()
+    raise ImportFailed(line, f'{field} must be a string')
+
+
+def _refs(line, value):
+    """Refs from a list or a ``;``-separated string."""
+    if isinstance(value, list):
+        refs = [_text(line, 'predecessors', v, numbers=True) for v in value]
+    else:
+        refs = _text(line, 'predecessors', value, numbers=True).split(';')
+    return [r.strip() for r in refs if r.strip()]
+
+
+def _flag(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+def _task_row(line, record, member_ids):
+    name = _text(line, 'name', record.get('name'))
+    if not name:
+        raise ImportFailed(line, 'name is required')
+    start = _text(line, 'start_date', record.get('start_date'))
+    end = _text(line, 'end_date', record.get('end_date'))
+    try:
+        start_date = date.fromisoformat(start)
+        end_date = date.fromisoformat(end) if end else start_date
+    except ValueError as e:
+        raise ImportFailed(line, str(e))
+    try:
+        progress = int(record.get('progress') or 0)
+    except (TypeError, ValueError):
+        raise ImportFailed(line, 'progress must be an integer')
+    if end_date < start_date:
+        raise ImportFailed(line, 'end_date is before start_date')
+    remarks = record.get('remarks')
+    if remarks is not None and not isinstance(remarks, str):
+        raise ImportFailed(line, 'remarks must be a string')
+    is_milestone = _flag(record.get('is_milestone'))
+    if is_milestone:
+        end_date = start_date
+
+    assignee_id = None
+    assignee = _text(line, 'assignee', record.get('assignee'))
+    if assignee:
+        assignee_id = member_ids.get(assignee)
+        if assignee_id is None:
+            member = Member(name=assignee)
+            db.session.add(member)
+            db.session.flush()
+            assignee_id = member_ids[assignee] = member.id
+
+    return {
+        'name': name, 'start_date': start_date, 'end_date': end_date,
+        'progress': max(0, min(progress, 100)), 'remarks': remarks or None,
+        'assignee_id': assignee_id, 'is_milestone': is_milestone,
+    }
+
+
+def _reserve_ids():
+    """First free task id, with the project's write lock held until commit.
+
+    The lock keeps other writers from taking the ids assigned by the import.
+    """
+    connection = db.session.connection(bind_arguments={'mapper': Task})
+    if not connection.connection.dbapi_connection.in_transaction:
+        # pysqlite would only BEGIN (without a lock) before the first INSERT
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+    return (db.session.query(func.max(Task.id)).scalar() or 0) + 1
+
+
+def import_tasks(records):
+    """Insert tasks from ``(line, record)`` pairs; the caller commits.
+
+    Returns counts of created tasks, dependencies and members.
+    """
+    member_ids = dict(db.session.query(Member.name, Member.id))
+    known_members = len(member_ids)
+    ids = {}
+    refs = set()
+    parents = []
+    links = []
+    rows, pending = [], []
+    # New task id -> line and (start, duration), for the cycle check
+    lines, dates = {}, {}
+    next_id = None
+
+    def flush():
+        nonlocal next_id
+        if not rows:
+            return
+        if next_id is None:
+            next_id = _reserve_ids()
+        # Ids are assigned here so the chunk is one executemany; RETURNING
+        # would make SQLite run an INSERT per row
+        new_ids = list(range(next_id, next_id + len(rows)))
+        next_id += len(rows)
+        for row, task_id in zip(rows, new_ids):
+            row['id'] = task_id
+        db.session.execute(insert(Task), rows)
+        changes.record('task', new_ids, 'insert')
+        history.record(new_ids)
+        for (line, ref, parent, preds), row, task_id in zip(pending, rows, new_ids):
+            ids[ref] = task_id
+            lines[task_id] = line
+            dates[task_id] = (row['start_date'], scheduling.task_duration(
+                row['start_date'], row['end_date'], row['is_milestone']))
+            if parent:
+                parents.append((line, task_id, parent))
+            if preds:
+                links.append((line, task_id, preds))
+        rows.clear()
+        pending.clear()
+
+    for line, record in records:
+        if not isinstance(record, dict):
+            raise ImportFailed(line, 'record must be an object')
+        row = _task_row(line, record, member_ids)
+        ref = _text(line, 'ref', record.get('ref'), numbers=True) or f'line:{line}'
+        if ref in refs:
+            raise ImportFailed(line, f'duplicate ref {ref!r}')
+        refs.add(ref)
+        rows.append(row)
+        pending.append((line, ref, _text(line, 'parent', record.get('parent'), numbers=True),
+                        _refs(line, record.get('predecessors'))))
+        if len(rows) >= CHUNK_SIZE:
+            flush()
+    flush()
+
+    # Refs not defined in the file may name existing tasks by id
+    outside = {r for _, _, r in parents if r not in ids}
+    outside |= {r for _, _, preds in links for r in preds if r not in ids}
+    numeric = [int(r) for r in outside if r.isdigit()]
+    existing = set()
+    for start in range(0, len(numeric), CHUNK_SIZE):
+        existing.update(i for (i,) in db.session.query(Task.id)
+                        .filter(Task.id.in_(numeric[start:start + CHUNK_SIZE])))
+
+    def resolve(line, ref):
+        if ref in ids:
+            return ids[ref]
+        if ref.isdigit() and int(ref) in existing:
+            return int(ref)
+        raise ImportFailed(line, f'unknown task reference {ref!r}')
+
+    parent_rows = [{'id': task_id, 'parent_id': resolve(line, ref)}
+                   for line, task_id, ref in parents]
+    dep_rows = []
+    for line, task_id, preds in links:
+        seen = set()
+        for ref in preds:
+            pred_id = resolve(line, ref)
+            if pred_id != task_id and pred_id not in seen:
+                seen.add(pred_id)
+                dep_rows.append({'predecessor_id': pred_id, 'successor_id': task_id})
+
+    if dep_rows:
+        # New links all end at new tasks, so any cycle found passes through
+        # one of them; cycles that predate the import do not block it
+        predecessors = {}
+        for row in dep_rows:
+            predecessors.setdefault(row['successor_id'], set()).add(row['predecessor_id'])
+        try:
+            scheduling.with_changes(dates, predecessors)
+        except scheduling.CycleError as e:
+            new = [n for n in e.cycle if n in lines]
+            if new:
+                raise ImportFailed(min(lines[n] for n in new), str(e))
+
+    for start in range(0, len(parent_rows), CHUNK_SIZE):
+        db.session.execute(update(Task), parent_rows[start:start + CHUNK_SIZE])
+    for start in range(0, len(dep_rows), CHUNK_SIZE):
+        db.session.execute(insert(TaskDependency), dep_rows[start:start + CHUNK_SIZE])
+
+    return {'tasks': len(ids), 'dependencies': len(dep_rows),
+            'members': len(member_ids) - known_members}
+
+
+def export_records():
+    """Yield one dict per task, streaming from the database."""
+    deps = iter(db.session.query(TaskDependency.successor_id, TaskDependency.predecessor_id)
+                .order_by(TaskDependency.successor_id, TaskDependency.predecessor_id)
+                .yield_per(CHUNK_SIZE))
+    tasks = (db.session.query(Task.id, Task.name, Task.start_date, Task.end_date,
+                              Task.progress, Task.remarks, Member.name, Task.parent_id,
+                              Task.is_milestone)
+             .outerjoin(Member, Member.id == Task.assignee_id)
+             .order_by(Task.id)
+             .yield_per(CHUNK_SIZE))
+    dep = next(deps, None)
+    for task_id, name, start, end, progress, remarks, assignee, parent_id, milestone in tasks:
+        # Both streams are ordered by task id, so predecessors merge in one pass
+        preds = []
+        while dep is not None and dep[0] <= task_id:
+            if dep[0] == task_id:
+                preds.append(str(dep[1]))
+            dep = next(deps, None)
+        yield {
+            'ref': str(task_id), 'name': name, 'start_date': start.isoformat(),
+            'end_date': end.isoformat(), 'progress': progress, 'remarks': remarks or '',
+            'assignee': assignee or '', 'parent': str(parent_id) if parent_id else '',
+            'predecessors': preds, 'is_milestone': bool(milestone),
+        }
+
+
+def export_lines(fmt):
+    """Yield encoded chunks of the export in ``fmt``."""
+    if fmt not in FORMATS:
+        raise ValueError(f'unknown format: {fmt}')
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, FIELDS) if fmt == 'csv' else None
+    if writer:
+        writer.writeheader()
+    for count, record in enumerate(export_records(), start=1):
+        if writer:
+            writer.writerow(dict(record, predecessors=';'.join(record['predecessors']),
+                                 is_milestone=int(record['is_milestone'])))
+        else:
+            buffer.write(json.dumps(record, ensure_ascii=False) + '\n')
+        if count % CHUNK_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
@@ -0,0 +1,105 @@
+"""Burndown series computation.
+
+The remaining-task count on a given day is the number of open tasks whose
+``end_date`` is on or after that day.  Instead of re-scanning every task for
+every calendar day, open tasks are grouped by ``end_date`` in SQL and the
+series is produced with a single reverse cumulative sum, so the cost is
+O(distinct end dates + days).
+"""
+from datetime import date
+
+import pandas as pd
+from sqlalchemy import func
+
+from models import db, Task
+
+BUCKETS = {'day': 'D', 'week': 'W', 'month': 'M'}
+
+
+def open_counts_by_end_date():
+    """Return ``{end_date: open_task_count}`` using a ``GROUP BY`` aggregate."""
+    rows = (db.session.query(Task.end_date, func.count(Task.id))
+            .filter(Task.progress < 100)
+            .group_by(Task.end_date)
+            .all())
+    return dict(rows)
+
+
+def project_span():
+    """Return ``(min start_date, max end_date)`` or ``(None, None)`` if empty."""
+    return db.session.query(func.min(Task.start_date), func.max(Task.end_date)).one()
+
+
+def pick_bucket(start, end):
+    """Choose a bucket size that keeps the chart to a few hundred points."""
+    days = (end - start).days
+    if days <= 180:
+        return 'day'
+    if days <= 3 * 365:
+        return 'week'
+    return 'month'
+
+
+def series_from_counts(counts, start, end, bucket='day'):
+    """Build ``[{"date", "remaining"}]`` between ``start`` and ``end``.
+
+    ``counts`` maps end dates to the number of open tasks ending that day.
+    Tasks ending after ``end`` are still remaining on every day in range, so
+    they are clipped onto ``end``; tasks ending before ``start`` never count.
+    Bucketed series report the remaining count on the first day of each
+    bucket.
+    """
+    if bucket not in BUCKETS:
+        raise ValueError(f'unknown bucket: {bucket}')
+    if start is None or end is None or start > end:
+        return []
+
+    days = pd.date_range(start, end, freq='D')
+    per_day = pd.Series(0, index=days, dtype='int64')
+    if counts:
+        ends = pd.Series(counts, dtype='int64')
+        ends.index = pd.to_datetime(ends.index)
+        ends = ends[ends.index >= days[0]]
+        ends.index = ends.index.where(ends.index <= days[-1], days[-1])
+        per_day = per_day.add(ends.groupby(level=0).sum(), fill_value=0)
+
+    remaining = per_day.iloc[::-1].cumsum().iloc[::-1].astype('int64')
+    return [{'date': d, 'remaining': int(v)} for d, v in bucketed(remaining, bucket)]
+
+
+def bucketed(series, bucket):
+    """``(YYYY-MM-DD, value)`` pairs of a daily ``series`` resampled to ``bucket``.
+
+    Each bucket reports the value on its first day inside the series.
+    """
+    if bucket != 'day':
+        first_day = series.index[0]
+        periods = series.index.to_period(BUCKETS[bucket])
+        series = series.groupby(periods).first()
+        labels = [max(p.start_time, first_day) for p in series.index]
+    else:
+        labels = series.index
+    return [(d.strftime('%Y-%m-%d'), v) for d, v in zip(labels, series.tolist())]
+
+
+def remaining_by_date(start=None, end=None, bucket='day'):
+    """Burndown series for the current project.
+
+    ``start``/``end`` default to the project span; ``bucket`` is one of
+    ``day``, ``week``, ``month`` or ``auto``.
+    """
+    span_start, span_end = project_span()
+    start = start or span_start
+    end = end or span_end
+    if start is None or end is None:
+        return []
+    if bucket == 'auto':
+        bucket = pick_bucket(start, end)
+    return series_from_counts(open_counts_by_end_date(), start, end, bucket)
+
+
+def parse_date(value):
+    """Parse an optional ``YYYY-MM-DD`` query parameter."""
+    if not value:
+        return None
+    return date.fromisoformat(value)
@@ -0,0 +1,139 @@
+"""Per-project change feed.
+
+Every flush that touches a ``Task``, ``TaskDependency``, ``Member`` or
+``Resource`` appends ``(entity, entity_id, op)`` rows to ``change_log`` in
+the same transaction.  Dependency edits are logged as an update of the
+successor task, because that is the row whose predecessor list changed.
+
+Bulk statements (``query.update()``, ``insert()`` executemany, ...) bypass
+the unit of work, so code that issues them calls ``record()`` with the ids
+it touched.
+
+``read_changes()`` turns a cursor into compact deltas: the latest state of
+each changed row, or just its id when it was deleted.
+"""
+import itertools
+
+from sqlalchemy import event, insert, func
+
+from models import db, Task, TaskDependency, Member, Resource, ChangeLog
+from routing import RoutingSession
+import task_api
+
+ENTITIES = {Task: 'task', Member: 'member', Resource: 'resource'}
+# Rows kept per project; older entries are pruned now and then
+KEEP_ROWS = 100000
+PRUNE_EVERY = 500
+MAX_CHANGES = 1000
+
+_flushes = itertools.count(1)
+
+
+def _entries(session):
+    entries = []
+    for obj in session.new:
+        if isinstance(obj, TaskDependency):
+            entries.append(('task', obj.successor_id, 'update'))
+        elif type(obj) in ENTITIES:
+            entries.append((ENTITIES[type(obj)], obj.id, 'insert'))
+    for obj in session.dirty:
+        if isinstance(obj, TaskDependency):
+            entries.append(('task', obj.successor_id, 'update'))
+        elif type(obj) in ENTITIES and session.is_modified(obj, include_collections=False):
+            entries.append((ENTITIES[type(obj)], obj.id, 'update'))
+    for obj in session.deleted:
+        if isinstance(obj, TaskDependency):
+            entries.append(('task', obj.successor_id, 'update'))
+        elif type(obj) in ENTITIES:
+            entries.append((ENTITIES[type(obj)], obj.id, 'delete'))
+    return entries
+
+
+def _write(connection, entries):
+    rows = [{'entity': e, 'entity_id': i, 'op': op}
+            for e, i, op in dict.fromkeys(entries) if i is not None]
+    if rows:
+        connection.execute(insert(ChangeLog.__table__), rows)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def log_flush(session, flush_context):
+    entries = _entries(session)
+    if entries:
+        connection = session.connection(bind_arguments={'mapper': ChangeLog})
+        _write(connection, entries)
+        if next(_flushes) % PRUNE_EVERY == 0:
+            prune(connection)
+
+
+def record(entity, ids, op='update'):
+    """Log a bulk change to ``ids`` in the current transaction."""
+    connection = db.session.connection(bind_arguments={'mapper': ChangeLog})
+    _write(connection, [(entity, i, op) for i in ids])
+
+
+def prune(connection, keep=KEEP_ROWS):
+    """Drop all but the newest ``keep`` log rows."""
+    last = connection.execute(func.max(ChangeLog.__table__.c.id).select()).scalar()
+    if last and last > keep:
+        connection.execute(ChangeLog.__table__.delete().where(ChangeLog.__table__.c.id <= last - keep))
+
+
+def latest_cursor():
+    return db.session.query(func.max(ChangeLog.id)).scalar() or 0
+
+
+def read_changes(since, limit=MAX_CHANGES):
+    """Deltas after cursor ``since``.
+
+    Returns a dict with ``cursor`` (pass it back as ``since``), ``changes``
+    and ``more``.  ``reset`` is set when ``since`` predates the retained log
+    and the client should reload everything.
+    """
+    oldest = db.session.query(func.min(ChangeLog.id)).scalar()
+    if oldest is not None and since < oldest - 1:
+        return {'cursor': latest_cursor(), 'changes': [], 'more': False, 'reset': True}
+
+    log = (db.session.query(ChangeLog.id, ChangeLog.entity, ChangeLog.entity_id, ChangeLog.op)
+           .filter(ChangeLog.id > since)
+           .order_by(ChangeLog.id)
+           .limit(limit + 1)
+           .all())
+    more = len(log) > limit
+    log = log[:limit]
+    if not log:
+        return {'cursor': since, 'changes': [], 'more': False, 'reset': False}
+
+    # Keep only the last operation per row
+    latest = {}
+    for _, entity, entity_id, op in log:
+        latest.pop((entity, entity_id), None)
+        latest[(entity, entity_id)] = op
+
+    live = {'task': [], 'member': [], 'resource': []}
+    for (entity, entity_id), op in latest.items():
+        if op != 'delete':
+            live[entity].append(entity_id)
+    data = {}
+    if live['task']:
+        tasks = Task.query.filter(Task.id.in_(live['task'])).all()
+        names = dict(db.session.query(Member.id, Member.name)
+                     .filter(Member.id.in_({t.assignee_id for t in tasks if t.assignee_id})))
+        for item in task_api.serialize(tasks):
+            item['assignee'] = names.get(item['assignee_id'])
+            data[('task', item['id'])] = item
+    for m in Member.query.filter(Member.id.in_(live['member'])) if live['member'] else ():
+        data[('member', m.id)] = {'id': m.id, 'name': m.name}
+    for r in Resource.query.filter(Resource.id.in_(live['resource'])) if live['resource'] else ():
+        data[('resource', r.id)] = {'id': r.id, 'name': r.name, 'role': r.role,
+                                    'color': r.color, 'utilization': r.utilization}
+
+    changes = []
+    for (entity, entity_id), op in latest.items():
+        item = data.get((entity, entity_id))
+        if item is None:
+            # Deleted in the meantime, or logged as deleted
+            changes.append({'entity': entity, 'id': entity_id, 'op': 'delete'})
+        else:
+            changes.append({'entity': entity, 'id': entity_id, 'op': op, 'data': item})
+    return {'cursor': log[-1][0], 'changes': changes, 'more': more, 'reset': False}
@@ -0,0 +1,88 @@
+"""Gantt chart layout.
+
+The layout is computed from plain column queries: tasks are assigned a row
+in ``(start_date, id)`` order and bar offsets are expressed in days from the
+project origin.  Dependency edges are resolved through an id-indexed dict,
+so building the layout is O(tasks + dependencies).  The app caches the
+layout per project data version and slices blocks from it, so the browser
+only receives the rows it is about to draw.
+"""
+from datetime import date
+
+from models import db, Task, TaskDependency
+
+# Default number of rows returned per request
+BLOCK_SIZE = 200
+
+
+def task_status(progress, end_date, today):
+    """Return the bar status used for colouring."""
+    if progress == 100:
+        return 'complete'
+    if end_date < today:
+        return 'delayed'
+    return 'ongoing'
+
+
+def build_layout(today=None, critical=()):
+    """Compute row positions, bar offsets and dependency edges.
+
+    Tasks whose ids are in ``critical`` are flagged for highlighting.
+
+    Returns a dict with ``origin`` (first start date), ``days`` (chart width
+    in days), ``rows`` (one tuple per task in row order) and ``edges``
+    (``(pred_row, pred_end, succ_row, succ_start)`` in row/day units).
+    """
+    today = today or date.today()
+    tasks = (db.session.query(Task.id, Task.name, Task.start_date, Task.end_date,
+                              Task.progress, Task.is_milestone)
+             .order_by(Task.start_date, Task.id)
+             .all())
+    if not tasks:
+        return {'origin': today, 'days': 0, 'rows': [], 'edges': []}
+
+    origin = tasks[0].start_date
+    last = max(t.end_date for t in tasks)
+    rows = []
+    position = {}
+    for row, t in enumerate(tasks):
+        offset = (t.start_date - origin).days
+        duration = (t.end_date - t.start_date).days + 1
+        position[t.id] = (row, offset, offset + duration)
+        rows.append((t.id, t.name, offset, duration, t.progress,
+                     task_status(t.progress, t.end_date, today), bool(t.is_milestone),
+                     t.id in critical))
+
+    edges = []
+    for pred_id, succ_id in db.session.query(TaskDependency.predecessor_id,
+                                             TaskDependency.successor_id):
+        pred = position.get(pred_id)
+        succ = position.get(succ_id)
+        if pred and succ:
+            edges.append((pred[0], pred[2], succ[0], succ[1]))
+
+    return {'origin': origin, 'days': (last - origin).days + 1, 'rows': rows, 'edges': edges}
+
+
+def window(layout, row_start=0, row_count=BLOCK_SIZE, today=None):
+    """Slice ``layout`` to ``row_count`` rows starting at ``row_start``.
+
+    Edges are included when their row span overlaps the slice, so arrows
+    leaving, entering or passing through the visible rows can be drawn even
+    when neither end's block is loaded.
+    """
+    today = today or date.today()
+    row_start = max(row_start, 0)
+    row_end = row_start + max(row_count, 0)
+    rows = layout['rows'][row_start:row_end]
+    edges = [e for e in layout['edges']
+             if min(e[0], e[2]) < row_end and max(e[0], e[2]) >= row_start]
+    return {
+        'origin': layout['origin'].isoformat(),
+        'days': layout['days'],
+        'today': (today - layout['origin']).days,
+        'total_rows': len(layout['rows']),
+        'row_start': row_start,
+        'rows': [list(r) for r in rows],
+        'edges': [list(e) for e in edges],
+    }
@@ -0,0 +1,188 @@
+"""Task progress history for actual burndown and velocity.
+
+``progress_history`` holds one narrow ``(day, task_id, progress)`` row per
+task per day on which its progress changed; a deleted task gets a final
+row with NULL progress.  Rows are written after each flush (bulk inserts
+call ``record()``), at most one per task per day.
+
+Series are built from the change rows alone: every row is a step in that
+task's contribution, so per-day deltas summed with one cumulative sum give
+the state of the project on every day, whatever the number of tasks.
+Only rows inside the requested range are read, plus each task's last row
+before it as a seed, so long histories are not loaded in full.
+
+``compact()`` bounds storage: rows older than ``DAILY_DAYS`` keep only the
+last change per task per week, rows older than ``WEEKLY_DAYS`` only the
+last per month, and rows that repeat the previous value are dropped.
+"""
+from datetime import date, timedelta
+
+import pandas as pd
+from sqlalchemy import event, select, text, inspect, func, bindparam, union_all
+from sqlalchemy.dialects.sqlite import insert
+
+from models import db, Task, ProgressHistory
+from routing import RoutingSession
+import burndown
+
+DAILY_DAYS = 90
+WEEKLY_DAYS = 730
+
+_history = ProgressHistory.__table__
+
+
+def _connection(session):
+    return session.connection(bind_arguments={'mapper': ProgressHistory})
+
+
+def _write(connection, rows):
+    if rows:
+        stmt = insert(_history)
+        connection.execute(stmt.on_conflict_do_update(
+            index_elements=[_history.c.day, _history.c.task_id],
+            set_={'progress': stmt.excluded.progress}), rows)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _after_flush(session, flush_context):
+    today = date.today()
+    rows = []
+    for obj in session.new:
+        if isinstance(obj, Task):
+            rows.append({'day': today, 'task_id': obj.id, 'progress': obj.progress or 0})
+    for obj in session.dirty:
+        if isinstance(obj, Task) and inspect(obj).attrs.progress.history.has_changes():
+            rows.append({'day': today, 'task_id': obj.id, 'progress': obj.progress})
+    for obj in session.deleted:
+        if isinstance(obj, Task):
+            rows.append({'day': today, 'task_id': obj.id, 'progress': None})
+    if rows:
+        _write(_connection(session), rows)
+
+
+def record(task_ids):
+    """Record the current progress of ``task_ids`` after a bulk write."""
+    connection = _connection(db.session)
+    stmt = text('INSERT INTO progress_history (day, task_id, progress) '
+                'SELECT :day, id, progress FROM tasks WHERE id IN :ids '
+                'ON CONFLICT (day, task_id) DO UPDATE SET progress = excluded.progress'
+                ).bindparams(bindparam('ids', expanding=True))
+    ids = list(task_ids)
+    for start in range(0, len(ids), 500):
+        connection.execute(stmt, {'day': date.today().isoformat(), 'ids': ids[start:start + 500]})
+
+
+def _steps(start, end):
+    """Per-change deltas of open-task count, remaining work and completed work.
+
+    Returns a DataFrame with one row per history row between ``start`` and
+    ``end``, preceded by each task's last row before ``start`` as its seed.
+    """
+    # SQLite returns the progress of the max(day) row with the aggregate
+    seeds = (select(_history.c.task_id, func.max(_history.c.day).label('day'), _history.c.progress)
+             .where(_history.c.day < start)
+             .group_by(_history.c.task_id))
+    in_range = (select(_history.c.task_id, _history.c.day, _history.c.progress)
+               .where(_history.c.day >= start, _history.c.day <= end))
+    rows = db.session.execute(
+        union_all(seeds, in_range).order_by(text('task_id'), text('day'))).all()
+    df = pd.DataFrame(rows, columns=['task_id', 'day', 'progress'])
+    df['day'] = pd.to_datetime(df['day'])
+    progress = df['progress'].astype('float64')
+    exists = progress.notna()
+    is_open = (exists & (progress < 100)).astype('int64')
+    remaining = ((100 - progress) / 100).where(exists, 0.0)
+    previous = df.groupby('task_id')['progress'].shift().astype('float64')
+    first = ~df['task_id'].duplicated()
+    df['open'] = is_open - is_open.groupby(df['task_id']).shift(fill_value=0)
+    df['work'] = remaining - remaining.groupby(df['task_id']).shift(fill_value=0.0)
+    # Progress made on tasks that existed before and after the change
+    df['done'] = ((progress - previous) / 100).where(~first & exists & previous.notna(), 0.0)
+    df['completed'] = (((progress == 100) & (previous < 100)).astype('int64')
+                       - ((previous == 100) & (progress < 100)).astype('int64'))
+    return df
+
+
+def first_day():
+    return db.session.query(func.min(ProgressHistory.day)).scalar()
+
+
+def actual_burndown(start=None, end=None, bucket='day'):
+    """Open tasks and remaining work (in task-equivalents) as they were each day.
+
+    ``start`` defaults to the first recorded day and ``end`` to today;
+    ``bucket`` is one of ``day``, ``week``, ``month`` or ``auto``.  Days
+    before the first recorded day have None values.
+    """
+    start = start or first_day()
+    end = end or date.today()
+    if start is None or start > end:
+        return []
+    if bucket == 'auto':
+        bucket = burndown.pick_bucket(start, end)
+    if bucket not in burndown.BUCKETS:
+        raise ValueError(f'unknown bucket: {bucket}')
+    steps = _steps(start, end)
+    days = pd.date_range(start, end, freq='D')
+    # Seed rows before the range count towards its first day
+    on = steps['day'].where(steps['day'] >= days[0], days[0])
+    daily = steps[['open', 'work']].groupby(on).sum().reindex(days, fill_value=0).cumsum()
+    # Nothing is known before the first recorded day; buckets skip those days
+    recorded = steps['day'].min() if len(steps) else days[-1] + pd.Timedelta(days=1)
+    daily = daily.astype('float64')
+    daily.loc[daily.index < recorded] = float('nan')
+    open_tasks = burndown.bucketed(daily['open'], bucket)
+    work = burndown.bucketed(daily['work'].round(2), bucket)
+    return [{'date': d,
+             'remaining': None if pd.isna(n) else int(n),
+             'remaining_work': None if pd.isna(w) else float(w)}
+            for (d, n), (_, w) in zip(open_tasks, work)]
+
+
+def velocity(start=None, end=None, bucket='week'):
+    """Completed tasks and progress made (in task-equivalents) per bucket."""
+    end = end or date.today()
+    start = start or max(first_day() or end, end - timedelta(days=WEEKLY_DAYS))
+    if bucket not in burndown.BUCKETS:
+        raise ValueError(f'unknown bucket: {bucket}')
+    if start > end:
+        return []
+    steps = _steps(start, end)
+    steps = steps[steps['day'] >= pd.Timestamp(start)]
+    days = pd.date_range(start, end, freq='D')
+    daily = steps[['completed', 'done']].groupby(steps['day']).sum().reindex(days, fill_value=0)
+    periods = daily.index.to_period(burndown.BUCKETS[bucket])
+    totals = daily.groupby(periods).sum()
+    return [{'date': max(p.start_time, days[0]).strftime('%Y-%m-%d'),
+             'completed': int(c), 'work_done': round(float(w), 2)}
+            for p, c, w in zip(totals.index, totals['completed'], totals['done'])]
+
+
+def compact(today=None):
+    """Downsample old history for the active project; the caller commits.
+
+    Returns the number of rows removed.
+    """
+    today = today or date.today()
+    daily_cutoff = (today - timedelta(days=DAILY_DAYS)).isoformat()
+    weekly_cutoff = (today - timedelta(days=WEEKLY_DAYS)).isoformat()
+    connection = _connection(db.session)
+    removed = 0
+    # Keep the last row per task per period: weeks before the daily cutoff,
+    # months before the weekly cutoff
+    for cutoff, period in ((daily_cutoff, '%Y-%W'), (weekly_cutoff, '%Y-%m')):
+        removed += connection.execute(text(
+            'DELETE FROM progress_history AS h WHERE day < :cutoff AND EXISTS ('
+            ' SELECT 1 FROM progress_history AS later WHERE later.task_id = h.task_id'
+            ' AND later.day > h.day AND later.day < :cutoff'
+            ' AND strftime(:period, later.day) = strftime(:period, h.day))'),
+            {'cutoff': cutoff, 'period': period}).rowcount
+    # Then drop rows that only repeat the task's previous value
+    removed += connection.execute(text(
+        'DELETE FROM progress_history WHERE (day, task_id) IN ('
+        ' SELECT day, task_id FROM ('
+        '  SELECT day, task_id, progress,'
+        '   lag(progress) OVER w AS previous, row_number() OVER w AS n'
+        '  FROM progress_history WINDOW w AS (PARTITION BY task_id ORDER BY day))'
+        ' WHERE n > 1 AND previous IS progress)')).rowcount
+    return removed
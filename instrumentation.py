@@ -0,0 +1,204 @@
+"""Request and SQL timing exposed as Prometheus text metrics.
+
+Every request records its wall time and the number and total time of the
+SQL statements it ran, labelled by endpoint and project.  Statement times
+come from the ``before/after_cursor_execute`` engine events and are also
+kept per statement kind; time SQLite spends waiting on ``busy_timeout``
+for a lock shows up there, and lock timeouts are counted separately.
+
+Statements slower than ``SLOW_QUERY_SECONDS`` and requests slower than
+``SLOW_REQUEST_SECONDS`` are logged as warnings (``None`` disables either).
+``render()`` returns all series in the Prometheus text exposition format.
+"""
+import logging
+import threading
+import time
+
+from flask import g, has_request_context, request, session
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import query_budget
+
+logger = logging.getLogger(__name__)
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500)
+SQL_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+# Longest statement text written to the slow query log
+LOG_STATEMENT_CHARS = 500
+
+# Thresholds in seconds, set from the app config by init_app()
+slow_query_seconds = 0.1
+slow_request_seconds = 1.0
+
+_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values = {}
+
+    def inc(self, labels=(), amount=1):
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        for labels, value in sorted(self._values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labels, labels)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, buckets, labels=()):
+        self.name, self.help, self.buckets, self.labels = name, help, buckets, labels
+        # labels -> [per-bucket counts..., sum, count]
+        self._values = {}
+
+    def observe(self, labels, value):
+        with _lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            entry[-2] += value
+            entry[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for labels, entry in sorted(self._values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, entry):
+                cumulative += n
+                le = _format_labels(self.labels, labels, f'le="{bound}"')
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+            inf = _format_labels(self.labels, labels, 'le="+Inf"')
+            lines.append(f'{self.name}_bucket{inf} {entry[-1]}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, labels)} {entry[-2]:.6f}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, labels)} {entry[-1]}')
+        return lines
+
+
+request_seconds = Histogram(
+    'pmt_request_duration_seconds', 'Request wall time.', REQUEST_BUCKETS,
+    ('endpoint', 'project', 'status'))
+request_statements = Histogram(
+    'pmt_request_sql_statements', 'SQL statements executed per request.', STATEMENT_COUNT_BUCKETS,
+    ('endpoint', 'project'))
+request_sql_seconds = Histogram(
+    'pmt_request_sql_duration_seconds', 'Total SQL time per request.', REQUEST_BUCKETS,
+    ('endpoint', 'project'))
+statement_seconds = Histogram(
+    'pmt_sql_statement_duration_seconds', 'SQL statement execution time.', SQL_BUCKETS,
+    ('endpoint', 'kind'))
+slow_statements = Counter(
+    'pmt_sql_slow_statements_total', 'Statements slower than the slow query threshold.',
+    ('endpoint',))
+lock_timeouts = Counter(
+    'pmt_sql_lock_timeouts_total', 'Statements that gave up waiting for a SQLite lock.',
+    ('endpoint',))
+
+METRICS = (request_seconds, request_statements, request_sql_seconds, statement_seconds,
+           slow_statements, lock_timeouts)
+
+
+def _endpoint():
+    # Statements outside a request come from CLI commands and start-up
+    if not has_request_context():
+        return 'none'
+    return request.endpoint or 'unmatched'
+
+
+def _kind(statement):
+    word = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else ''
+    return word if word in ('select', 'insert', 'update', 'delete', 'with') else 'other'
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_statement(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('statement_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _end_statement(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['statement_start'].pop()
+    endpoint = _endpoint()
+    statement_seconds.observe((endpoint, _kind(statement)), elapsed)
+    if has_request_context():
+        g.sql_seconds = g.get('sql_seconds', 0.0) + elapsed
+    if slow_query_seconds is not None and elapsed >= slow_query_seconds:
+        slow_statements.inc((endpoint,))
+        logger.warning('slow query (%.3fs) in %s: %s', elapsed, endpoint,
+                       ' '.join(statement.split())[:LOG_STATEMENT_CHARS])
+
+
+@event.listens_for(Engine, 'handle_error')
+def _statement_error(context):
+    starts = context.connection.info.get('statement_start') if context.connection is not None else None
+    if starts:
+        # after_cursor_execute does not run for failed statements
+        starts.pop()
+    if 'database is locked' in str(context.original_exception):
+        lock_timeouts.inc((_endpoint(),))
+
+
+def _finish_request(status):
+    if g.get('request_recorded') or 'request_start' not in g:
+        return
+    g.request_recorded = True
+    elapsed = time.perf_counter() - g.request_start
+    endpoint, project = _endpoint(), g.get('metrics_project', '')
+    request_seconds.observe((endpoint, project, str(status)), elapsed)
+    request_statements.observe((endpoint, project), query_budget.query_count())
+    request_sql_seconds.observe((endpoint, project), g.get('sql_seconds', 0.0))
+    if slow_request_seconds is not None and elapsed >= slow_request_seconds:
+        logger.warning('slow request (%.3fs, %d statements, %.3fs SQL) %s %s [%s]',
+                       elapsed, query_budget.query_count(), g.get('sql_seconds', 0.0),
+                       request.method, request.path, project)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    with _lock:
+        lines = [line for metric in METRICS for line in metric.render()]
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app):
+    global slow_query_seconds, slow_request_seconds
+    app.config.setdefault('SLOW_QUERY_SECONDS', slow_query_seconds)
+    app.config.setdefault('SLOW_REQUEST_SECONDS', slow_request_seconds)
+    slow_query_seconds = app.config['SLOW_QUERY_SECONDS']
+    slow_request_seconds = app.config['SLOW_REQUEST_SECONDS']
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+        g.metrics_project = session.get('project', '')
+
+    @app.after_request
+    def record_request(response):
+        _finish_request(response.status_code)
+        return response
+
+    @app.teardown_request
+    def record_failed_request(exc):
+        # after_request is skipped when the view raised
+        if exc is not None:
+            _finish_request(500)
@@ -0,0 +1,258 @@
+"""In-process background jobs for long-running project operations.
+
+Job functions are registered by kind with ``@job('kind')`` and called as
+``fn(ctx, **params)`` on a thread pool, inside an app context routed to the
+job's project (``g.project_path``).  The return value is stored as the
+job's JSON result; an exception fails the job and rolls back its session.
+
+Job state lives in the ``jobs`` table of the master database so status
+survives the request that started it.  Jobs on the same project database
+run one at a time in submission order: a project's queue is fed to the
+pool only while none of its jobs is running, so waiting jobs never tie up
+a worker thread.
+
+Cancelling a queued job drops it; a running job is flagged and stops at its
+next ``ctx.progress()`` or ``ctx.check_cancelled()`` call.  Jobs are lost
+with the process that queued them.  Each runner refreshes ``heartbeat_at``
+on its unfinished jobs, and ``recover()`` fails only jobs whose heartbeat
+went stale, so it is safe to call from every process.
+
+A running job holds ``writer_lock(project_path)``; request handlers that
+write to the same project take it too, so they wait for (or are refused
+during) a job instead of failing on SQLite's busy timeout mid-request.
+"""
+import json
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import g
+from sqlalchemy import func, select, update
+
+from models import db, Job
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = 'queued', 'running', 'succeeded', 'failed', 'cancelled'
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+DEFAULT_WORKERS = 4
+# Minimum seconds between progress writes to the master database
+PROGRESS_INTERVAL = 0.5
+# Seconds between heartbeats; jobs silent for STALE_AFTER are presumed dead
+HEARTBEAT_INTERVAL = 15
+STALE_AFTER = 4 * HEARTBEAT_INTERVAL
+
+_jobs = Job.__table__
+_registry = {}
+
+
+class JobCancelled(Exception):
+    """Raised inside a job function once cancellation was requested."""
+
+
+def job(kind):
+    """Register the decorated function as the handler for ``kind``."""
+    def decorator(fn):
+        _registry[kind] = fn
+        return fn
+    return decorator
+
+
+def as_dict(row):
+    return {
+        'id': row.id,
+        'kind': row.kind,
+        'status': row.status,
+        'progress': row.progress,
+        'message': row.message,
+        'result': json.loads(row.result) if row.result else None,
+        'error': row.error,
+        'cancel_requested': bool(row.cancel_requested),
+        'created_at': row.created_at.isoformat() if row.created_at else None,
+        'started_at': row.started_at.isoformat() if row.started_at else None,
+        'finished_at': row.finished_at.isoformat() if row.finished_at else None,
+    }
+
+
+class JobContext:
+    """Handle passed to job functions for progress reports and cancellation."""
+
+    def __init__(self, runner, job_id):
+        self.runner = runner
+        self.job_id = job_id
+        self._written = 0.0
+
+    def check_cancelled(self):
+        if self.job_id in self.runner._cancelled:
+            raise JobCancelled()
+
+    def progress(self, percent, message=None):
+        """Record progress (0-100); raises ``JobCancelled`` if cancelled."""
+        self.check_cancelled()
+        now = time.monotonic()
+        if now - self._written >= PROGRESS_INTERVAL:
+            self._written = now
+            self.runner._update(self.job_id, progress=max(0, min(int(percent), 100)), message=message)
+
+
+class JobRunner:
+    """Thread pool with per-project FIFO queues."""
+
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self.workers = workers
+        self.app = None
+        self._executor = None
+        self._lock = threading.Lock()
+        # project path -> queued job ids; a key exists while a job of it runs
+        self._queues = {}
+        self._cancelled = set()
+        # Unfinished jobs of this process, kept alive by the heartbeat
+        self._active = set()
+        self._writers = {}
+        self._stopped = threading.Event()
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.setdefault('JOB_WORKERS', self.workers)
+
+    def _engine(self):
+        return db.engines['users']
+
+    def _update(self, job_id, **values):
+        with self.app.app_context(), self._engine().begin() as conn:
+            conn.execute(update(_jobs).where(_jobs.c.id == job_id).values(**values))
+
+    def recover(self):
+        """Fail unfinished jobs whose process stopped sending heartbeats."""
+        now = datetime.utcnow()
+        last_seen = func.coalesce(_jobs.c.heartbeat_at, _jobs.c.created_at)
+        with self._engine().begin() as conn:
+            return conn.execute(
+                update(_jobs).where(_jobs.c.status.in_((QUEUED, RUNNING)),
+                                    last_seen < now - timedelta(seconds=STALE_AFTER))
+                .values(status=FAILED, error='interrupted by a restart', finished_at=now)).rowcount
+
+    def _heartbeat(self):
+        with self.app.app_context():
+            while not self._stopped.wait(HEARTBEAT_INTERVAL):
+                with self._lock:
+                    active = list(self._active)
+                if not active:
+                    continue
+                try:
+                    with self._engine().begin() as conn:
+                        conn.execute(update(_jobs).where(_jobs.c.id.in_(active))
+                                     .values(heartbeat_at=datetime.utcnow()))
+                except Exception:
+                    logger.exception('job heartbeat failed')
+
+    def writer_lock(self, project_path):
+        """Lock serialising writes to ``project_path`` between jobs and requests."""
+        with self._lock:
+            return self._writers.setdefault(project_path, threading.Lock())
+
+    def submit(self, kind, project_path=None, params=None, user_id=None):
+        """Queue a job and return its id."""
+        if kind not in _registry:
+            raise ValueError(f'unknown job kind: {kind}')
+        with self._engine().begin() as conn:
+            job_id = conn.execute(_jobs.insert().values(
+                kind=kind, project_path=project_path, user_id=user_id, status=QUEUED,
+                progress=0, cancel_requested=False, params=json.dumps(params or {}),
+                created_at=datetime.utcnow(), heartbeat_at=datetime.utcnow())).inserted_primary_key[0]
+        with self._lock:
+            self._active.add(job_id)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix='job')
+                self._stopped.clear()
+                threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True).start()
+            if project_path in self._queues:
+                self._queues[project_path].append(job_id)
+                return job_id
+            self._queues[project_path] = deque()
+        self._executor.submit(self._run, job_id, project_path)
+        return job_id
+
+    def _run(self, job_id, project_path):
+        try:
+            self._execute(job_id, project_path)
+        finally:
+            with self._lock:
+                self._active.discard(job_id)
+                queue = self._queues[project_path]
+                next_id = queue.popleft() if queue else None
+                if next_id is None:
+                    del self._queues[project_path]
+            if next_id is not None:
+                self._executor.submit(self._run, next_id, project_path)
+
+    def _execute(self, job_id, project_path):
+        with self.app.app_context():
+            with self._engine().begin() as conn:
+                # Only a still-queued job is started; a cancelled one is skipped
+                started = conn.execute(
+                    update(_jobs).where(_jobs.c.id == job_id, _jobs.c.status == QUEUED)
+                    .values(status=RUNNING, started_at=datetime.utcnow())).rowcount
+                row = conn.execute(select(_jobs.c.kind, _jobs.c.params)
+                                   .where(_jobs.c.id == job_id)).first()
+            if not started:
+                self._cancelled.discard(job_id)
+                return
+            g.project_path = project_path
+            values = {}
+            try:
+                with self.writer_lock(project_path):
+                    result = _registry[row.kind](JobContext(self, job_id), **json.loads(row.params))
+                values = {'status': SUCCEEDED, 'progress': 100, 'message': None,
+                          'result': json.dumps(result, default=str) if result is not None else None}
+            except JobCancelled:
+                db.session.rollback()
+                values = {'status': CANCELLED, 'message': 'cancelled'}
+            except Exception as exc:
+                logger.exception('job %s (%s) failed', job_id, row.kind)
+                db.session.rollback()
+                values = {'status': FAILED, 'error': str(exc)}
+            finally:
+                self._cancelled.discard(job_id)
+                values['finished_at'] = datetime.utcnow()
+                self._update(job_id, **values)
+
+    def cancel(self, job_id):
+        """Request cancellation; returns False if the job already finished."""
+        with self._engine().begin() as conn:
+            # A queued job is cancelled outright and skipped when its turn comes
+            dropped = conn.execute(
+                update(_jobs).where(_jobs.c.id == job_id, _jobs.c.status == QUEUED)
+                .values(status=CANCELLED, message='cancelled', cancel_requested=True,
+                        finished_at=datetime.utcnow())).rowcount
+            flagged = conn.execute(update(_jobs).where(_jobs.c.id == job_id, _jobs.c.status == RUNNING)
+                                   .values(cancel_requested=True)).rowcount
+        if flagged:
+            self._cancelled.add(job_id)
+        return bool(dropped or flagged)
+
+    def get(self, job_id):
+        with self._engine().connect() as conn:
+            row = conn.execute(select(_jobs).where(_jobs.c.id == job_id)).first()
+        return row
+
+    def recent(self, user_id=None, limit=50):
+        stmt = select(_jobs).order_by(_jobs.c.id.desc()).limit(limit)
+        if user_id is not None:
+            stmt = stmt.where(_jobs.c.user_id == user_id)
+        with self._engine().connect() as conn:
+            return conn.execute(stmt).all()
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._stopped.set()
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+runner = JobRunner()
@@ -0,0 +1,73 @@
+"""Cached project metrics for the dashboard.
+
+Task counts and average progress are computed with one SQL aggregate and
+kept per project database, together with any other task-derived values
+registered through ``cached()`` (e.g. the burndown series).  Entries are
+keyed by the project data version (``versions.project_version()``), so a
+write from any process or thread retires them, and by today's date, since
+"overdue" depends on it.  A warm hit costs the version lookup only.
+"""
+import threading
+from datetime import date
+
+from sqlalchemy import func, case
+
+from models import db, Task
+from routing import current_project_path
+import versions
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def invalidate(key=None):
+    """Drop cached metrics for ``key`` (default: the active project)."""
+    with _lock:
+        _cache.pop(key or current_project_path(), None)
+
+
+def cached(name, compute, today=None):
+    """Return ``compute()`` for the active project, cached until the data changes."""
+    today = today or date.today()
+    key = current_project_path()
+    # Read before computing: if a write lands in between, the value is stored
+    # under the older version and never served again
+    version = (versions.project_version(), today)
+    with _lock:
+        entry = _cache.get(key)
+        if entry is not None and entry['version'] == version and name in entry['values']:
+            return entry['values'][name]
+    value = compute()
+    if versions.has_pending_writes():
+        # Uncommitted data must not be cached
+        return value
+    with _lock:
+        entry = _cache.get(key)
+        if entry is None or entry['version'] != version:
+            entry = _cache[key] = {'version': version, 'values': {}}
+        entry['values'][name] = value
+    return value
+
+
+def compute_summary(today=None):
+    """Task totals for the active project in a single aggregate query."""
+    today = today or date.today()
+    total, completed, overdue, avg_progress = db.session.query(
+        func.count(Task.id),
+        func.coalesce(func.sum(case((Task.progress == 100, 1), else_=0)), 0),
+        func.coalesce(func.sum(case(((Task.progress < 100) & (Task.end_date < today), 1), else_=0)), 0),
+        func.coalesce(func.avg(Task.progress), 0),
+    ).one()
+    return {
+        'total_tasks': total,
+        'completed_tasks': completed,
+        'overdue_tasks': overdue,
+        'progress_rate': int(completed / total * 100) if total else 0,
+        'avg_progress': int(avg_progress),
+    }
+
+
+def summary(today=None):
+    """Cached ``compute_summary()``."""
+    today = today or date.today()
+    return cached('summary', lambda: compute_summary(today), today)
@@ -0,0 +1,293 @@
+"""Versioned schema migrations for project and master databases.
+
+Each database stores the number of applied migrations in
+``PRAGMA user_version``.  Opening a database whose schema is already current
+costs a single integer read; otherwise the pending migrations run in order
+and the version is bumped after each one.
+
+Append new migrations to the end of ``PROJECT_MIGRATIONS`` or
+``MASTER_MIGRATIONS``; never reorder or remove existing entries.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from sqlalchemy import create_engine, text
+
+from routing import apply_sqlite_profile
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(text(f'PRAGMA table_info({table})'))}
+
+
+# Schemas are spelled out rather than created from the live models,
+# so a later model change cannot alter what these migrations create.
+PROJECT_TABLES = (
+    'CREATE TABLE IF NOT EXISTS resource ('
+    ' id INTEGER NOT NULL, name VARCHAR(100) NOT NULL, role VARCHAR(100), color VARCHAR(20),'
+    ' utilization INTEGER, PRIMARY KEY (id))',
+    'CREATE TABLE IF NOT EXISTS members ('
+    ' id INTEGER NOT NULL, name VARCHAR(100) NOT NULL, PRIMARY KEY (id), UNIQUE (name))',
+    'CREATE TABLE IF NOT EXISTS tasks ('
+    ' id INTEGER NOT NULL, name VARCHAR(100) NOT NULL, start_date DATE NOT NULL,'
+    ' end_date DATE NOT NULL, remarks TEXT, progress INTEGER NOT NULL, parent_id INTEGER,'
+    ' assignee_id INTEGER, resource_id INTEGER, depends_on_id INTEGER, is_milestone BOOLEAN,'
+    ' updated_at DATETIME, PRIMARY KEY (id),'
+    ' FOREIGN KEY(parent_id) REFERENCES tasks (id),'
+    ' FOREIGN KEY(assignee_id) REFERENCES members (id),'
+    ' FOREIGN KEY(resource_id) REFERENCES resource (id),'
+    ' FOREIGN KEY(depends_on_id) REFERENCES tasks (id))',
+    'CREATE TABLE IF NOT EXISTS task_dependencies ('
+    ' id INTEGER NOT NULL, predecessor_id INTEGER NOT NULL, successor_id INTEGER NOT NULL,'
+    ' PRIMARY KEY (id),'
+    ' FOREIGN KEY(predecessor_id) REFERENCES tasks (id),'
+    ' FOREIGN KEY(successor_id) REFERENCES tasks (id))',
+)
+
+HOT_QUERY_INDEXES = (
+    'CREATE INDEX IF NOT EXISTS ix_tasks_start_date ON tasks (start_date, id)',
+    'CREATE INDEX IF NOT EXISTS ix_tasks_end_date_progress ON tasks (end_date, progress)',
+    'CREATE INDEX IF NOT EXISTS ix_tasks_parent_id ON tasks (parent_id)',
+    'CREATE INDEX IF NOT EXISTS ix_tasks_assignee_id ON tasks (assignee_id)',
+    'CREATE INDEX IF NOT EXISTS ix_task_dependencies_predecessor'
+    ' ON task_dependencies (predecessor_id, successor_id)',
+    'CREATE INDEX IF NOT EXISTS ix_task_dependencies_successor'
+    ' ON task_dependencies (successor_id, predecessor_id)',
+)
+
+CHANGE_LOG_TABLE = (
+    'CREATE TABLE IF NOT EXISTS change_log ('
+    ' id INTEGER NOT NULL, entity VARCHAR(20) NOT NULL, entity_id INTEGER NOT NULL,'
+    ' op VARCHAR(10) NOT NULL, created_at DATETIME NOT NULL, PRIMARY KEY (id))'
+)
+
+WBS_ROLLUPS_TABLE = (
+    'CREATE TABLE IF NOT EXISTS wbs_rollups ('
+    ' task_id INTEGER NOT NULL, start_date DATE NOT NULL, end_date DATE NOT NULL,'
+    ' work INTEGER NOT NULL, done FLOAT NOT NULL, progress INTEGER NOT NULL,'
+    ' PRIMARY KEY (task_id), FOREIGN KEY(task_id) REFERENCES tasks (id))'
+)
+
+PROGRESS_HISTORY_TABLE = (
+    'CREATE TABLE IF NOT EXISTS progress_history ('
+    ' day DATE NOT NULL, task_id INTEGER NOT NULL, progress INTEGER,'
+    ' PRIMARY KEY (day, task_id)) WITHOUT ROWID',
+    'CREATE INDEX IF NOT EXISTS ix_progress_history_task_day ON progress_history (task_id, day)',
+)
+
+MASTER_TABLES = (
+    'CREATE TABLE IF NOT EXISTS user ('
+    ' id INTEGER NOT NULL, username VARCHAR(80) NOT NULL, password_hash VARCHAR(128) NOT NULL,'
+    ' role VARCHAR(20) NOT NULL, PRIMARY KEY (id), UNIQUE (username))',
+    'CREATE TABLE IF NOT EXISTS project ('
+    ' id INTEGER NOT NULL, name VARCHAR(100) NOT NULL, path VARCHAR(255) NOT NULL,'
+    ' PRIMARY KEY (id), UNIQUE (name))',
+)
+
+# heartbeat_at is added by a later migration
+JOBS_TABLE = (
+    'CREATE TABLE IF NOT EXISTS jobs ('
+    ' id INTEGER NOT NULL, kind VARCHAR(50) NOT NULL, project_path VARCHAR(255), user_id INTEGER,'
+    ' status VARCHAR(20) NOT NULL, progress INTEGER NOT NULL, message VARCHAR(255),'
+    ' cancel_requested BOOLEAN NOT NULL, params TEXT, result TEXT, error TEXT,'
+    ' created_at DATETIME NOT NULL, started_at DATETIME, finished_at DATETIME, PRIMARY KEY (id))',
+    'CREATE INDEX IF NOT EXISTS ix_jobs_status ON jobs (status)',
+    'CREATE INDEX IF NOT EXISTS ix_jobs_user_id ON jobs (user_id, id)',
+)
+
+
+def _create_project_tables(conn):
+    """Create project tables and add columns missing from early databases."""
+    for ddl in PROJECT_TABLES:
+        conn.execute(text(ddl))
+    cols = _columns(conn, 'tasks')
+    for name, ddl in (('remarks', 'TEXT'), ('parent_id', 'INTEGER'), ('assignee_id', 'INTEGER')):
+        if name not in cols:
+            conn.execute(text(f'ALTER TABLE tasks ADD COLUMN {name} {ddl}'))
+
+
+def _add_hot_query_indexes(conn):
+    """Index the columns the task, Gantt and burndown queries filter on."""
+    for ddl in HOT_QUERY_INDEXES:
+        conn.execute(text(ddl))
+
+
+def _add_updated_at_index(conn):
+    """Index updated_at so the project data version is a single seek."""
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_tasks_updated_at ON tasks (updated_at)'))
+
+
+def _create_change_log(conn):
+    """Table backing the /changes feed."""
+    conn.execute(text(CHANGE_LOG_TABLE))
+
+
+def _create_wbs_rollups(conn):
+    """Materialized WBS roll-ups; left empty so the first read rebuilds them."""
+    conn.execute(text(WBS_ROLLUPS_TABLE))
+
+
+def _create_task_search(conn):
+    """FTS5 index over task names and remarks, kept in sync by triggers.
+
+    The trigram tokenizer matches substrings, which also works for Japanese
+    text without word boundaries.
+    """
+    conn.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5("
+        "name, remarks, content='tasks', content_rowid='id', tokenize='trigram case_sensitive 0')"))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks BEGIN "
+        "INSERT INTO tasks_fts(rowid, name, remarks) VALUES (new.id, new.name, new.remarks); END"))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN "
+        "INSERT INTO tasks_fts(tasks_fts, rowid, name, remarks) VALUES ('delete', old.id, old.name, old.remarks); END"))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF name, remarks ON tasks BEGIN "
+        "INSERT INTO tasks_fts(tasks_fts, rowid, name, remarks) VALUES ('delete', old.id, old.name, old.remarks); "
+        "INSERT INTO tasks_fts(rowid, name, remarks) VALUES (new.id, new.name, new.remarks); END"))
+    conn.execute(text("INSERT INTO tasks_fts(tasks_fts) VALUES ('rebuild')"))
+
+
+def _create_progress_history(conn):
+    """Progress history, seeded with every task's current progress."""
+    for ddl in PROGRESS_HISTORY_TABLE:
+        conn.execute(text(ddl))
+    conn.execute(text('INSERT OR IGNORE INTO progress_history (day, task_id, progress) '
+                      'SELECT :day, id, progress FROM tasks'), {'day': date.today().isoformat()})
+
+
+# Characters of name + remarks indexed per task for short search terms;
+# longer texts get an empty gram so searches always check them
+BIGRAM_TEXT_LIMIT = 2000
+
+
+def _bigrams(row, source=None):
+    """SELECT producing ``(gram, task_id)`` rows for the task ``row``.
+
+    ``source`` is a FROM item defining ``row``; triggers use ``new`` instead.
+    """
+    body = f"lower({row}.name || char(10) || coalesce({row}.remarks, ''))"
+    positions = f'{source} JOIN search_positions p' if source else 'search_positions p'
+    overflow = f' FROM {source}' if source else ''
+    return (f'SELECT substr({body}, p.n, 2), {row}.id FROM {positions} WHERE p.n <= length({body}) '
+            f"UNION ALL SELECT '', {row}.id{overflow} WHERE length({body}) > {BIGRAM_TEXT_LIMIT}")
+
+
+def _create_short_term_index(conn):
+    """Bigram index so one- and two-character search terms avoid a full scan.
+
+    Every two-character substring of a task's lower-cased name and remarks
+    (and the last single character) is stored with the task id.  Triggers
+    cannot use recursive CTEs, so they join a fixed table of character positions.
+    """
+    conn.execute(text('CREATE TABLE IF NOT EXISTS search_positions (n INTEGER PRIMARY KEY)'))
+    conn.execute(text(
+        'INSERT OR IGNORE INTO search_positions (n) '
+        'WITH RECURSIVE p(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM p WHERE n < :limit) '
+        'SELECT n FROM p'), {'limit': BIGRAM_TEXT_LIMIT})
+    conn.execute(text(
+        'CREATE TABLE IF NOT EXISTS task_bigrams ('
+        ' gram TEXT NOT NULL, task_id INTEGER NOT NULL, PRIMARY KEY (gram, task_id)) WITHOUT ROWID'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_task_bigrams_task_id ON task_bigrams (task_id)'))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS task_bigrams_insert AFTER INSERT ON tasks BEGIN "
+        f"INSERT OR IGNORE INTO task_bigrams (gram, task_id) {_bigrams('new')}; END"))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS task_bigrams_delete AFTER DELETE ON tasks BEGIN "
+        "DELETE FROM task_bigrams WHERE task_id = old.id; END"))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS task_bigrams_update AFTER UPDATE OF name, remarks ON tasks BEGIN "
+        "DELETE FROM task_bigrams WHERE task_id = old.id; "
+        f"INSERT OR IGNORE INTO task_bigrams (gram, task_id) {_bigrams('new')}; END"))
+    conn.execute(text(f"INSERT OR IGNORE INTO task_bigrams (gram, task_id) {_bigrams('t', 'tasks t')}"))
+
+
+def _create_master_tables(conn):
+    """Create user/project tables and add the role column to old user tables."""
+    for ddl in MASTER_TABLES:
+        conn.execute(text(ddl))
+    if 'role' not in _columns(conn, 'user'):
+        conn.execute(text("ALTER TABLE user ADD COLUMN role VARCHAR DEFAULT 'Viewer'"))
+        conn.execute(text("UPDATE user SET role='Viewer'"))
+
+
+def _create_jobs(conn):
+    """Background job state."""
+    for ddl in JOBS_TABLE:
+        conn.execute(text(ddl))
+
+
+def _add_job_heartbeat(conn):
+    """Heartbeat column so only jobs of dead processes are recovered."""
+    if 'heartbeat_at' not in _columns(conn, 'jobs'):
+        conn.execute(text('ALTER TABLE jobs ADD COLUMN heartbeat_at DATETIME'))
+
+
+PROJECT_MIGRATIONS = [
+    _create_project_tables,
+    _add_hot_query_indexes,
+    _add_updated_at_index,
+    _create_change_log,
+    _create_wbs_rollups,
+    _create_task_search,
+    _create_progress_history,
+    _create_short_term_index,
+]
+
+MASTER_MIGRATIONS = [
+    _create_master_tables,
+    _create_jobs,
+    _add_job_heartbeat,
+]
+
+
+def schema_version(conn):
+    return conn.execute(text('PRAGMA user_version')).scalar()
+
+
+def upgrade(engine, migrations):
+    """Apply pending ``migrations`` to ``engine`` and return the new version."""
+    with engine.connect() as conn:
+        if schema_version(conn) >= len(migrations):
+            return len(migrations)
+    with engine.connect() as conn:
+        # pysqlite only opens a transaction before DML, so take the write lock
+        # explicitly: concurrent openers (threads or processes) wait here, and
+        # the re-read below sees whatever the winner applied
+        conn.exec_driver_sql('BEGIN IMMEDIATE')
+        current = schema_version(conn)
+        for number, migration in enumerate(migrations[current:], start=current + 1):
+            migration(conn)
+            conn.execute(text(f'PRAGMA user_version = {number}'))
+        conn.commit()
+    return len(migrations)
+
+
+def upgrade_project(engine):
+    return upgrade(engine, PROJECT_MIGRATIONS)
+
+
+def upgrade_master(engine):
+    return upgrade(engine, MASTER_MIGRATIONS)
+
+
+def _upgrade_file(path):
+    engine = apply_sqlite_profile(create_engine(f'sqlite:///{path}'))
+    try:
+        with engine.connect() as conn:
+            before = schema_version(conn)
+        return path, before, upgrade_project(engine), None
+    except Exception as exc:  # report and keep going with the other files
+        return path, None, None, str(exc)
+    finally:
+        engine.dispose()
+
+
+def upgrade_project_files(paths, workers=4):
+    """Upgrade many project database files concurrently.
+
+    Returns ``(path, old_version, new_version, error)`` tuples in input order.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_upgrade_file, paths))
@@ -3,10 +3,13 @@ from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 
+from routing import RoutingSession
+
 # database instance
-# 'db' is used for task databases (per project) and also binds to the user database
+# 'db' is used for task databases (per project) and also binds to the user database.
+# Project tables are routed to the active project's engine on each request.
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class User(UserMixin, db.Model):
     __bind_key__ = 'users'
@@ -37,6 +40,14 @@ class Member(db.Model):
 
 class Task(db.Model):
     __tablename__ = 'tasks'
+    __table_args__ = (
+        db.Index('ix_tasks_start_date', 'start_date', 'id'),
+        # covers the burndown GROUP BY end_date WHERE progress < 100
+        db.Index('ix_tasks_end_date_progress', 'end_date', 'progress'),
+        db.Index('ix_tasks_parent_id', 'parent_id'),
+        db.Index('ix_tasks_assignee_id', 'assignee_id'),
+        db.Index('ix_tasks_updated_at', 'updated_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -68,6 +79,10 @@ class Task(db.Model):
 
 class TaskDependency(db.Model):
     __tablename__ = 'task_dependencies'
+    __table_args__ = (
+        db.Index('ix_task_dependencies_predecessor', 'predecessor_id', 'successor_id'),
+        db.Index('ix_task_dependencies_successor', 'successor_id', 'predecessor_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     predecessor_id = db.Column(db.Integer, db.ForeignKey('tasks.id'), nullable=False)
@@ -88,3 +103,73 @@ class Project(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
     path = db.Column(db.String(255), nullable=False)
+
+
+class Job(db.Model):
+    """Background job state in the master database, maintained by ``jobs``."""
+
+    __bind_key__ = 'users'
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_status', 'status'),
+        db.Index('ix_jobs_user_id', 'user_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    # Database path the job writes to; jobs on the same path run one at a time
+    project_path = db.Column(db.String(255))
+    user_id = db.Column(db.Integer)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    message = db.Column(db.String(255))
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    # JSON encoded
+    params = db.Column(db.Text)
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    # Refreshed by the runner that owns the job; see jobs.recover()
+    heartbeat_at = db.Column(db.DateTime)
+
+
+class ChangeLog(db.Model):
+    """Append-only log of project data changes; ``id`` is the feed cursor."""
+
+    __tablename__ = 'change_log'
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class WbsRollup(db.Model):
+    """Materialized roll-up of one task's WBS subtree, maintained by ``wbs``."""
+
+    __tablename__ = 'wbs_rollups'
+    task_id = db.Column(db.Integer, db.ForeignKey('tasks.id'), primary_key=True)
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date, nullable=False)
+    # Leaf task days in the subtree, and the completed share of them
+    work = db.Column(db.Integer, nullable=False, default=0)
+    done = db.Column(db.Float, nullable=False, default=0)
+    progress = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ProgressHistory(db.Model):
+    """Progress of a task as of ``day``; a row is written whenever it changes."""
+
+    __tablename__ = 'progress_history'
+    __table_args__ = (
+        db.Index('ix_progress_history_task_day', 'task_id', 'day'),
+        {'sqlite_with_rowid': False},
+    )
+
+    day = db.Column(db.Date, primary_key=True)
+    # No foreign key: history outlives deleted tasks
+    task_id = db.Column(db.Integer, primary_key=True)
+    # NULL from the day the task was deleted
+    progress = db.Column(db.Integer, nullable=True)
@@ -0,0 +1,218 @@
+"""Single-file project packages.
+
+A package (``*.pmtpkg``) is a zip archive holding ``manifest.json`` and a
+deflate-compressed ``project.db``.  The manifest records the project name,
+schema version, size and SHA-256 of the database, so a package can be
+checked before anything is written.
+
+``create()`` snapshots a live project with SQLite's online backup API from
+a read-only connection.  In WAL mode the copy runs as a single read
+transaction, so it is consistent and never blocks writers.  The snapshot
+is then streamed into the archive.
+
+A package can be opened in two ways:
+
+* ``extract()`` streams the database into place (verifying size and hash
+  on the way) so it becomes an ordinary project file;
+* ``mount_engine()`` serves it read-only without writing anything to disk:
+  the database is decompressed with ``sqlite3.Connection.deserialize`` and
+  copied into a shared-cache memory database that each pooled connection
+  opens separately.  Registered project paths ending in
+  ``PACKAGE_SUFFIX`` are mounted this way by the engine pool.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import uuid
+import zipfile
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
+
+import migrations
+import wbs
+from routing import apply_sqlite_profile
+
+PACKAGE_SUFFIX = '.pmtpkg'
+FORMAT = 1
+MANIFEST = 'manifest.json'
+DATABASE = 'project.db'
+COMPRESS_LEVEL = 6
+CHUNK_SIZE = 1 << 20
+
+
+class PackageError(ValueError):
+    """Raised for archives that are not valid project packages."""
+
+
+def is_package(path):
+    return bool(path) and path.endswith(PACKAGE_SUFFIX)
+
+
+def _snapshot(path, target):
+    """Consistent copy of the database at ``path`` into ``target``."""
+    source = sqlite3.connect(f'file:{quote(path)}?mode=ro', uri=True)
+    dest = sqlite3.connect(target)
+    try:
+        # One step keeps a single read transaction; writers carry on under WAL
+        source.backup(dest)
+        dest.execute('PRAGMA journal_mode=DELETE')
+        schema = dest.execute('PRAGMA user_version').fetchone()[0]
+        tasks = dest.execute('SELECT count(*) FROM tasks').fetchone()[0]
+    finally:
+        dest.close()
+        source.close()
+    return schema, tasks
+
+
+def create(path, output, name):
+    """Write a package of the project database at ``path`` to ``output``.
+
+    Returns the manifest.
+    """
+    directory = os.path.dirname(os.path.abspath(output))
+    fd, snapshot = tempfile.mkstemp(suffix='.db', dir=directory)
+    os.close(fd)
+    partial = output + '.part'
+    try:
+        schema, tasks = _snapshot(path, snapshot)
+        digest = hashlib.sha256()
+        with zipfile.ZipFile(partial, 'w', zipfile.ZIP_DEFLATED, compresslevel=COMPRESS_LEVEL) as archive:
+            with open(snapshot, 'rb') as src, archive.open(DATABASE, 'w', force_zip64=True) as dst:
+                while chunk := src.read(CHUNK_SIZE):
+                    digest.update(chunk)
+                    dst.write(chunk)
+            manifest = {
+                'format': FORMAT,
+                'name': name,
+                'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'schema_version': schema,
+                'sqlite_version': sqlite3.sqlite_version,
+                'tasks': tasks,
+                'size': os.path.getsize(snapshot),
+                'sha256': digest.hexdigest(),
+            }
+            archive.writestr(MANIFEST, json.dumps(manifest, ensure_ascii=False, indent=2))
+        os.replace(partial, output)
+    finally:
+        os.remove(snapshot)
+        if os.path.exists(partial):
+            os.remove(partial)
+    return manifest
+
+
+def _manifest(archive):
+    try:
+        manifest = json.loads(archive.read(MANIFEST))
+    except KeyError:
+        raise PackageError('manifest.json is missing') from None
+    if manifest.get('format') != FORMAT:
+        raise PackageError(f"unsupported package format {manifest.get('format')!r}")
+    if manifest.get('schema_version', 0) > len(migrations.PROJECT_MIGRATIONS):
+        raise PackageError('package was written by a newer version of the application')
+    return manifest
+
+
+def _open(path):
+    try:
+        return zipfile.ZipFile(path)
+    except (zipfile.BadZipFile, OSError) as e:
+        raise PackageError(f'cannot read package: {e}') from None
+
+
+def read_manifest(path):
+    with _open(path) as archive:
+        return _manifest(archive)
+
+
+def extract(path, target):
+    """Stream the package database to ``target``; returns the manifest.
+
+    The file only appears at ``target`` once its size and hash are verified.
+    """
+    if os.path.exists(target):
+        raise PackageError(f'{target} already exists')
+    os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+    partial = target + '.part'
+    with _open(path) as archive:
+        manifest = _manifest(archive)
+        digest = hashlib.sha256()
+        try:
+            with archive.open(DATABASE) as src, open(partial, 'wb') as dst:
+                while chunk := src.read(CHUNK_SIZE):
+                    digest.update(chunk)
+                    dst.write(chunk)
+            if os.path.getsize(partial) != manifest['size'] or digest.hexdigest() != manifest['sha256']:
+                raise PackageError('database does not match the manifest')
+            os.replace(partial, target)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+    return manifest
+
+
+def _load(path):
+    """The verified database image inside a package."""
+    with _open(path) as archive:
+        manifest = _manifest(archive)
+        data = archive.read(DATABASE)
+    if hashlib.sha256(data).hexdigest() != manifest['sha256']:
+        raise PackageError('database does not match the manifest')
+    return data
+
+
+def connect(path, **kwargs):
+    """Plain ``sqlite3`` connection to an in-memory copy of a package database.
+
+    The copy is taken as stored, without migrations.
+    """
+    conn = sqlite3.connect(':memory:', **kwargs)
+    conn.deserialize(_load(path))
+    return conn
+
+
+def mount_engine(path):
+    """Read-only in-memory engine over the database inside a package."""
+    # The image is copied into a named shared-cache memory database, which
+    # stays alive while ``keeper`` is open; every pooled connection opens
+    # its own handle on it, so concurrent requests never share a connection
+    uri = f'file:pmtpkg-{uuid.uuid4().hex}?mode=memory&cache=shared'
+    keeper = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    image = connect(path)
+    try:
+        image.backup(keeper)
+    finally:
+        image.close()
+
+    def creator():
+        keeper  # held by the engine for the lifetime of the mount
+        return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+    engine = create_engine('sqlite://', creator=creator, poolclass=QueuePool)
+    # Bring old packages up to date and fill derived tables that readers
+    # would otherwise rebuild on first use, then refuse all writes
+    migrations.upgrade_project(engine)
+    with Session(engine) as session:
+        if session.execute(text('SELECT 1 FROM wbs_rollups LIMIT 1')).first() is None:
+            wbs.rebuild(session)
+            session.commit()
+    engine.dispose()
+
+    @event.listens_for(engine, 'connect')
+    def set_query_only(dbapi_conn, connection_record):
+        dbapi_conn.execute('PRAGMA query_only = ON')
+
+    return engine
+
+
+def engine_for(path):
+    """Engine pool factory: mount packages, open plain database files."""
+    if is_package(path):
+        return mount_engine(path)
+    return apply_sqlite_profile(create_engine(f'sqlite:///{path}'))
+
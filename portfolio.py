@@ -0,0 +1,185 @@
+"""Portfolio summaries across every project database.
+
+Each project file is opened read-only with the plain ``sqlite3`` module (no
+engine, no migrations) and summarised on a thread pool: task totals, overdue
+count, open tasks per end date for the burndown, and the critical-path
+finish date; project packages are summarised from an in-memory copy of
+the database they hold.  A query that runs past the per-file timeout is
+interrupted, so one slow or locked file cannot hold up the whole portfolio.
+
+Summaries are cached per file keyed by the size and mtime of the database
+and its WAL plus the ``user_version`` in the file header, so a refresh only
+rescans projects that changed.  The cache also rolls over with the date,
+because "overdue" depends on today.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import date
+from urllib.parse import quote
+
+import burndown
+import packages
+from scheduling import Schedule, CycleError, task_duration
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 8
+DEFAULT_TIMEOUT = 10
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def file_key(path):
+    """Change key for a project file, or None if it does not exist."""
+    try:
+        stat = os.stat(path)
+        with open(path, 'rb') as f:
+            header = f.read(64)
+    except OSError:
+        return None
+    # user_version lives at offset 60 of the database header
+    user_version = int.from_bytes(header[60:64], 'big') if len(header) == 64 else 0
+    try:
+        wal = os.stat(path + '-wal')
+        wal_key = (wal.st_size, wal.st_mtime_ns)
+    except OSError:
+        wal_key = None
+    return stat.st_size, stat.st_mtime_ns, wal_key, user_version
+
+
+def _connect(path, timeout):
+    if packages.is_package(path):
+        # Packages are immutable zips; summarise an in-memory copy
+        conn = packages.connect(path, check_same_thread=False)
+    else:
+        conn = sqlite3.connect(f'file:{quote(path)}?mode=ro', uri=True, timeout=timeout,
+                               check_same_thread=False)
+    deadline = time.monotonic() + timeout
+    # Returning True aborts the running statement with OperationalError
+    conn.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+    return conn, deadline
+
+
+def summarize_file(path, today=None, timeout=DEFAULT_TIMEOUT):
+    """Summary dict for one project file; raises sqlite3.Error or TimeoutError."""
+    today = today or date.today()
+    conn, deadline = _connect(path, timeout)
+    try:
+        total, completed, overdue, avg_progress, first, last = conn.execute(
+            'SELECT count(*), coalesce(sum(progress = 100), 0),'
+            ' coalesce(sum(progress < 100 AND end_date < ?), 0), coalesce(avg(progress), 0),'
+            ' min(start_date), max(end_date) FROM tasks', (today.isoformat(),)).fetchone()
+        open_by_end = dict(conn.execute(
+            'SELECT end_date, count(*) FROM tasks WHERE progress < 100 GROUP BY end_date'))
+
+        tasks, edges = {}, []
+        for task_id, start, end, milestone, depends_on_id in conn.execute(
+                'SELECT id, start_date, end_date, is_milestone, depends_on_id FROM tasks'):
+            start, end = date.fromisoformat(start), date.fromisoformat(end)
+            tasks[task_id] = (start, task_duration(start, end, milestone))
+            if depends_on_id:
+                edges.append((depends_on_id, task_id))
+        edges.extend(conn.execute('SELECT predecessor_id, successor_id FROM task_dependencies'))
+    finally:
+        conn.close()
+    if time.monotonic() > deadline:
+        raise TimeoutError(f'timed out after {timeout}s')
+
+    try:
+        # Schedule() runs the forward/backward passes itself
+        finish = Schedule(tasks, edges).finish_date()
+    except CycleError:
+        finish = None
+    return {
+        'total_tasks': total,
+        'completed_tasks': completed,
+        'overdue_tasks': overdue,
+        'progress_rate': int(completed / total * 100) if total else 0,
+        'avg_progress': int(avg_progress),
+        'start_date': first,
+        'end_date': last,
+        'critical_finish': finish.isoformat() if finish else None,
+        'open_by_end': open_by_end,
+    }
+
+
+def _summary(name, path, today, timeout):
+    key = file_key(path)
+    if key is None:
+        return {'name': name, 'error': 'database file not found'}
+    with _lock:
+        entry = _cache.get(path)
+    if entry is not None and entry[0] == (key, today):
+        return dict(entry[1], name=name, cached=True)
+    try:
+        summary = summarize_file(path, today, timeout)
+    except (sqlite3.Error, TimeoutError, packages.PackageError) as e:
+        return {'name': name, 'error': str(e)}
+    except Exception as e:
+        # Malformed data (bad dates and the like) must not sink the whole portfolio
+        logger.exception('summary of %s failed', path)
+        return {'name': name, 'error': f'{type(e).__name__}: {e}'}
+    with _lock:
+        _cache[path] = ((key, today), summary)
+    return dict(summary, name=name, cached=False)
+
+
+def collect(projects, workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT, today=None):
+    """Summaries for ``(name, path)`` pairs, in the given order.
+
+    Projects that fail or do not finish within ``timeout`` seconds get an
+    ``error`` entry instead of figures.
+    """
+    today = today or date.today()
+    projects = list(projects)
+    if not projects:
+        return []
+    workers = max(1, min(workers, len(projects)))
+    pool = ThreadPoolExecutor(max_workers=workers)
+    futures = [pool.submit(_summary, name, path, today, timeout) for name, path in projects]
+    # Every file has its own deadline; this only guards against a stuck worker
+    wait(futures, timeout=timeout * (len(futures) / workers + 1))
+    pool.shutdown(wait=False, cancel_futures=True)
+    results = []
+    for (name, _), future in zip(projects, futures):
+        if future.done() and not future.cancelled():
+            results.append(future.result())
+        else:
+            results.append({'name': name, 'error': f'timed out after {timeout}s'})
+    return results
+
+
+def totals(summaries, bucket='auto'):
+    """Portfolio-wide figures and burndown from per-project ``summaries``."""
+    ok = [s for s in summaries if 'error' not in s]
+    total = sum(s['total_tasks'] for s in ok)
+    completed = sum(s['completed_tasks'] for s in ok)
+    open_by_end = Counter()
+    for s in ok:
+        open_by_end.update(s['open_by_end'])
+    starts = [s['start_date'] for s in ok if s['start_date']]
+    ends = [s['end_date'] for s in ok if s['end_date']]
+    series = []
+    if starts and ends:
+        start, end = date.fromisoformat(min(starts)), date.fromisoformat(max(ends))
+        if bucket == 'auto':
+            bucket = burndown.pick_bucket(start, end)
+        counts = {date.fromisoformat(d): n for d, n in open_by_end.items()}
+        series = burndown.series_from_counts(counts, start, end, bucket)
+    finishes = [s['critical_finish'] for s in ok if s['critical_finish']]
+    return {
+        'projects': len(summaries),
+        'failed': len(summaries) - len(ok),
+        'total_tasks': total,
+        'completed_tasks': completed,
+        'overdue_tasks': sum(s['overdue_tasks'] for s in ok),
+        'progress_rate': int(completed / total * 100) if total else 0,
+        'critical_finish': max(finishes, default=None),
+        'remaining_by_date': series,
+    }
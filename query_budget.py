@@ -0,0 +1,47 @@
+"""Per-request SQL statement budget for catching N+1 regressions.
+
+Every statement executed while handling a request is counted.  When the app
+runs in debug or testing mode and a route exceeds its budget, the request
+fails with ``QueryBudgetExceeded`` so the regression is noticed immediately.
+
+``QUERY_BUDGET`` sets the default budget and ``QUERY_BUDGETS`` maps endpoint
+names to overrides; None disables the check.  The count is checked after
+the view returned, when its transaction is already committed, so routes
+whose statement count grows with their input must be exempted.
+"""
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_BUDGET = 25
+
+
+class QueryBudgetExceeded(RuntimeError):
+    """Raised when a request issues more statements than allowed."""
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+
+def query_count():
+    """Number of statements executed so far in the current request."""
+    return g.get('query_count', 0)
+
+
+def init_app(app):
+    app.config.setdefault('QUERY_BUDGET', DEFAULT_BUDGET)
+    app.config.setdefault('QUERY_BUDGETS', {})
+
+    @app.after_request
+    def check_query_budget(response):
+        if not (app.debug or app.testing):
+            return response
+        budget = app.config['QUERY_BUDGETS'].get(request.endpoint, app.config['QUERY_BUDGET'])
+        count = query_count()
+        if budget is not None and count > budget:
+            raise QueryBudgetExceeded(
+                f'{request.endpoint} executed {count} SQL statements (budget {budget})')
+        return response
@@ -0,0 +1,206 @@
+"""Monte Carlo schedule risk analysis.
+
+Each task's remaining duration is scaled by a random factor drawn from a
+triangular or PERT distribution between ``optimistic`` and ``pessimistic``
+(most likely 1.0); completed work and milestones are fixed.  The CPM
+forward and backward passes then run for a whole block of samples at once:
+tasks are grouped into topological levels, and each level is one NumPy
+gather plus ``reduceat`` over its incoming (or outgoing) edges, so Python
+only loops over levels, not tasks or samples.
+
+Samples are processed in chunks that bound memory, optionally on a process
+pool.  Results are cached per project data version and parameters.
+"""
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+import numpy as np
+
+from models import db, Task
+from routing import current_project_path
+import scheduling
+import versions
+
+DISTRIBUTIONS = ('triangular', 'pert')
+DEFAULT_SAMPLES = 10000
+MAX_SAMPLES = 100000
+# Upper bound on (tasks x samples) cells per chunk, about 40 MB per array
+CHUNK_CELLS = 10000000
+PERCENTILES = (50, 80, 95)
+# Number of pre-drawn duration factors sampled from per chunk
+FACTOR_POOL = 65536
+
+_cache = {}
+_lock = threading.Lock()
+
+
+class Graph:
+    """Task arrays in topological order, with edges grouped by level."""
+
+    def __init__(self, schedule, progress):
+        order = schedule.topological_order()
+        self.ids = np.array(order, dtype=np.int64)
+        position = {n: i for i, n in enumerate(order)}
+        self.origin = min(schedule.start.values()) if order else 0
+        self.start = np.array([schedule.start[n] - self.origin for n in order], dtype=np.float64)
+        self.duration = np.array([schedule.duration[n] for n in order], dtype=np.float64)
+        done = np.array([min(progress.get(n, 0), 100) / 100 for n in order], dtype=np.float64)
+        # Only the unfinished part of a task is uncertain
+        self.remaining = self.duration * (1 - done)
+        self.fixed = self.duration - self.remaining
+
+        level = np.zeros(len(order), dtype=np.int64)
+        for n in order:
+            i = position[n]
+            for p in schedule.preds[n]:
+                level[i] = max(level[i], level[position[p]] + 1)
+        self.levels = []
+        for lv in range(int(level.max()) + 1 if len(order) else 0):
+            nodes = np.flatnonzero(level == lv)
+            # Incoming edges grouped by successor, outgoing grouped by predecessor
+            into = [(i, position[p]) for i in nodes for p in sorted(schedule.preds[order[i]])]
+            out = [(i, position[s]) for i in nodes for s in sorted(schedule.succs[order[i]])]
+            self.levels.append((nodes, self._groups(into), self._groups(out)))
+
+    @staticmethod
+    def _groups(pairs):
+        """``(owners, others, offsets)`` for ``reduceat`` over ``pairs``."""
+        if not pairs:
+            return None
+        owner, other = np.array(pairs, dtype=np.int64).T
+        offsets = np.flatnonzero(np.r_[True, owner[1:] != owner[:-1]])
+        return owner[offsets], other, offsets
+
+
+def _factors(rng, shape, distribution, optimistic, pessimistic):
+    """Duration factors for ``shape`` (tasks x samples).
+
+    Every task uses the same distribution, so a pool of ``FACTOR_POOL``
+    draws is generated once and indexed with cheap random integers, which is
+    far faster than drawing a beta variate per cell.
+    """
+    if pessimistic <= optimistic:
+        return np.ones(shape, dtype=np.float32)
+    if distribution == 'triangular':
+        pool = rng.triangular(optimistic, 1.0, pessimistic, size=FACTOR_POOL)
+    else:
+        # PERT: a beta distribution rescaled to [optimistic, pessimistic]
+        spread = pessimistic - optimistic
+        alpha = 1 + 4 * (1.0 - optimistic) / spread
+        beta = 1 + 4 * (pessimistic - 1.0) / spread
+        pool = optimistic + spread * rng.beta(alpha, beta, size=FACTOR_POOL)
+    return pool.astype(np.float32)[rng.integers(0, FACTOR_POOL, size=shape, dtype=np.uint16)]
+
+
+def _simulate_chunk(graph, samples, seed, distribution, optimistic, pessimistic):
+    """Return ``(finish, critical_counts)`` for ``samples`` iterations."""
+    rng = np.random.default_rng(seed)
+    n = len(graph.ids)
+    duration = np.repeat(graph.fixed.astype(np.float32)[:, None], samples, axis=1)
+    uncertain = np.flatnonzero(graph.remaining > 0)
+    duration[uncertain] += (graph.remaining[uncertain, None].astype(np.float32)
+                            * _factors(rng, (len(uncertain), samples), distribution,
+                                       optimistic, pessimistic))
+    es = np.empty((n, samples), dtype=np.float32)
+    ef = np.empty((n, samples), dtype=np.float32)
+    for nodes, into, _ in graph.levels:
+        es[nodes] = graph.start[nodes, None]
+        if into is not None:
+            owners, preds, offsets = into
+            latest = np.maximum.reduceat(ef[preds], offsets, axis=0)
+            es[owners] = np.maximum(es[owners], latest)
+        ef[nodes] = es[nodes] + duration[nodes]
+    finish = ef.max(axis=0)
+
+    # Backward pass; ls reuses the ef buffer since ef is no longer needed
+    ls = ef
+    for nodes, _, out in reversed(graph.levels):
+        lf = np.broadcast_to(finish, (len(nodes), samples)).copy()
+        if out is not None:
+            owners, succs, offsets = out
+            earliest = np.minimum.reduceat(ls[succs], offsets, axis=0)
+            rows = np.searchsorted(nodes, owners)
+            lf[rows] = np.minimum(lf[rows], earliest)
+        ls[nodes] = lf - duration[nodes]
+    # float32 keeps about 1e-3 day of precision over a multi-year horizon
+    critical = (ls - es < 1e-3).sum(axis=1)
+    return finish.astype(np.float64), critical
+
+
+def simulate(graph, samples=DEFAULT_SAMPLES, distribution='pert', optimistic=0.9,
+             pessimistic=1.5, seed=0, workers=1):
+    """Run the simulation; returns ``(finish_offsets, criticality)`` arrays.
+
+    ``finish_offsets`` holds each sample's project finish (exclusive, days
+    from ``graph.origin``); ``criticality`` is the share of samples in which
+    each task had zero float.
+    """
+    if distribution not in DISTRIBUTIONS:
+        raise ValueError(f'unknown distribution: {distribution}')
+    if not 0 < optimistic <= 1 <= pessimistic:
+        raise ValueError('expected 0 < optimistic <= 1 <= pessimistic')
+    n = max(len(graph.ids), 1)
+    chunk = max(1, min(samples, CHUNK_CELLS // n))
+    sizes = [min(chunk, samples - i) for i in range(0, samples, chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = [(graph, size, s, distribution, optimistic, pessimistic) for size, s in zip(sizes, seeds)]
+    if workers > 1 and len(args) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(args))) as pool:
+            results = list(pool.map(_simulate_chunk, *zip(*args)))
+    else:
+        results = [_simulate_chunk(*a) for a in args]
+    finish = np.concatenate([r[0] for r in results])
+    critical = sum(r[1] for r in results) / samples
+    return finish, critical
+
+
+def _day(origin, offset):
+    # ef is exclusive, so the last working day is one before it
+    return date.fromordinal(origin + max(int(np.ceil(offset - 1e-9)) - 1, 0))
+
+
+def analyze(samples=DEFAULT_SAMPLES, distribution='pert', optimistic=0.9, pessimistic=1.5,
+            seed=0, workers=1, top=20):
+    """Finish date distribution and criticality for the active project.
+
+    Cached per project data version and parameters; raises CycleError when
+    the dependencies are cyclic.
+    """
+    params = (samples, distribution, optimistic, pessimistic, seed, top)
+    key = (versions.project_version(), params)
+    path = current_project_path()
+    with _lock:
+        entry = _cache.get(path)
+    if entry is not None and entry[0] == key:
+        return entry[1]
+
+    schedule = scheduling.get_schedule()
+    progress = dict(db.session.query(Task.id, Task.progress))
+    graph = Graph(schedule, progress)
+    if not len(graph.ids):
+        result = {'samples': 0, 'planned_finish': None, 'percentiles': {}, 'histogram': [], 'tasks': []}
+    else:
+        finish, critical = simulate(graph, samples, distribution, optimistic, pessimistic, seed, workers)
+        planned = schedule.finish_date()
+        days = np.ceil(finish - 1e-9).astype(np.int64)
+        values, counts = np.unique(days, return_counts=True)
+        names = dict(db.session.query(Task.id, Task.name))
+        ranked = np.argsort(-critical, kind='stable')[:top]
+        result = {
+            'samples': samples,
+            'distribution': distribution,
+            'optimistic': optimistic,
+            'pessimistic': pessimistic,
+            'planned_finish': planned.isoformat() if planned else None,
+            'on_time_probability': float(np.mean(days <= planned.toordinal() - graph.origin + 1)) if planned else None,
+            'percentiles': {f'P{p}': _day(graph.origin, np.percentile(finish, p)).isoformat()
+                            for p in PERCENTILES},
+            'histogram': [{'date': (date.fromordinal(graph.origin) + timedelta(days=int(v) - 1)).isoformat(),
+                           'count': int(c)} for v, c in zip(values, counts)],
+            'tasks': [{'id': int(graph.ids[i]), 'name': names.get(int(graph.ids[i])),
+                       'criticality': round(float(critical[i]), 4)} for i in ranked],
+        }
+    with _lock:
+        _cache[path] = (key, result)
+    return result
@@ -0,0 +1,148 @@
+"""Per-request routing of project tables to per-project engines.
+
+Project databases are not configured through ``SQLALCHEMY_DATABASE_URI``.
+Instead ``g.project_path`` is set for each request and ``RoutingSession``
+sends every default-bind (project) statement to the engine for that path.
+Engines live in a bounded ``EnginePool`` so switching between recently used
+projects never reconnects, and idle or least recently used engines are
+disposed.  Every engine gets the ``SQLITE_PRAGMAS`` profile on connect.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+
+# Applied to every new SQLite connection. WAL lets readers proceed while a
+# writer holds the database; NORMAL sync is safe under WAL.
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', 5000),
+    ('cache_size', -64000),
+    ('mmap_size', 268435456),
+    ('temp_store', 'MEMORY'),
+)
+
+
+def apply_sqlite_profile(engine):
+    """Register the connection profile on ``engine``."""
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_conn, connection_record):
+        cursor = dbapi_conn.cursor()
+        for name, value in SQLITE_PRAGMAS:
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+    return engine
+
+
+class EnginePool:
+    """LRU cache of SQLite engines keyed by database path."""
+
+    def __init__(self, max_size=8, idle_timeout=600, on_create=None, factory=None):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        # Builds the engine for a path (e.g. to mount archives); None opens the file
+        self.factory = factory
+        # Called with each new engine before it is handed out (e.g. migrations)
+        self.on_create = on_create
+        self._engines = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """Return the engine for ``path``, creating it if needed.
+
+        Every call also disposes engines that went idle, so they are released
+        even when no new project is opened.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._engines.get(path)
+            if entry is not None:
+                entry[1] = now
+                self._engines.move_to_end(path)
+                evicted = self._evict(now)
+        if entry is not None:
+            for old in evicted:
+                old.dispose()
+            return entry[0]
+
+        if self.factory:
+            engine = self.factory(path)
+        else:
+            engine = apply_sqlite_profile(create_engine(f'sqlite:///{path}'))
+        if self.on_create:
+            self.on_create(engine)
+
+        with self._lock:
+            entry = self._engines.get(path)
+            if entry is not None:
+                # Another request created it while we were configuring ours
+                entry[1] = now
+                self._engines.move_to_end(path)
+                evicted = [engine]
+                engine = entry[0]
+            else:
+                self._engines[path] = [engine, now]
+                evicted = self._evict(now)
+        for old in evicted:
+            old.dispose()
+        return engine
+
+    def _evict(self, now):
+        # Entries are kept in last-used order, so both idle and overflow
+        # victims are always at the front.
+        evicted = []
+        while self._engines:
+            path, (engine, last_used) = next(iter(self._engines.items()))
+            if len(self._engines) <= self.max_size and now - last_used < self.idle_timeout:
+                break
+            del self._engines[path]
+            evicted.append(engine)
+        return evicted
+
+    def discard(self, path):
+        """Dispose and forget the engine for ``path`` if it is cached."""
+        with self._lock:
+            entry = self._engines.pop(path, None)
+        if entry is not None:
+            entry[0].dispose()
+
+    def dispose_all(self):
+        with self._lock:
+            entries = list(self._engines.values())
+            self._engines.clear()
+        for engine, _ in entries:
+            engine.dispose()
+
+    def __contains__(self, path):
+        return path in self._engines
+
+    def __len__(self):
+        return len(self._engines)
+
+
+project_engines = EnginePool()
+
+
+def current_project_path():
+    """Database path of the project active in this app context, if any."""
+    if has_app_context():
+        return g.get('project_path')
+    return None
+
+
+class RoutingSession(Session):
+    """Session that routes default-bind statements to the active project."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is None and engine is self._db.engines[None]:
+            path = current_project_path()
+            if path:
+                return project_engines.get(path)
+        return engine
@@ -0,0 +1,469 @@
+"""Critical path scheduling over the task dependency graph.
+
+``Schedule`` holds the dependency DAG (``TaskDependency`` rows plus the
+legacy ``Task.depends_on_id`` link) and runs a CPM forward/backward pass in
+O(V+E).  Dates are day ordinals; a task's planned ``start_date`` acts as a
+"start no earlier than" constraint, and ``ef``/``lf`` are exclusive.
+
+Schedules are cached per project database, keyed by the data version
+(``versions.project_version()``), so writes from other processes are
+noticed.  Cached schedules are never changed in place: an edit works on a
+copy that replaces the cached one only when the session commits.  When a
+task's dates or predecessors change only its downstream subgraph is re-run
+forward, and only the affected upstream tasks are re-run backward unless
+the project finish moved.
+
+``propagate`` pushes successors of a slipped task forward and writes every
+move with one bulk UPDATE in the caller's transaction.
+"""
+import threading
+from collections import defaultdict, deque
+from datetime import date, datetime
+
+from sqlalchemy import event, update
+
+from models import db, Task, TaskDependency
+from routing import RoutingSession, current_project_path
+import changes
+import versions
+
+
+class CycleError(ValueError):
+    """Raised when the dependencies contain (or would contain) a cycle."""
+
+    def __init__(self, cycle):
+        self.cycle = cycle
+        super().__init__('dependency cycle: ' + ' -> '.join(str(t) for t in cycle))
+
+
+def task_duration(start_date, end_date, is_milestone=False):
+    """Duration in days; milestones take no time."""
+    if is_milestone:
+        return 0
+    return (end_date - start_date).days + 1
+
+
+class Schedule:
+    """CPM results for one project."""
+
+    def __init__(self, tasks, edges):
+        """``tasks`` maps id to ``(start_date, duration)``; ``edges`` are
+        ``(predecessor_id, successor_id)`` pairs."""
+        self.start = {}
+        self.duration = {}
+        self.preds = defaultdict(set)
+        self.succs = defaultdict(set)
+        for task_id, (start_date, duration) in tasks.items():
+            self.start[task_id] = start_date.toordinal()
+            self.duration[task_id] = duration
+            # Present for every task, so lookups never insert into a shared schedule
+            self.preds[task_id] = set()
+            self.succs[task_id] = set()
+        for pred, succ in edges:
+            if pred in self.start and succ in self.start and pred != succ:
+                self.preds[succ].add(pred)
+                self.succs[pred].add(succ)
+        self.es, self.ef, self.ls, self.lf = {}, {}, {}, {}
+        self.finish = None
+        self.recompute()
+
+    def copy(self):
+        """Independent copy that can be updated while others read this one."""
+        other = Schedule.__new__(Schedule)
+        other.start, other.duration = dict(self.start), dict(self.duration)
+        other.preds = defaultdict(set, {n: set(p) for n, p in self.preds.items()})
+        other.succs = defaultdict(set, {n: set(s) for n, s in self.succs.items()})
+        other.es, other.ef, other.ls, other.lf = dict(self.es), dict(self.ef), dict(self.ls), dict(self.lf)
+        other.finish = self.finish
+        return other
+
+    # -- graph helpers -------------------------------------------------
+    def _reachable(self, roots, links):
+        seen = set(roots)
+        queue = deque(roots)
+        while queue:
+            node = queue.popleft()
+            for nxt in links[node]:
+                if nxt not in seen:
+                    seen.add(nxt)
+                    queue.append(nxt)
+        return seen
+
+    def topological_order(self, nodes=None):
+        """Kahn's algorithm over ``nodes`` (default: all tasks)."""
+        nodes = set(self.start) if nodes is None else nodes
+        indegree = {n: sum(1 for p in self.preds[n] if p in nodes) for n in nodes}
+        queue = deque(sorted(n for n, d in indegree.items() if d == 0))
+        order = []
+        while queue:
+            node = queue.popleft()
+            order.append(node)
+            for succ in self.succs[node]:
+                if succ in indegree:
+                    indegree[succ] -= 1
+                    if indegree[succ] == 0:
+                        queue.append(succ)
+        if len(order) < len(nodes):
+            raise CycleError(self._find_cycle({n for n, d in indegree.items() if d > 0}))
+        return order
+
+    def _find_cycle(self, remaining):
+        # Every remaining node has a remaining predecessor, so walking
+        # predecessors must eventually revisit a node.
+        node = min(remaining)
+        path, index = [], {}
+        while node not in index:
+            index[node] = len(path)
+            path.append(node)
+            node = min(p for p in self.preds[node] if p in remaining)
+        cycle = path[index[node]:][::-1]
+        return cycle + [cycle[0]]
+
+    # -- passes --------------------------------------------------------
+    def _forward(self, order):
+        for node in order:
+            es = self.start[node]
+            for pred in self.preds[node]:
+                es = max(es, self.ef[pred])
+            self.es[node] = es
+            self.ef[node] = es + self.duration[node]
+
+    def _backward(self, order):
+        for node in reversed(order):
+            lf = self.finish
+            for succ in self.succs[node]:
+                lf = min(lf, self.ls[succ])
+            self.lf[node] = lf
+            self.ls[node] = lf - self.duration[node]
+
+    def recompute(self):
+        order = self.topological_order()
+        self._forward(order)
+        self.finish = max(self.ef.values(), default=None)
+        self._backward(order)
+
+    # -- incremental updates -------------------------------------------
+    def would_cycle(self, task_id, predecessor_ids):
+        """Return the cycle that ``predecessor_ids`` would create, or None."""
+        preds = {p for p in predecessor_ids if p in self.start}
+        if task_id in preds:
+            return [task_id, task_id]
+        if task_id not in self.start:
+            return None
+        downstream = self._reachable([task_id], self.succs)
+        for pred in sorted(preds):
+            if pred in downstream:
+                return self._path(task_id, pred) + [task_id]
+        return None
+
+    def _path(self, source, target):
+        parent = {source: None}
+        queue = deque([source])
+        while queue:
+            node = queue.popleft()
+            if node == target:
+                break
+            for succ in self.succs[node]:
+                if succ not in parent:
+                    parent[succ] = node
+                    queue.append(succ)
+        path = []
+        while target is not None:
+            path.append(target)
+            target = parent[target]
+        return path[::-1]
+
+    def update_task(self, task_id, start_date, duration, predecessor_ids=None):
+        """Apply a change to one task and refresh only the affected tasks.
+
+        ``predecessor_ids`` replaces the task's predecessors when given.
+        Unknown ids are added as new tasks.
+        """
+        touched = {task_id}
+        if predecessor_ids is not None:
+            cycle = self.would_cycle(task_id, predecessor_ids)
+            if cycle:
+                raise CycleError(cycle)
+            new_preds = {p for p in predecessor_ids if p in self.start and p != task_id}
+            old_preds = self.preds[task_id]
+            touched |= old_preds | new_preds
+            for pred in old_preds - new_preds:
+                self.succs[pred].discard(task_id)
+            for pred in new_preds - old_preds:
+                self.succs[pred].add(task_id)
+            self.preds[task_id] = new_preds
+        self.start[task_id] = start_date.toordinal()
+        self.duration[task_id] = duration
+
+        old_finish = self.finish
+        downstream = self._reachable([task_id], self.succs)
+        old_ef = {n: self.ef.get(n) for n in downstream}
+        self._forward(self.topological_order(downstream))
+
+        new_max = max(self.ef[n] for n in downstream)
+        if old_finish is None or new_max > old_finish:
+            self.finish = new_max
+        elif any(old_ef[n] == old_finish and self.ef[n] < old_finish for n in downstream):
+            self.finish = max(self.ef.values())
+
+        if self.finish != old_finish:
+            self._backward(self.topological_order())
+        else:
+            upstream = self._reachable(touched, self.preds)
+            self._backward(self.topological_order(upstream))
+
+    def cascade(self, task_id):
+        """Planned start ordinals successors need so none starts before its
+        predecessors finish.  Only tasks that must move are returned, and
+        tasks are only ever pushed later."""
+        starts = {}
+        for node in self.topological_order(self._reachable([task_id], self.succs)):
+            if node == task_id:
+                continue
+            start = self.start[node]
+            for pred in self.preds[node]:
+                start = max(start, starts.get(pred, self.start[pred]) + self.duration[pred])
+            if start != self.start[node]:
+                starts[node] = start
+        return starts
+
+    def move_tasks(self, starts):
+        """Set new planned starts for many tasks and recompute."""
+        self.start.update(starts)
+        self.recompute()
+
+    # -- results -------------------------------------------------------
+    def total_float(self, task_id):
+        return self.ls[task_id] - self.es[task_id]
+
+    def critical_tasks(self):
+        # Negative float (a start constraint later than the late start) is critical too
+        return {n for n in self.start if self.ls[n] <= self.es[n]}
+
+    def critical_path(self):
+        """Critical tasks ordered by early start."""
+        return sorted(self.critical_tasks(), key=lambda n: (self.es[n], n))
+
+    def finish_date(self):
+        if self.finish is None:
+            return None
+        return date.fromordinal(max(self.finish - 1, min(self.es.values())))
+
+    def as_dict(self):
+        def day(ordinal):
+            return date.fromordinal(ordinal).isoformat()
+
+        return {
+            'finish': self.finish_date().isoformat() if self.finish is not None else None,
+            'critical_path': self.critical_path(),
+            # id -> [early start, early finish, late start, late finish, total float]
+            'tasks': {
+                n: [day(self.es[n]), day(max(self.ef[n] - 1, self.es[n])),
+                    day(self.ls[n]), day(max(self.lf[n] - 1, self.ls[n])),
+                    self.total_float(n)]
+                for n in self.start
+            },
+        }
+
+
+def load_graph():
+    """Return ``(tasks, edges)`` for the active project, as ``Schedule`` takes them."""
+    tasks = {}
+    edges = []
+    rows = db.session.query(Task.id, Task.start_date, Task.end_date,
+                            Task.is_milestone, Task.depends_on_id)
+    for task_id, start_date, end_date, is_milestone, depends_on_id in rows:
+        tasks[task_id] = (start_date, task_duration(start_date, end_date, is_milestone))
+        if depends_on_id:
+            edges.append((depends_on_id, task_id))
+    edges.extend(db.session.query(TaskDependency.predecessor_id, TaskDependency.successor_id))
+    return tasks, edges
+
+
+def load_schedule():
+    """Build a schedule for the active project from the database."""
+    return Schedule(*load_graph())
+
+
+# project path -> (data version, Schedule); cached schedules are read-only
+_schedules = {}
+_lock = threading.Lock()
+
+
+def _capture(session):
+    """Remember the cached schedule this transaction's changes start from.
+
+    Only a schedule matching the committed data, read before the transaction
+    wrote anything, is a valid base; otherwise the base is None.
+    """
+    if 'schedule_base' in session.info:
+        return
+    key = current_project_path()
+    with _lock:
+        entry = _schedules.get(key)
+    base = None
+    if entry is not None:
+        with session.no_autoflush:
+            if not versions.has_pending_writes(session) and versions.project_version() == entry[0]:
+                base = entry[1]
+    session.info['schedule_base'] = base
+
+
+def _working_copy(session):
+    """Schedule this transaction is changing, or None if there is no base."""
+    pending = session.info.get('schedule_pending')
+    if pending is not None:
+        return pending[1]
+    _capture(session)
+    base = session.info['schedule_base']
+    schedule = base.copy() if base is not None else None
+    session.info['schedule_pending'] = (current_project_path(), schedule)
+    return schedule
+
+
+def get_schedule():
+    """Schedule for the active project; raises CycleError if cyclic.
+
+    Inside a transaction that changed the schedule, that pending schedule is
+    returned.  Only schedules of committed data are cached.
+    """
+    session = db.session()
+    pending = session.info.get('schedule_pending')
+    if pending is not None and pending[1] is not None:
+        return pending[1]
+    key = current_project_path()
+    version = versions.project_version()
+    with _lock:
+        entry = _schedules.get(key)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    schedule = load_schedule()
+    if not versions.has_pending_writes(session):
+        with _lock:
+            _schedules[key] = (version, schedule)
+    return schedule
+
+
+def store(schedule):
+    """Cache ``schedule`` for the active project once the session commits."""
+    db.session.info['schedule_pending'] = (current_project_path(), schedule)
+
+
+def with_changes(dates, predecessors):
+    """Schedule for the active project with pending changes applied.
+
+    ``dates`` maps task ids to ``(start_date, duration)`` and ``predecessors``
+    maps task ids to their complete new predecessor sets.  Nothing is cached;
+    raises CycleError if the result is cyclic.
+    """
+    session = db.session()
+    pending = session.info.get('schedule_pending')
+    if pending is not None:
+        base = pending[1]
+    else:
+        _capture(session)
+        base = session.info['schedule_base']
+    if base is not None:
+        tasks = {n: (date.fromordinal(base.start[n]), base.duration[n]) for n in base.start}
+        edges = [(p, s) for s, preds in base.preds.items() for p in preds]
+    else:
+        tasks, edges = load_graph()
+    tasks.update(dates)
+    edges = [(p, s) for p, s in edges if s not in predecessors]
+    edges.extend((p, s) for s, preds in predecessors.items() for p in preds)
+    return Schedule(tasks, edges)
+
+
+def invalidate(key=None):
+    """Drop the cached schedule for ``key`` (default: the active project)."""
+    with _lock:
+        _schedules.pop(key or current_project_path(), None)
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def _capture_before_write(session, flush_context, instances):
+    if any(isinstance(obj, (Task, TaskDependency))
+           for obj in (*session.new, *session.dirty, *session.deleted)):
+        _capture(session)
+
+
+@event.listens_for(RoutingSession, 'before_commit')
+def _version_pending(session):
+    pending = session.info.pop('schedule_pending', None)
+    if pending is not None and pending[1] is not None:
+        # The version read inside the write transaction is the one committed
+        session.info['schedule_commit'] = (pending[0], versions.project_version(), pending[1])
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _publish_pending(session):
+    session.info.pop('schedule_base', None)
+    committed = session.info.pop('schedule_commit', None)
+    if committed is not None:
+        key, version, schedule = committed
+        with _lock:
+            _schedules[key] = (version, schedule)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _drop_pending(session):
+    for name in ('schedule_base', 'schedule_pending', 'schedule_commit'):
+        session.info.pop(name, None)
+
+
+def check_predecessors(task_id, predecessor_ids):
+    """Raise CycleError if giving ``task_id`` these predecessors forms a cycle."""
+    try:
+        schedule = get_schedule()
+    except CycleError:
+        # Already cyclic; let the edit through so the cycle can be fixed
+        return
+    cycle = schedule.would_cycle(task_id, predecessor_ids)
+    if cycle:
+        raise CycleError(cycle)
+
+
+def task_changed(task, predecessor_ids=None):
+    """Apply an edit of ``task`` to the schedule cached when the session commits."""
+    session = db.session()
+    schedule = _working_copy(session)
+    if schedule is None:
+        return
+    if predecessor_ids is not None:
+        predecessor_ids = set(predecessor_ids)
+        if task.depends_on_id:
+            predecessor_ids.add(task.depends_on_id)
+    try:
+        schedule.update_task(task.id, task.start_date,
+                             task_duration(task.start_date, task.end_date, task.is_milestone),
+                             predecessor_ids)
+    except CycleError:
+        session.info['schedule_pending'] = (current_project_path(), None)
+
+
+def propagate(task_id):
+    """Move the successors of ``task_id`` so they start after it finishes.
+
+    New dates are computed in memory from the cached schedule and written
+    with a single bulk UPDATE; the caller commits.  Returns the moved tasks
+    as ``{"id", "start_date", "end_date"}`` dicts.
+    """
+    schedule = _working_copy(db.session())
+    if schedule is None:
+        # No cached base: load the data including this transaction's edits
+        schedule = load_schedule()
+        store(schedule)
+    starts = schedule.cascade(task_id)
+    if not starts:
+        return []
+    now = datetime.utcnow()
+    rows = []
+    for node, start in starts.items():
+        start_date = date.fromordinal(start)
+        end_date = date.fromordinal(start + max(schedule.duration[node] - 1, 0))
+        rows.append({'id': node, 'start_date': start_date, 'end_date': end_date, 'updated_at': now})
+    db.session.execute(update(Task), rows)
+    changes.record('task', list(starts))
+    schedule.move_tasks(starts)
+    return [{'id': r['id'], 'start_date': r['start_date'].isoformat(),
+             'end_date': r['end_date'].isoformat()} for r in rows]
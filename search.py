@@ -0,0 +1,101 @@
+"""Full-text task search backed by the ``tasks_fts`` FTS5 index.
+
+Each whitespace-separated term must appear in the task name or remarks.
+The index uses the trigram tokenizer, so terms of three or more characters
+match anywhere in a word (which covers prefixes) with an index lookup.
+Shorter terms (such as 設計) cannot be looked up in a trigram index; they
+are looked up in the ``task_bigrams`` index instead and confirmed with
+``LIKE``.
+
+Results are ranked by bm25 with name hits weighted above remarks hits and
+paged with ``limit``/``offset``.
+"""
+import re
+
+from markupsafe import Markup, escape
+from sqlalchemy import text
+
+from models import db
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+# bm25 column weights for (name, remarks)
+NAME_WEIGHT = 10.0
+REMARKS_WEIGHT = 1.0
+# Control characters mark hits inside FTS output until it is HTML-escaped
+_OPEN, _CLOSE = '\x02', '\x03'
+
+
+def terms(query):
+    """Split a query into search terms, dropping FTS5 syntax characters."""
+    return [t for t in (re.sub(r'["*^():]', ' ', part).strip() for part in query.split()) if t]
+
+
+def _like(term):
+    return '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def _short_term_tasks(i, term):
+    """Subquery of task ids whose text may contain the short term ``term``."""
+    if len(term) == 2:
+        grams = f'gram = lower(:gram{i})'
+    else:
+        # Grams starting with the character, including a trailing single one
+        grams = f'gram BETWEEN lower(:gram{i}) AND lower(:gram{i}) || char(1114111)'
+    # The empty gram marks texts too long to be indexed in full
+    return f"SELECT task_id FROM task_bigrams WHERE {grams} OR gram = ''"
+
+
+def _markup(value, short_terms):
+    """Escape ``value`` and turn hit markers and short-term hits into ``<mark>``."""
+    value = value or ''
+    for term in short_terms:
+        value = re.sub(re.escape(term), lambda m: _OPEN + m.group(0) + _CLOSE, value, flags=re.IGNORECASE)
+    html = str(escape(value)).replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>')
+    return Markup(html)
+
+
+def search(query, limit=DEFAULT_LIMIT, offset=0):
+    """Return ``(results, more)`` for one page of ``query``.
+
+    Each result has the task fields plus ``name_html`` and ``remarks_html``
+    (escaped HTML with ``<mark>`` around hits; remarks are cut to a snippet).
+    """
+    words = terms(query)
+    if not words:
+        return [], False
+    long_terms = [w for w in words if len(w) >= 3]
+    short_terms = [w for w in words if len(w) < 3]
+
+    params = {'limit': limit + 1, 'offset': offset}
+    where = []
+    if long_terms:
+        params['match'] = ' AND '.join('"{}"'.format(t) for t in long_terms)
+        where.append('tasks_fts MATCH :match')
+        name = f"highlight(tasks_fts, 0, '{_OPEN}', '{_CLOSE}')"
+        remarks = f"snippet(tasks_fts, 1, '{_OPEN}', '{_CLOSE}', '…', 16)"
+        order = f'bm25(tasks_fts, {NAME_WEIGHT}, {REMARKS_WEIGHT})'
+    else:
+        name, remarks, order = 'tasks_fts.name', 'substr(tasks_fts.remarks, 1, 80)', 't.start_date, t.id'
+    for i, term in enumerate(short_terms):
+        params[f'like{i}'], params[f'gram{i}'] = _like(term), term
+        where.append(f't.id IN ({_short_term_tasks(i, term)})')
+        where.append(f"(tasks_fts.name LIKE :like{i} ESCAPE '\\' OR tasks_fts.remarks LIKE :like{i} ESCAPE '\\')")
+
+    rows = db.session.execute(text(
+        f'SELECT t.id, t.name, {name}, {remarks}, t.start_date, t.end_date, t.progress, t.parent_id '
+        f'FROM tasks_fts JOIN tasks t ON t.id = tasks_fts.rowid '
+        f'WHERE {" AND ".join(where)} ORDER BY {order} LIMIT :limit OFFSET :offset'),
+        params).all()
+    more = len(rows) > limit
+    results = [{
+        'id': task_id,
+        'name': plain_name,
+        'name_html': _markup(name_hit, short_terms),
+        'remarks_html': _markup(remarks_hit, short_terms),
+        'start_date': start_date,
+        'end_date': end_date,
+        'progress': progress,
+        'parent_id': parent_id,
+    } for task_id, plain_name, name_hit, remarks_hit, start_date, end_date, progress, parent_id in rows[:limit]]
+    return results, more
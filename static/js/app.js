@@ -10,6 +10,20 @@ document.addEventListener('DOMContentLoaded', () => {
     container.appendChild(div);
     new bootstrap.Toast(div).show();
   };
+  // Save many task patches ({id, ...changed fields}) in a single request
+  window.saveTaskBatch = function(patches) {
+    return fetch('/tasks/batch', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ tasks: patches })
+    }).then(res => res.json().then(body => {
+      if (!res.ok) {
+        const failed = body.results ? body.results.filter(r => r.error) : [];
+        showToast(failed.length ? failed.map(r => `#${r.id ?? r.index}: ${r.error}`).join('<br>') : 'Save failed', 'error');
+      }
+      return body;
+    }));
+  };
   const progress = document.getElementById('progress');
   const progressValue = document.getElementById('progressValue');
   if (progress && progressValue) {
@@ -63,7 +77,8 @@ document.addEventListener('DOMContentLoaded', () => {
           })
         }).then(res => {
           if (res.ok) {
-            location.reload();
+            // The change feed patches the page; reload only without it
+            if (!window.taskFeed) location.reload();
           } else {
             showToast('Save failed', 'error');
           }
@@ -72,6 +87,31 @@ document.addEventListener('DOMContentLoaded', () => {
     }
   }
 
+  const bulkProgressBtn = document.getElementById('bulkProgressBtn');
+  if (bulkProgressBtn) {
+    // Progress for all selected rows is saved in one batch request
+    const selectAll = document.getElementById('selectAllTasks');
+    selectAll.addEventListener('change', () => {
+      document.querySelectorAll('#taskTable .task-select').forEach(box => { box.checked = selectAll.checked; });
+    });
+    bulkProgressBtn.addEventListener('click', () => {
+      const progress = +document.getElementById('bulkProgressValue').value;
+      const ids = [...document.querySelectorAll('#taskTable .task-select:checked')]
+        .map(box => +box.closest('tr').dataset.taskId);
+      if (!ids.length) {
+        showToast('タスクが選択されていません', 'error');
+        return;
+      }
+      saveTaskBatch(ids.map(id => ({ id, progress }))).then(body => {
+        if (body.status !== 'ok') return;
+        selectAll.checked = false;
+        document.querySelectorAll('#taskTable .task-select:checked').forEach(box => { box.checked = false; });
+        showToast(`${ids.length}件のタスクを更新しました`, 'success');
+        if (!window.taskFeed) location.reload();
+      });
+    });
+  }
+
   const deleteModal = document.getElementById('deleteTaskModal');
   if (deleteModal) {
     const deleteForm = document.getElementById('deleteTaskForm');
@@ -83,6 +123,329 @@ document.addEventListener('DOMContentLoaded', () => {
     });
   }
 
+  const ganttEl = document.getElementById('gantt');
+  if (ganttEl && window.d3) {
+    // Only the rows and days inside the scroll viewport are drawn; rows are
+    // fetched from /api/gantt in blocks as the user scrolls.
+    const DAY_W = 20, ROW_H = 24, HEADER_H = 24, BLOCK = 200;
+    const url = ganttEl.dataset.url;
+    const blocks = new Map();
+    let meta = null;
+    let pending = false;
+
+    const svg = d3.select(ganttEl).append('svg');
+    const marker = svg.append('defs').append('marker')
+      .attr('id', 'gantt-arrow').attr('viewBox', '0 0 10 10')
+      .attr('refX', 10).attr('refY', 5)
+      .attr('markerWidth', 5).attr('markerHeight', 5).attr('orient', 'auto');
+    marker.append('path').attr('d', 'M0,0L10,5L0,10z');
+    const edgeLayer = svg.append('g');
+    const barLayer = svg.append('g');
+    const todayLine = svg.append('line').attr('class', 'gantt-today');
+    const header = svg.append('g');
+
+    const loadBlock = (b) => {
+      if (blocks.has(b)) return;
+      blocks.set(b, null);
+      fetch(`${url}?row_start=${b * BLOCK}&row_count=${BLOCK}`)
+        .then(res => res.json())
+        .then(data => {
+          meta = data;
+          blocks.set(b, data);
+          schedule();
+        });
+    };
+
+    const render = () => {
+      pending = false;
+      if (!meta) return;
+      const width = meta.days * DAY_W;
+      const height = HEADER_H + meta.total_rows * ROW_H;
+      svg.attr('width', width).attr('height', height);
+
+      const top = ganttEl.scrollTop, left = ganttEl.scrollLeft;
+      const firstRow = Math.max(0, Math.floor((top - HEADER_H) / ROW_H));
+      const lastRow = Math.min(meta.total_rows - 1, Math.ceil((top + ganttEl.clientHeight) / ROW_H));
+      const firstDay = Math.floor(left / DAY_W);
+      const lastDay = Math.ceil((left + ganttEl.clientWidth) / DAY_W);
+
+      const rows = [];
+      const edges = new Map();
+      for (let b = Math.floor(firstRow / BLOCK); b <= Math.floor(lastRow / BLOCK); b++) {
+        const data = blocks.get(b);
+        if (data === undefined) loadBlock(b);
+        if (!data) continue;
+        data.rows.forEach((r, i) => {
+          const row = data.row_start + i;
+          if (row < firstRow || row > lastRow) return;
+          if (r[2] + r[3] < firstDay || r[2] > lastDay) return;
+          rows.push({ row, id: r[0], name: r[1], offset: r[2], duration: r[3], progress: r[4], status: r[5], critical: r[7] });
+        });
+        data.edges.forEach(e => {
+          if (Math.max(e[0], e[2]) < firstRow || Math.min(e[0], e[2]) > lastRow) return;
+          edges.set(e.join(','), e);
+        });
+      }
+
+      const bars = barLayer.selectAll('g.gantt-bar-row').data(rows, d => d.id)
+        .join(enter => {
+          const g = enter.append('g').attr('class', 'gantt-bar-row');
+          g.append('rect').attr('height', ROW_H - 6).attr('rx', 2);
+          g.append('text').attr('dy', ROW_H / 2).attr('dx', 4).attr('fill', '#fff');
+          g.append('title');
+          return g;
+        });
+      bars.attr('transform', d => `translate(${d.offset * DAY_W},${HEADER_H + d.row * ROW_H + 3})`);
+      bars.select('rect').attr('class', d => `bar-${d.status}${d.critical ? ' bar-critical' : ''}`).attr('width', d => d.duration * DAY_W);
+      bars.select('text').text(d => d.name);
+      bars.select('title').text(d => `${d.name}: ${d.progress}%`);
+
+      const y = row => HEADER_H + row * ROW_H + ROW_H / 2;
+      edgeLayer.selectAll('path').data([...edges.values()], e => e.join(','))
+        .join('path')
+        .attr('class', 'gantt-dependency')
+        .attr('marker-end', 'url(#gantt-arrow)')
+        .attr('d', e => {
+          const x1 = e[1] * DAY_W, x2 = e[3] * DAY_W;
+          const xm = Math.max(x1 + 4, x2 - 6);
+          return `M${x1},${y(e[0])}H${xm}V${y(e[2])}H${x2}`;
+        });
+
+      todayLine.attr('x1', meta.today * DAY_W).attr('x2', meta.today * DAY_W)
+        .attr('y1', HEADER_H).attr('y2', height);
+
+      const origin = new Date(meta.origin + 'T00:00:00');
+      const days = d3.range(Math.max(0, firstDay), Math.min(meta.days, lastDay + 1));
+      header.attr('transform', `translate(0,${top})`);
+      header.selectAll('text').data(days, d => d)
+        .join('text')
+        .attr('x', d => d * DAY_W + 2)
+        .attr('y', HEADER_H - 8)
+        .text(d => {
+          const day = d3.timeDay.offset(origin, d);
+          return day.getDate() === 1 ? `${day.getMonth() + 1}月` : day.getDate();
+        });
+    };
+
+    const schedule = () => {
+      if (!pending) {
+        pending = true;
+        requestAnimationFrame(render);
+      }
+    };
+
+    ganttEl.addEventListener('scroll', schedule);
+    window.addEventListener('resize', schedule);
+    // Drop cached blocks and refetch the visible ones
+    window.ganttRefresh = () => {
+      blocks.clear();
+      if (meta) schedule(); else loadBlock(0);
+    };
+    loadBlock(0);
+  }
+
+  const heatmapEl = document.getElementById('workloadHeatmap');
+  if (heatmapEl && window.Plotly) {
+    fetch(heatmapEl.dataset.url)
+      .then(res => res.json())
+      .then(data => {
+        // UTC arithmetic keeps toISOString() on the same calendar day
+        const origin = Date.parse(data.origin + 'T00:00:00Z');
+        const x = Array.from({ length: data.days }, (_, i) =>
+          new Date(origin + i * 86400000).toISOString().slice(0, 10));
+        Plotly.newPlot(heatmapEl, [{
+          type: 'heatmap',
+          x,
+          y: data.owners.map(o => o.name),
+          z: data.load,
+          zmin: 0,
+          zmax: Math.max(200, ...data.owners.map(o => o.cap)),
+          colorscale: [[0, '#ffffff'], [0.5, '#4caf50'], [0.75, '#ff9800'], [1, '#f44336']],
+          hovertemplate: '%{y} %{x}: %{z}%<extra></extra>'
+        }], {
+          margin: { l: 120, r: 20, t: 20, b: 40 },
+          yaxis: { autorange: 'reversed' }
+        });
+
+        const tbody = document.getElementById('overallocations');
+        data.overallocations.forEach(o => {
+          const tr = tbody.insertRow();
+          [o.name, o.start, o.end, o.days, `${o.peak}%`].forEach(v => {
+            tr.insertCell().textContent = v;
+          });
+        });
+      });
+  }
+
+  const riskEl = document.getElementById('riskResult');
+  if (riskEl && window.Plotly) {
+    const summary = document.getElementById('riskSummary');
+    fetch(riskEl.dataset.url)
+      .then(res => res.json().then(data => ({ ok: res.ok, data })))
+      .then(({ ok, data }) => {
+        if (!ok) {
+          summary.textContent = data.message || '計算できませんでした';
+          return;
+        }
+        const p = data.percentiles;
+        summary.textContent = data.samples
+          ? `計画完了日 ${data.planned_finish} ／ 期限内確率 ${Math.round(data.on_time_probability * 100)}% ／ ` +
+            `P50 ${p.P50} ／ P80 ${p.P80} ／ P95 ${p.P95}`
+          : 'タスクがありません';
+        Plotly.newPlot('riskHistogram', [{
+          type: 'bar',
+          x: data.histogram.map(h => h.date),
+          y: data.histogram.map(h => h.count),
+          hovertemplate: '%{x}: %{y}<extra></extra>'
+        }], {
+          margin: { l: 60, r: 20, t: 20, b: 40 },
+          shapes: data.planned_finish ? [{
+            type: 'line', x0: data.planned_finish, x1: data.planned_finish,
+            yref: 'paper', y0: 0, y1: 1, line: { color: '#f44336', dash: 'dash' }
+          }] : []
+        });
+        const tbody = document.getElementById('riskTasks');
+        data.tasks.forEach(t => {
+          const tr = tbody.insertRow();
+          [t.name, `${Math.round(t.criticality * 100)}%`].forEach(v => {
+            tr.insertCell().textContent = v;
+          });
+        });
+      });
+  }
+
+  const jobEl = document.getElementById('jobStatus');
+  if (jobEl) {
+    // Poll a background job until it finishes
+    const bar = jobEl.querySelector('.progress-bar');
+    const cancelBtn = jobEl.querySelector('.job-cancel');
+    const labels = { queued: '待機中', running: '実行中', succeeded: '完了', failed: '失敗', cancelled: 'キャンセル済み' };
+    const render = job => {
+      jobEl.querySelector('.job-state').textContent = labels[job.status] || job.status;
+      jobEl.querySelector('.job-message').textContent = job.message || '';
+      bar.style.width = `${job.progress}%`;
+      bar.textContent = `${job.progress}%`;
+      const done = ['succeeded', 'failed', 'cancelled'].includes(job.status);
+      if (done) {
+        bar.classList.remove('progress-bar-animated');
+        cancelBtn.classList.add('d-none');
+      }
+      if (job.status === 'failed') {
+        bar.classList.add('bg-danger');
+        const error = jobEl.querySelector('.job-error');
+        error.textContent = job.error || '';
+        error.classList.remove('d-none');
+      }
+      return done;
+    };
+    const poll = () => {
+      fetch(jobEl.dataset.url)
+        .then(res => res.json())
+        .then(job => {
+          if (!render(job)) {
+            setTimeout(poll, 1000);
+          } else if (job.status === 'succeeded' && jobEl.dataset.next) {
+            window.location.href = jobEl.dataset.next;
+          }
+        })
+        .catch(() => setTimeout(poll, 3000));
+    };
+    cancelBtn.addEventListener('click', () => {
+      cancelBtn.disabled = true;
+      fetch(jobEl.dataset.cancelUrl, { method: 'POST' })
+        .then(res => res.json())
+        .then(job => { if (job.status) render(job); });
+    });
+    poll();
+  }
+
+  const taskTable = document.getElementById('taskTable');
+  if (taskTable && window.EventSource) {
+    // Apply change feed deltas to the task table and Gantt in place
+    const body = taskTable.querySelector('tbody');
+    const rowTemplate = document.getElementById('taskRowTemplate');
+    const today = taskTable.dataset.today;
+    const rowFor = id => body.querySelector(`tr[data-task-id="${id}"]`);
+    const predNames = ids => ids.map(id => (rowFor(id) || {}).dataset?.name).filter(Boolean).join(', ');
+
+    const fill = (row, t) => {
+      Object.assign(row.dataset, {
+        taskId: t.id, name: t.name, start: t.start_date,
+        assigneeId: t.assignee_id || '', preds: t.predecessors.join(',')
+      });
+      row.className = t.progress === 100 ? 'table-success' : (t.end_date < today ? 'table-danger' : '');
+      const parentRow = t.parent_id ? rowFor(t.parent_id) : null;
+      const depth = parentRow ? +parentRow.dataset.depth + 1 : (t.parent_id ? 1 : 0);
+      row.dataset.depth = depth;
+      row.querySelector('.task-name').textContent = '\u2003'.repeat(depth) + (depth ? '🔹 ' : '') + t.name;
+      row.querySelector('.task-start').textContent = t.start_date;
+      row.querySelector('.task-end').textContent = t.end_date;
+      row.querySelector('.task-assignee').textContent = t.assignee || '';
+      row.querySelector('.task-progress').textContent = `${t.progress}%`;
+      row.querySelector('.task-preds').textContent = predNames(t.predecessors);
+      row.querySelector('.task-remarks').textContent = t.remarks || '';
+      row.querySelectorAll('a[href], form[action]').forEach(el => {
+        const attr = el.tagName === 'A' ? 'href' : 'action';
+        el.setAttribute(attr, el.getAttribute(attr).replace(/\/task\/\d+\//, `/task/${t.id}/`));
+      });
+    };
+
+    const place = (row, t) => {
+      const before = [...body.rows].find(r => r !== row &&
+        (r.dataset.start > t.start_date || (r.dataset.start === t.start_date && +r.dataset.taskId > t.id)));
+      body.insertBefore(row, before || null);
+    };
+
+    const applyTask = change => {
+      let row = rowFor(change.id);
+      if (change.op === 'delete') {
+        if (row) row.remove();
+        return;
+      }
+      const t = change.data;
+      if (!row) {
+        row = rowTemplate.content.firstElementChild.cloneNode(true);
+        place(row, t);
+      } else if (row.dataset.start !== t.start_date) {
+        place(row, t);
+      }
+      fill(row, t);
+    };
+
+    const applyMember = change => {
+      body.querySelectorAll(`tr[data-assignee-id="${change.id}"]`).forEach(row => {
+        row.querySelector('.task-assignee').textContent = change.op === 'delete' ? '' : change.data.name;
+      });
+    };
+
+    window.taskFeed = new EventSource(taskTable.dataset.streamUrl);
+    window.taskFeed.addEventListener('changes', e => {
+      const feed = JSON.parse(e.data);
+      if (feed.reset) {
+        location.reload();
+        return;
+      }
+      let tasksChanged = false;
+      feed.changes.forEach(change => {
+        if (change.entity === 'task') {
+          applyTask(change);
+          tasksChanged = true;
+        } else if (change.entity === 'member') {
+          applyMember(change);
+        }
+      });
+      if (tasksChanged) {
+        // Names and order may have changed: refresh numbering and predecessor names
+        [...body.rows].forEach((row, i) => {
+          row.querySelector('.task-no').textContent = i + 1;
+          const ids = row.dataset.preds ? row.dataset.preds.split(',') : [];
+          row.querySelector('.task-preds').textContent = predNames(ids);
+        });
+        if (window.ganttRefresh) window.ganttRefresh();
+      }
+    });
+  }
+
   const taskForm = document.getElementById('taskForm');
   if (taskForm) {
     taskForm.addEventListener('submit', (e) => {
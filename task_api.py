@@ -0,0 +1,85 @@
+"""Filtered, keyset-paginated task queries for the JSON API.
+
+Pages are ordered by ``(start_date, id)``, which the ``ix_tasks_start_date``
+index serves directly, and the cursor is the last key of the previous page,
+so fetching page N costs the same as fetching page 1.
+"""
+import base64
+from datetime import date
+
+from sqlalchemy import tuple_
+
+from models import db, Task, TaskDependency
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+STATUSES = ('complete', 'delayed', 'ongoing')
+
+
+def encode_cursor(start_date, task_id):
+    raw = f'{start_date.isoformat()}|{task_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return ``(start_date, id)``; raises ValueError for a bad cursor."""
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    day, task_id = raw.split('|')
+    return date.fromisoformat(day), int(task_id)
+
+
+def query_tasks(assignee_id=None, parent_id=None, start=None, end=None,
+                status=None, after=None, limit=DEFAULT_LIMIT, today=None):
+    """Return ``(tasks, next_cursor)`` for one page.
+
+    ``start``/``end`` select tasks overlapping that range; ``status`` is one
+    of ``STATUSES``; ``after`` is a cursor from a previous page.
+    """
+    today = today or date.today()
+    query = Task.query
+    if assignee_id is not None:
+        query = query.filter(Task.assignee_id == assignee_id)
+    if parent_id is not None:
+        query = query.filter(Task.parent_id == parent_id)
+    if start is not None:
+        query = query.filter(Task.end_date >= start)
+    if end is not None:
+        query = query.filter(Task.start_date <= end)
+    if status == 'complete':
+        query = query.filter(Task.progress == 100)
+    elif status == 'delayed':
+        query = query.filter(Task.progress < 100, Task.end_date < today)
+    elif status == 'ongoing':
+        query = query.filter(Task.progress < 100, Task.end_date >= today)
+    if after is not None:
+        query = query.filter(tuple_(Task.start_date, Task.id) > tuple_(*after))
+
+    tasks = query.order_by(Task.start_date, Task.id).limit(limit + 1).all()
+    more = len(tasks) > limit
+    tasks = tasks[:limit]
+    next_cursor = encode_cursor(tasks[-1].start_date, tasks[-1].id) if more else None
+    return tasks, next_cursor
+
+
+def serialize(tasks):
+    """Task dicts including predecessor ids, loaded with one query."""
+    preds = {t.id: [] for t in tasks}
+    if preds:
+        rows = (db.session.query(TaskDependency.successor_id, TaskDependency.predecessor_id)
+                .filter(TaskDependency.successor_id.in_(list(preds)))
+                .order_by(TaskDependency.predecessor_id))
+        for succ, pred in rows:
+            preds[succ].append(pred)
+    return [{
+        'id': t.id,
+        'name': t.name,
+        'start_date': t.start_date.isoformat(),
+        'end_date': t.end_date.isoformat(),
+        'progress': t.progress,
+        'remarks': t.remarks,
+        'assignee_id': t.assignee_id,
+        'parent_id': t.parent_id,
+        'is_milestone': bool(t.is_milestone),
+        'updated_at': t.updated_at.isoformat() if t.updated_at else None,
+        'predecessors': preds[t.id],
+    } for t in tasks]
@@ -0,0 +1,188 @@
+"""Batch task updates with predecessor diffing.
+
+A batch is a list of patches (``{"id": ..., <fields>}``).  All patches are
+validated together before anything is written, so a batch either applies
+completely or not at all.  Only fields that actually change are assigned,
+and predecessor sets are diffed against the stored rows so that unchanged
+dependencies are never deleted and re-inserted.
+"""
+from collections import Counter
+from datetime import date
+
+from sqlalchemy import insert, tuple_
+
+from models import db, Task, TaskDependency, Member
+import scheduling
+import changes
+
+MAX_BATCH = 5000
+FIELDS = ('name', 'start_date', 'end_date', 'remarks', 'progress',
+          'assignee_id', 'parent_id', 'is_milestone')
+
+
+def current_predecessors(task_ids):
+    """``{successor_id: set(predecessor_ids)}`` for ``task_ids``."""
+    preds = {task_id: set() for task_id in task_ids}
+    ids = list(task_ids)
+    for start in range(0, len(ids), 500):
+        rows = (db.session.query(TaskDependency.successor_id, TaskDependency.predecessor_id)
+                .filter(TaskDependency.successor_id.in_(ids[start:start + 500])))
+        for succ, pred in rows:
+            preds[succ].add(pred)
+    return preds
+
+
+def sync_predecessors(new_sets, current=None):
+    """Make each task's predecessors equal ``new_sets[task_id]``.
+
+    Only the difference is written: one DELETE for removed links and one
+    ``executemany`` INSERT for added ones.  Returns ``{task_id: (added,
+    removed)}`` with sorted id lists.
+    """
+    if current is None:
+        current = current_predecessors(new_sets)
+    removed, added, diff = [], [], {}
+    for task_id, new in new_sets.items():
+        old = current.get(task_id, set())
+        gone, new_links = sorted(old - new), sorted(new - old)
+        removed.extend((pred, task_id) for pred in gone)
+        added.extend({'predecessor_id': pred, 'successor_id': task_id} for pred in new_links)
+        diff[task_id] = (new_links, gone)
+    for start in range(0, len(removed), 500):
+        (TaskDependency.query
+         .filter(tuple_(TaskDependency.predecessor_id, TaskDependency.successor_id)
+                 .in_(removed[start:start + 500]))
+         .delete(synchronize_session=False))
+    if added:
+        db.session.execute(insert(TaskDependency), added)
+    changes.record('task', [task_id for task_id, (new, gone) in diff.items() if new or gone])
+    return diff
+
+
+def _parse(patch, field):
+    value = patch[field]
+    if field == 'name':
+        value = str(value or '').strip()
+        if not value:
+            raise ValueError('name must not be empty')
+    elif field in ('start_date', 'end_date'):
+        value = date.fromisoformat(str(value))
+    elif field == 'progress':
+        value = int(value)
+        if not 0 <= value <= 100:
+            raise ValueError('progress must be between 0 and 100')
+    elif field in ('assignee_id', 'parent_id'):
+        value = int(value) if value not in (None, '') else None
+    elif field == 'is_milestone':
+        value = bool(value)
+    return value
+
+
+def apply_batch(patches):
+    """Validate and apply ``patches``; the caller commits on success.
+
+    Returns ``(ok, results)`` where ``results`` has one entry per patch.
+    When ``ok`` is False nothing was written.
+    """
+    results = [{'index': i} for i in range(len(patches))]
+    ids = []
+    for result, patch in zip(results, patches):
+        if not isinstance(patch, dict):
+            result['error'] = 'patch must be an object'
+            continue
+        try:
+            result['id'] = int(patch['id'])
+            ids.append(result['id'])
+        except (KeyError, TypeError, ValueError):
+            result['error'] = 'id is required'
+    duplicates = {i for i, n in Counter(ids).items() if n > 1}
+    if duplicates:
+        for result in results:
+            if result.get('id') in duplicates:
+                result['error'] = 'duplicate id'
+        return False, results
+
+    tasks = {t.id: t for t in Task.query.filter(Task.id.in_(ids))} if ids else {}
+    referenced = set()
+    for patch in patches:
+        if isinstance(patch, dict) and isinstance(patch.get('predecessors'), list):
+            referenced.update(int(p) for p in patch['predecessors'] if str(p).isdigit())
+    task_ids = set(tasks)
+    missing = referenced - task_ids
+    if missing:
+        task_ids |= {i for (i,) in db.session.query(Task.id).filter(Task.id.in_(missing))}
+    member_ids = {i for (i,) in db.session.query(Member.id)}
+
+    updates, pred_sets = {}, {}
+    for result, patch in zip(results, patches):
+        if 'error' in result:
+            continue
+        task = tasks.get(result['id'])
+        if task is None:
+            result['error'] = 'task not found'
+            continue
+        try:
+            values = {f: _parse(patch, f) for f in FIELDS if f in patch}
+            start = values.get('start_date', task.start_date)
+            end = values.get('end_date', task.end_date)
+            if values.get('is_milestone', task.is_milestone):
+                end = values['end_date'] = start
+            if end < start:
+                raise ValueError('end_date is before start_date')
+            if values.get('assignee_id') is not None and values['assignee_id'] not in member_ids:
+                raise ValueError('unknown assignee')
+            if values.get('parent_id') is not None and values['parent_id'] not in task_ids:
+                raise ValueError('unknown parent')
+            if values.get('parent_id') == task.id:
+                raise ValueError('task cannot be its own parent')
+            if 'predecessors' in patch:
+                if not isinstance(patch['predecessors'] or [], list):
+                    raise ValueError('predecessors must be a list')
+                preds = {int(p) for p in patch['predecessors'] or ()}
+                if preds - task_ids:
+                    raise ValueError(f'unknown predecessors {sorted(preds - task_ids)}')
+                pred_sets[task.id] = preds - {task.id}
+        except (TypeError, ValueError) as e:
+            result['error'] = str(e)
+            continue
+        updates[task.id] = {f: v for f, v in values.items() if getattr(task, f) != v}
+
+    if any('error' in r for r in results):
+        return False, results
+
+    # Check the combined dependency graph once for the whole batch
+    schedule = None
+    try:
+        schedule = scheduling.with_changes(
+            {task_id: (vals.get('start_date', tasks[task_id].start_date),
+                       scheduling.task_duration(vals.get('start_date', tasks[task_id].start_date),
+                                                vals.get('end_date', tasks[task_id].end_date),
+                                                vals.get('is_milestone', tasks[task_id].is_milestone)))
+             for task_id, vals in updates.items() if vals},
+            {task_id: preds | ({tasks[task_id].depends_on_id} if tasks[task_id].depends_on_id else set())
+             for task_id, preds in pred_sets.items()})
+    except scheduling.CycleError as e:
+        # A cycle that predates this batch does not block it
+        if any(n in pred_sets for n in e.cycle):
+            for result in results:
+                if result['id'] in e.cycle:
+                    result['error'] = str(e)
+            return False, results
+
+    for task_id, values in updates.items():
+        for field, value in values.items():
+            setattr(tasks[task_id], field, value)
+    diff = sync_predecessors(pred_sets) if pred_sets else {}
+    db.session.flush()
+
+    for result in results:
+        task_id = result['id']
+        added, removed = diff.get(task_id, ([], []))
+        result['changed'] = sorted(updates[task_id])
+        result['predecessors_added'] = added
+        result['predecessors_removed'] = removed
+        result['status'] = 'updated' if (updates[task_id] or added or removed) else 'unchanged'
+    if schedule is not None:
+        # Published only once the caller's commit succeeds; a rollback drops it
+        scheduling.store(schedule)
+    return True, results
@@ -0,0 +1,34 @@
+"""Cheap data version for the active project.
+
+The version changes whenever a task is added, edited or deleted and
+whenever dependencies are added or removed.  Every such write appends to
+``change_log`` in its transaction (bulk writes through
+``changes.record()``), and log ids only grow, so the newest log id is the
+main component; the task count and last ``updated_at`` are kept for writes
+made outside the application.  All parts are indexed lookups, so the
+version is far cheaper than loading the data it describes and can be used
+for ETags and cache keys.
+"""
+import hashlib
+
+from sqlalchemy import func
+
+from models import db, Task, ChangeLog
+
+
+def project_version():
+    """Return a short string identifying the current project data."""
+    task_count, last_update = db.session.query(func.count(Task.id), func.max(Task.updated_at)).one()
+    last_change = db.session.query(func.max(ChangeLog.id)).scalar()
+    raw = f'{task_count}:{last_update}:{last_change}'
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+def has_pending_writes(session=None):
+    """True once the project transaction has written something.
+
+    Versions read at that point describe data that is not committed yet.
+    """
+    session = session or db.session()
+    # pysqlite only opens the transaction before the first DML statement
+    return session.connection().connection.dbapi_connection.in_transaction
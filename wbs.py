@@ -0,0 +1,276 @@
+"""Work breakdown structure built from ``Task.parent_id``.
+
+``tree()`` loads the whole hierarchy with one recursive CTE and returns the
+tasks in depth-first order (siblings by ``(start_date, id)``) with their
+depth and subtree roll-up.  A parent's dates span its subtree and its
+progress is the duration-weighted progress of the leaf tasks below it;
+milestones weigh nothing.
+
+Roll-ups are materialized in ``wbs_rollups``, one row per task.  After each
+flush the changed tasks and their ancestor chains (old and new, when a task
+moves) are recomputed from their children's rows, so editing a leaf costs
+O(depth) small queries.  Bulk statements on ``tasks`` bypass the unit of
+work: a primary-key bulk UPDATE of dates or progress refreshes the ancestors
+of the rows it names, statements that set no roll-up column are ignored, and
+anything else marks the table for a full rebuild just before the
+transaction commits.  Readers never write; a table left empty by an old
+migration is rolled up in memory until the next write fills it.
+
+Tasks caught in a ``parent_id`` cycle are unreachable from any root.  They
+are listed after the tree, each group under one of its tasks promoted to a
+root, so damaged data stays visible.
+"""
+from sqlalchemy import event, select, func, literal, delete, exists, inspect
+from sqlalchemy.dialects.sqlite import insert
+
+from models import db, Task, WbsRollup
+from routing import RoutingSession
+from scheduling import task_duration
+
+# Guards against parent_id cycles in damaged data
+MAX_DEPTH = 64
+# Task columns that feed the roll-ups
+ROLLUP_COLUMNS = {'start_date', 'end_date', 'progress', 'is_milestone', 'parent_id'}
+
+_rollups = WbsRollup.__table__
+
+
+def _progress(work, done, own_progress):
+    if work:
+        return int(round(done / work * 100))
+    return own_progress
+
+
+def _connection(session):
+    return session.connection(bind_arguments={'mapper': WbsRollup})
+
+
+def _tree_query():
+    """Recursive CTE yielding ``(id, depth, path)`` in depth-first order."""
+    parent = db.aliased(Task)
+    # Paths sort siblings by (start_date, id) and put parents before children
+    path = func.printf('%s%010d', Task.start_date, Task.id)
+    roots = (select(Task.id, literal(0).label('depth'), path.label('path'))
+             .where(~exists().where(parent.id == Task.parent_id)))
+    cte = roots.cte('wbs', recursive=True)
+    cte = cte.union_all(
+        select(Task.id, cte.c.depth + 1,
+               func.printf('%s/%s%010d', cte.c.path, Task.start_date, Task.id))
+        .join(cte, Task.parent_id == cte.c.id)
+        .where(cte.c.depth < MAX_DEPTH))
+    return cte
+
+
+def _order(session):
+    """``(task_id, depth)`` pairs in depth-first order, covering every task."""
+    cte = _tree_query()
+    rows = session.execute(
+        select(cte.c.id, cte.c.depth, select(func.count(Task.id)).scalar_subquery())
+        .order_by(cte.c.path)).all()
+    if not rows or len(rows) == rows[0][2]:
+        return [(task_id, depth) for task_id, depth, _ in rows]
+    order = [(task_id, depth) for task_id, depth, _ in rows]
+    return order + _unreached(session, {task_id for task_id, _ in order})
+
+
+def _unreached(session, reached):
+    """Depth-first order of the tasks the tree query could not reach."""
+    tasks = session.execute(select(Task.id, Task.parent_id, Task.start_date)).all()
+    children = {}
+    for task_id, parent_id, start in tasks:
+        children.setdefault(parent_id, []).append((start, task_id))
+    rest = sorted((start, task_id, parent_id) for task_id, parent_id, start in tasks
+                  if task_id not in reached)
+    # Below-limit subtrees hang off a reached parent; cycles get a promoted root
+    roots = [r for r in rest if r[2] in reached] + [r for r in rest if r[2] not in reached]
+    order, seen = [], set(reached)
+    for _, root, _ in roots:
+        stack = [(root, 0)]
+        while stack:
+            task_id, depth = stack.pop()
+            if task_id in seen:
+                continue
+            seen.add(task_id)
+            order.append((task_id, depth))
+            stack.extend((c, depth + 1) for _, c in sorted(children.get(task_id, ()), reverse=True))
+    return order
+
+
+def _compute(session):
+    """Roll-up rows for every task, in one pass over the tree."""
+    order = _order(session)
+    tasks = {row[0]: row for row in session.execute(
+        select(Task.id, Task.parent_id, Task.start_date, Task.end_date,
+               Task.progress, Task.is_milestone))}
+
+    # Children follow their parent in depth-first order, so walking the
+    # list backwards folds every subtree before its root is reached.
+    totals, entries = {}, []
+    for task_id, _ in reversed(order):
+        _, parent_id, start, end, progress, milestone = tasks[task_id]
+        own = totals.pop(task_id, None)
+        if own is None:
+            work = task_duration(start, end, milestone)
+            own = [start, end, work, work * progress / 100]
+        entries.append({'task_id': task_id, 'start_date': own[0], 'end_date': own[1],
+                        'work': own[2], 'done': own[3],
+                        'progress': _progress(own[2], own[3], progress)})
+        if parent_id is not None:
+            total = totals.get(parent_id)
+            if total is None:
+                totals[parent_id] = list(own)
+            else:
+                total[0] = min(total[0], own[0])
+                total[1] = max(total[1], own[1])
+                total[2] += own[2]
+                total[3] += own[3]
+    return entries
+
+
+def rebuild(session=None):
+    """Recompute every roll-up from scratch in one pass over the tree."""
+    session = session or db.session
+    entries = _compute(session)
+    connection = _connection(session)
+    connection.execute(delete(_rollups))
+    for start in range(0, len(entries), 1000):
+        connection.execute(_rollups.insert(), entries[start:start + 1000])
+    return len(entries)
+
+
+def _recompute(connection, task_ids):
+    """Recompute roll-ups for ``task_ids``; returns their parent ids."""
+    child = db.aliased(Task)
+    rows = connection.execute(
+        select(Task.id, Task.parent_id, Task.start_date, Task.end_date, Task.progress,
+               Task.is_milestone, func.count(child.id), func.min(_rollups.c.start_date),
+               func.max(_rollups.c.end_date), func.sum(_rollups.c.work), func.sum(_rollups.c.done))
+        .select_from(Task)
+        .outerjoin(child, child.parent_id == Task.id)
+        .outerjoin(_rollups, _rollups.c.task_id == child.id)
+        .where(Task.id.in_(task_ids))
+        .group_by(Task.id)).all()
+    entries, parents = [], set()
+    for task_id, parent_id, start, end, progress, milestone, children, c_start, c_end, work, done in rows:
+        if children and c_start is not None:
+            start, end, work, done = c_start, c_end, work, done
+        else:
+            work = task_duration(start, end, milestone)
+            done = work * progress / 100
+        entries.append({'task_id': task_id, 'start_date': start, 'end_date': end,
+                        'work': work, 'done': done, 'progress': _progress(work, done, progress)})
+        if parent_id is not None:
+            parents.add(parent_id)
+    if entries:
+        stmt = insert(_rollups)
+        connection.execute(stmt.on_conflict_do_update(
+            index_elements=[_rollups.c.task_id],
+            set_={c: stmt.excluded[c] for c in ('start_date', 'end_date', 'work', 'done', 'progress')}),
+            entries)
+    return parents
+
+
+def update_ancestors(connection, task_ids, deleted=()):
+    """Refresh ``task_ids`` and their ancestors; drop rows for ``deleted``."""
+    if deleted:
+        connection.execute(delete(_rollups).where(_rollups.c.task_id.in_(list(deleted))))
+    frontier = set(task_ids) - set(deleted)
+    for _ in range(MAX_DEPTH + 1):
+        if not frontier:
+            break
+        # A node reached twice is simply recomputed again from fresher children
+        frontier = _recompute(connection, list(frontier))
+
+
+def _is_empty(connection):
+    return connection.execute(select(_rollups.c.task_id).limit(1)).first() is None
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _after_flush(session, flush_context):
+    touched, deleted = set(), set()
+    for obj in (*session.new, *session.dirty):
+        if isinstance(obj, Task):
+            touched.add(obj.id)
+            # A task moved to another parent also changes its old ancestors
+            touched.update(p for p in inspect(obj).attrs.parent_id.history.deleted if p)
+    for obj in session.deleted:
+        if isinstance(obj, Task):
+            deleted.add(obj.id)
+            old = inspect(obj).attrs.parent_id.history
+            touched.update(p for p in (*old.unchanged, *old.deleted) if p)
+    if not (touched or deleted) or session.info.get('wbs_stale'):
+        return
+    connection = _connection(session)
+    if _is_empty(connection):
+        session.info['wbs_stale'] = True
+    else:
+        update_ancestors(connection, touched, deleted)
+
+
+def _set_columns(orm_execute_state):
+    """Names of the columns a bulk UPDATE sets."""
+    names = {getattr(c, 'key', c) for c in orm_execute_state.statement._values or ()}
+    parameters = orm_execute_state.parameters
+    for params in parameters if isinstance(parameters, (list, tuple)) else [parameters or {}]:
+        names.update(params)
+    return names
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _bulk_statement(orm_execute_state):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete) \
+            or orm_execute_state.bind_mapper is None \
+            or orm_execute_state.bind_mapper.class_ is not Task:
+        return None
+    session = orm_execute_state.session
+    if orm_execute_state.is_update:
+        columns = _set_columns(orm_execute_state)
+        if not columns & ROLLUP_COLUMNS:
+            return None
+        parameters = orm_execute_state.parameters
+        if 'parent_id' not in columns and isinstance(parameters, list) \
+                and all('id' in p for p in parameters) and not session.info.get('wbs_stale'):
+            # Bulk UPDATE by primary key (e.g. rescheduled successors)
+            result = orm_execute_state.invoke_statement()
+            connection = _connection(session)
+            if _is_empty(connection):
+                session.info['wbs_stale'] = True
+            else:
+                update_ancestors(connection, {p['id'] for p in parameters})
+            return result
+    session.info['wbs_stale'] = True
+    return None
+
+
+@event.listens_for(RoutingSession, 'before_commit')
+def _rebuild_stale(session):
+    if session.info.get('wbs_stale'):
+        session.flush()
+        del session.info['wbs_stale']
+        rebuild(session)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _drop_stale(session):
+    session.info.pop('wbs_stale', None)
+
+
+def tree():
+    """Tasks in depth-first WBS order.
+
+    Returns ``(task, depth, rollup)`` tuples where ``rollup`` is the task's
+    ``WbsRollup``; roll-ups are computed in memory (and not stored) while
+    the table is empty.
+    """
+    order = _order(db.session)
+    tasks = {t.id: t for t in Task.query}
+    rollups = {} if _is_empty(_connection(db.session)) else {r.task_id: r for r in WbsRollup.query}
+    if len(rollups) < len(tasks):
+        rollups = {e['task_id']: WbsRollup(**e) for e in _compute(db.session)}
+    return [(tasks[task_id], depth, rollups[task_id]) for task_id, depth in order]
+
+
+def depths():
+    """``{task_id: depth}`` for every task."""
+    return dict(_order(db.session))
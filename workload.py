@@ -0,0 +1,131 @@
+"""Resource load matrix and over-allocation detection.
+
+Every scheduled task books its owner -- the assigned member or the linked
+resource -- at 100% on each day from ``start_date`` to ``end_date``.
+Summary tasks (tasks with children) and milestones add no load.
+
+The (owner x day) matrix is built without per-day loops: each task adds
++100 at its first day and -100 after its last day in a difference array,
+and one cumulative sum along the day axis yields the daily load.
+Over-allocated intervals are the runs where the load exceeds the owner's
+cap (``Resource.utilization``, or 100% for members).
+"""
+import itertools
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import exists, select, func, cast, Integer
+
+from models import db, Task, Member, Resource
+import burndown
+
+OWNERS = ('member', 'resource')
+# Load booked per task per day, in percent
+TASK_LOAD = 100
+
+
+def _owners(by):
+    if by == 'member':
+        rows = db.session.query(Member.id, Member.name).order_by(Member.name, Member.id).all()
+        return [(i, name, 100) for i, name in rows]
+    rows = (db.session.query(Resource.id, Resource.name, Resource.utilization)
+            .order_by(Resource.name, Resource.id).all())
+    return [(i, name, 100 if cap is None else cap) for i, name, cap in rows]
+
+
+def _bookings(by, start, end):
+    """``(owner, first_day, last_day)`` rows for tasks overlapping the range.
+
+    Day offsets from ``start`` are computed in SQL so no date objects are
+    built per row.
+    """
+    column = Task.assignee_id if by == 'member' else Task.resource_id
+    child = db.aliased(Task)
+    origin = func.julianday(start.isoformat())
+    query = (select(column,
+                    cast(func.julianday(Task.start_date) - origin, Integer),
+                    cast(func.julianday(Task.end_date) - origin, Integer))
+             .where(column.isnot(None), Task.is_milestone.isnot(True),
+                    Task.end_date >= start, Task.start_date <= end)
+             .where(~exists().where(child.parent_id == Task.id)))
+    return db.session.execute(query).all()
+
+
+def load_matrix(by='member', start=None, end=None):
+    """Return ``(owners, origin, load)``.
+
+    ``owners`` is a list of ``(id, name, cap)``; ``load`` is an int array of
+    shape ``(len(owners), days)`` with the booked percentage per day starting
+    at ``origin``.  ``start``/``end`` default to the project span.
+    """
+    if by not in OWNERS:
+        raise ValueError(f'unknown owner type: {by}')
+    if start is None or end is None:
+        span_start, span_end = burndown.project_span()
+        start = start or span_start
+        end = end or span_end
+    owners = _owners(by)
+    if start is None or end is None or start > end:
+        return owners, start, np.zeros((len(owners), 0), dtype=np.int32)
+
+    days = (end - start).days + 1
+    rows = _bookings(by, start, end)
+    bookings = np.fromiter(itertools.chain.from_iterable(rows), dtype=np.int64,
+                           count=3 * len(rows)).reshape(-1, 3)
+    diff = np.zeros((len(owners), days + 1), dtype=np.int32)
+    if len(bookings):
+        row = pd.Index([o[0] for o in owners]).get_indexer(bookings[:, 0])
+        first = bookings[:, 1].clip(0, days)
+        last = bookings[:, 2].clip(-1, days - 1) + 1
+        keep = (row >= 0) & (first < last)
+        # np.add.at accumulates repeated (row, day) pairs, unlike fancy assignment
+        np.add.at(diff, (row[keep], first[keep]), TASK_LOAD)
+        np.add.at(diff, (row[keep], last[keep]), -TASK_LOAD)
+    load = diff.cumsum(axis=1)[:, :days]
+    return owners, start, load
+
+
+def overallocations(owners, origin, load):
+    """Runs of days where an owner's load exceeds their cap.
+
+    Returns dicts with ``owner_id``, ``name``, ``start``, ``end`` (inclusive,
+    ISO dates), ``days`` and ``peak`` (highest load in the run).
+    """
+    if not owners or load.shape[1] == 0:
+        return []
+    caps = np.array([o[2] for o in owners], dtype=np.int32)
+    over = load > caps[:, None]
+    # +1 where a run starts, -1 one past where it ends
+    edges = np.diff(np.pad(over.astype(np.int8), ((0, 0), (1, 1))), axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    if not len(rows):
+        return []
+    # Both nonzero() scans are row-major, so starts and ends pair up in order.
+    # Peaks come from one reduceat over the flattened (row, day) positions.
+    width = load.shape[1] + 1
+    flat = np.pad(load, ((0, 0), (0, 1))).ravel()
+    bounds = np.column_stack([rows * width + starts, rows * width + ends]).ravel()
+    peaks = np.maximum.reduceat(flat, bounds)[::2]
+    return [{
+        'owner_id': owners[r][0],
+        'name': owners[r][1],
+        'start': (origin + timedelta(days=int(s))).isoformat(),
+        'end': (origin + timedelta(days=int(e) - 1)).isoformat(),
+        'days': int(e - s),
+        'peak': int(p),
+    } for r, s, e, p in zip(rows.tolist(), starts.tolist(), ends.tolist(), peaks.tolist())]
+
+
+def heatmap(by='member', start=None, end=None):
+    """Load matrix and over-allocations as a JSON-ready dict."""
+    owners, origin, load = load_matrix(by, start, end)
+    return {
+        'by': by,
+        'origin': origin.isoformat() if origin else None,
+        'days': int(load.shape[1]),
+        'owners': [{'id': i, 'name': name, 'cap': cap} for i, name, cap in owners],
+        'load': load.tolist(),
+        'overallocations': overallocations(owners, origin, load),
+    }